@@ -9,10 +9,67 @@ class Config:
     managers: List[int]     # Список ID всех менеджеров
     admin_manager_id: int   # ID главного менеджера (администратора)
 
+    # Состояние навигации по каталогу
+    nav_state_max_entries: int = 10000      # Максимум пользователей в памяти (LRU)
+    nav_state_ttl: float = 1800.0           # Сброс выбора после N секунд бездействия
+    nav_state_backend: str = "memory"       # "memory" или "sqlite" (сохраняется между перезапусками)
+    nav_state_flush_interval: float = 1.0   # Период пакетной записи выбора в базу (сек)
+
+    # Очередь исходящих сообщений (лимиты Telegram)
+    send_global_rate: float = 30.0          # Максимум сообщений в секунду для всего бота
+    send_chat_rate: float = 1.0             # Максимум сообщений в секунду в один чат
+    send_chat_burst: int = 3                # Сообщений в чат подряд без ожидания
+    send_max_retries: int = 3               # Повторы отправки после 429 и сетевых ошибок
+    send_workers: int = 8                   # Одновременно выполняемых запросов к Telegram
+    send_max_pending: int = 1000            # Размер очереди, после которого отправители ждут
+
+    # Получение обновлений
+    mode: str = "polling"                   # "polling" или "webhook"
+    telegram_api_url: str = ""              # Свой сервер Bot API (например, utils.fake_telegram)
+    webhook_url: str = ""                   # Публичный адрес webhook (регистрируется при запуске)
+    webhook_path: str = "/webhook"
+    webhook_secret: str = ""                # Значение заголовка X-Telegram-Bot-Api-Secret-Token
+    webhook_host: str = "0.0.0.0"
+    webhook_port: int = 8080
+    webhook_workers: int = 32               # Одновременно обрабатываемых обновлений
+    webhook_drain_timeout: float = 30.0     # Ожидание обработки принятых обновлений при остановке (сек)
+
+    # Многопроцессный режим (utils.sharding)
+    shard_workers: int = 1                  # Процессов-обработчиков; 1 - обработка в одном процессе
+    shard_index: int = -1                   # Номер процесса-обработчика (задает процесс-приемник)
+    shard_socket: str = ""                  # Unix-сокет процесса-приемника
+
 
 @dataclass
 class DatabaseConfig:
     database: str = "support_bot.db"
+    pool_size: int = 5                          # Максимум одновременно открытых соединений
+    statement_cache_size: int = 128             # Размер кэша подготовленных выражений на соединение
+    pool_health_check_interval: float = 30.0    # Проверять соединение, если оно простаивало дольше (сек)
+    pool_timeout: float = 10.0                  # Ожидание свободного соединения / блокировки (сек)
+
+    # Профиль хранения SQLite
+    journal_mode: str = "WAL"                   # WAL: запись не блокирует чтение
+    synchronous: str = "NORMAL"                 # В режиме WAL fsync только при checkpoint
+    cache_size: int = -16000                    # Отрицательное значение - размер кэша в КиБ
+    mmap_size: int = 268435456                  # 256 МиБ отображаемой в память базы
+    temp_store: str = "MEMORY"                  # Временные таблицы и индексы в памяти
+    wal_autocheckpoint: int = 1000              # Автоматический checkpoint каждые N страниц WAL
+    checkpoint_interval: float = 300.0          # Фоновый checkpoint раз в N секунд (0 - отключить)
+    strict_query_plans: bool = False            # Проверять планы горячих запросов при каждом запуске и не запускаться при ошибке
+
+    # Кэш справочных данных (города, улицы, точки, каталог)
+    reference_cache_ttl: float = 3600.0         # Время жизни записи кэша (сек)
+
+    # Пакетная запись сообщений
+    journal_flush_interval: float = 0.05        # Максимальная задержка записи сообщения (сек, 0 - без журнала)
+    journal_max_batch: int = 200                # Запись пакета сразу при накоплении N операций
+
+    # Архив сообщений закрытых чатов (отдельный файл базы)
+    archive_database: str = ""                  # Файл архива (по умолчанию <database>_archive.db)
+    archive_after_days: float = 30.0            # Переносить историю чатов, закрытых N дней назад (0 - не переносить)
+    archive_interval: float = 3600.0            # Проверка чатов для архивации раз в N секунд
+    archive_batch: int = 50                     # Чатов за одну транзакцию переноса
 
 
 @dataclass
@@ -45,7 +102,42 @@ def load_config() -> TgBot:
         config=Config(
             token=env.str("BOT_TOKEN"),
             managers=managers_ids,
-            admin_manager_id=admin_id
+            admin_manager_id=admin_id,
+            nav_state_max_entries=env.int("NAV_STATE_MAX_ENTRIES", 10000),
+            nav_state_ttl=env.float("NAV_STATE_TTL", 1800.0),
+            nav_state_backend=env.str("NAV_STATE_BACKEND", "memory"),
+            nav_state_flush_interval=env.float("NAV_STATE_FLUSH_INTERVAL", 1.0),
+            send_global_rate=env.float("SEND_GLOBAL_RATE", 30.0),
+            send_chat_rate=env.float("SEND_CHAT_RATE", 1.0),
+            send_chat_burst=env.int("SEND_CHAT_BURST", 3),
+            send_max_retries=env.int("SEND_MAX_RETRIES", 3),
+            send_workers=env.int("SEND_WORKERS", 8),
+            send_max_pending=env.int("SEND_MAX_PENDING", 1000),
+            mode=env.str("BOT_MODE", "polling"),
+            telegram_api_url=env.str("TELEGRAM_API_URL", ""),
+            webhook_url=env.str("WEBHOOK_URL", ""),
+            webhook_path=env.str("WEBHOOK_PATH", "/webhook"),
+            webhook_secret=env.str("WEBHOOK_SECRET", ""),
+            webhook_host=env.str("WEBHOOK_HOST", "0.0.0.0"),
+            webhook_port=env.int("WEBHOOK_PORT", 8080),
+            webhook_workers=env.int("WEBHOOK_WORKERS", 32),
+            webhook_drain_timeout=env.float("WEBHOOK_DRAIN_TIMEOUT", 30.0),
+            shard_workers=env.int("SHARD_WORKERS", 1),
+            shard_index=env.int("SHARD_INDEX", -1),
+            shard_socket=env.str("SHARD_SOCKET", "")
         ),
-        db=DatabaseConfig()
+        db=DatabaseConfig(
+            pool_size=env.int("DB_POOL_SIZE", 5),
+            statement_cache_size=env.int("DB_STATEMENT_CACHE_SIZE", 128),
+            pool_health_check_interval=env.float("DB_POOL_HEALTH_CHECK_INTERVAL", 30.0),
+            pool_timeout=env.float("DB_POOL_TIMEOUT", 10.0),
+            strict_query_plans=env.bool("DB_STRICT_QUERY_PLANS", False),
+            reference_cache_ttl=env.float("DB_REFERENCE_CACHE_TTL", 3600.0),
+            journal_flush_interval=env.float("DB_JOURNAL_FLUSH_INTERVAL", 0.05),
+            journal_max_batch=env.int("DB_JOURNAL_MAX_BATCH", 200),
+            archive_database=env.str("DB_ARCHIVE_DATABASE", ""),
+            archive_after_days=env.float("DB_ARCHIVE_AFTER_DAYS", 30.0),
+            archive_interval=env.float("DB_ARCHIVE_INTERVAL", 3600.0),
+            archive_batch=env.int("DB_ARCHIVE_BATCH", 50)
+        )
     )
\ No newline at end of file
@@ -1,25 +1,402 @@
+import asyncio
+import os
+import re
 import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
 from typing import Optional, List, Tuple
 from utils.logger import logger
-import threading
+from utils.db_pool import ConnectionPool, WalCheckpointer
+from utils.archiver import MessageArchiver
+from utils.cache import ReferenceCache, cached_reference
+from utils.catalog_index import CatalogIndex
+from utils.message_journal import MessageJournal
+from utils.pending_queue import PendingChatQueue
+from utils.chat_assigner import ChatAssigner
+from utils.chat_routing import ChatRoutingTable
+from utils.migrations import (
+    MIGRATIONS, LATEST_VERSION, HOT_QUERIES, ARCHIVE_SCHEMA, ARCHIVE_COLUMNS, MESSAGE_HISTORY,
+    MANAGER_STATS_PERIODS
+)
+from config import DatabaseConfig
+
+
+def write_method(method):
+    """Отметка метода Database, изменяющего данные
+
+    Такие методы AsyncDatabase выполняет в единственном потоке-писателе,
+    остальные - в пуле потоков-читателей.
+    """
+    method._writes = True
+    return method
 
 
 class Database:
-    def __init__(self, db_file: str):
+    def __init__(self, db_file: str, db_config: Optional[DatabaseConfig] = None):
         self.db_file = db_file
-        self._local = threading.local()
+        self.db_config = db_config or DatabaseConfig(database=db_file)
+        self.archive_file = self.db_config.archive_database or f"{os.path.splitext(db_file)[0]}_archive.db"
+        self._pool = ConnectionPool(
+            db_file,
+            max_size=self.db_config.pool_size,
+            statement_cache_size=self.db_config.statement_cache_size,
+            health_check_interval=self.db_config.pool_health_check_interval,
+            timeout=self.db_config.pool_timeout,
+            pragmas={
+                'synchronous': self.db_config.synchronous,
+                'cache_size': self.db_config.cache_size,
+                'mmap_size': self.db_config.mmap_size,
+                'temp_store': self.db_config.temp_store,
+                'wal_autocheckpoint': self.db_config.wal_autocheckpoint
+            },
+            attach={'archive': self.archive_file}
+        )
+        self._checkpointer = WalCheckpointer(self._pool, interval=self.db_config.checkpoint_interval)
+        self._archiver = MessageArchiver(
+            self,
+            after_days=self.db_config.archive_after_days,
+            interval=self.db_config.archive_interval,
+            batch=self.db_config.archive_batch
+        )
+        # Справочные данные (города, улицы, точки, каталог) читаются из памяти
+        self._reference_cache = ReferenceCache(ttl=self.db_config.reference_cache_ttl)
+        # Активные чаты клиент <-> менеджер для пересылки сообщений без запросов
+        self.routing = ChatRoutingTable()
+        # Очередь менеджеров по нагрузке для выбора и назначения чатов
+        self.assigner = ChatAssigner()
+        # Ожидающие чаты в порядке поступления
+        self.pending_queue = PendingChatQueue()
+        # Подписчики изменений состояния в памяти (см. subscribe_changes)
+        self._change_listeners = []
         logger.info(f"Initializing database: {db_file}")
-        self._create_tables()
+        self._configure_storage()
+        if self._run_migrations() or self.db_config.strict_query_plans:
+            # Схема изменилась - проверяем, что горячие запросы по-прежнему используют индексы
+            self._verify_query_plans()
+        self._rebuild_routing_table()
+        self._load_assigner()
+        self._load_pending_queue()
+        self._archiver.start()
+
+    def _verify_query_plans(self):
+        """Проверка планов горячих запросов при запуске
+
+        Если включен strict_query_plans, найденные проблемы останавливают
+        запуск (RuntimeError), иначе только записываются в журнал.
+        """
+        problems = self.check_query_plans()
+        for name, steps in problems.items():
+            logger.warning(f"Hot query plan check failed for {name}: {steps}")
+        if problems and self.db_config.strict_query_plans:
+            raise RuntimeError(f"Query plan check failed: {', '.join(problems)}")
 
     def _get_connection(self):
-        """Получение соединения для текущего потока"""
-        if not hasattr(self._local, 'connection'):
-            self._local.connection = sqlite3.connect(self.db_file)
-            self._local.cursor = self._local.connection.cursor()
-        return self._local.connection, self._local.cursor
+        """Получение соединения из пула для текущего потока"""
+        conn = self._pool.acquire()
+        return conn, conn.cursor()
+
+    def _release_connection(self, conn):
+        """Возврат соединения в пул"""
+        self._pool.release(conn)
+
+    def _configure_storage(self):
+        """Установка режима журнала, схемы архива и запуск фонового checkpoint для WAL"""
+        conn, cursor = self._get_connection()
+        try:
+            cursor.execute(f"PRAGMA journal_mode = {self.db_config.journal_mode}")
+            journal_mode = cursor.fetchone()[0]
+            logger.info(f"Database journal mode: {journal_mode}")
+            cursor.execute(f"PRAGMA archive.journal_mode = {self.db_config.journal_mode}")
+            cursor.execute("SELECT 1 FROM archive.sqlite_master WHERE name = 'messages_fts'")
+            archive_indexed = cursor.fetchone() is not None
+            for statement in ARCHIVE_SCHEMA:
+                cursor.execute(statement)
+            if not archive_indexed:
+                # Архив, созданный до полнотекстового индекса, индексируется один раз
+                cursor.execute("INSERT INTO archive.messages_fts (messages_fts) VALUES ('rebuild')")
+            cursor.execute("PRAGMA archive.table_info(messages)")
+            archive_columns = {row[1] for row in cursor.fetchall()}
+            for column, column_type, index in ARCHIVE_COLUMNS:
+                if column not in archive_columns:
+                    cursor.execute(f"ALTER TABLE archive.messages ADD COLUMN {column} {column_type}")
+                cursor.execute(index)
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error configuring database storage: {e}")
+            return
+        finally:
+            self._release_connection(conn)
+
+        if journal_mode.lower() == 'wal':
+            self._checkpointer.start()
+
+    def checkpoint_wal(self, mode: str = "PASSIVE") -> Optional[tuple]:
+        """Принудительный checkpoint журнала WAL
+
+        Args:
+            mode: Режим checkpoint ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE')
+
+        Returns:
+            tuple: (busy, log_frames, checkpointed_frames) или None при ошибке
+        """
+        return self._checkpointer.checkpoint(mode)
+
+    def get_reference_cache_stats(self) -> dict:
+        """Получение статистики кэша справочных данных
+
+        Returns:
+            dict: Попадания, промахи, доля попаданий и версии групп кэша
+        """
+        return self._reference_cache.stats()
+
+    def invalidate_reference_cache(self, group: Optional[str] = None):
+        """Сброс кэша справочников после изменения данных в обход бота
+
+        Args:
+            group: 'contacts' или 'catalog'; без аргумента сбрасывается весь кэш
+        """
+        if group is None:
+            self._reference_cache.clear()
+            for name in ('contacts', 'catalog'):
+                self._publish('cache', name)
+        else:
+            self._invalidate_reference(group)
+
+    def _invalidate_reference(self, group: str):
+        self._reference_cache.invalidate(group)
+        self._publish('cache', group)
+
+    def subscribe_changes(self, listener):
+        """Подписка на изменения данных, которые дублируются в памяти
+
+        Слушатель вызывается после фиксации транзакции с аргументами
+        (kind, key): ('chat', client_id), ('manager', manager_id) или
+        ('cache', группа справочников). Используется для рассылки изменений
+        другим процессам, которые применяют их через apply_change().
+        Вызов происходит в потоке, выполнившем запись.
+        """
+        self._change_listeners.append(listener)
+
+    def _publish(self, kind: str, key):
+        for listener in self._change_listeners:
+            try:
+                listener(kind, key)
+            except Exception as e:
+                logger.error(f"Error in change listener: {e}")
+
+    def apply_change(self, kind: str, key):
+        """Применение изменения, сделанного другим процессом
+
+        Таблица маршрутизации, очередь ожидающих чатов, очередь менеджеров
+        и кэш справочников перечитываются из базы для указанного ключа.
+        """
+        if kind == 'cache':
+            self._reference_cache.invalidate(key)
+            return
+        conn, cursor = self._get_connection()
+        try:
+            if kind == 'manager':
+                self._refresh_assigner(cursor, key)
+            elif kind == 'chat':
+                cursor.execute(
+                    "SELECT username, status, manager_id, enqueued_at FROM chats WHERE client_id = ?",
+                    (key,)
+                )
+                row = cursor.fetchone()
+                username, status, manager_id, enqueued_at = row or (None, None, None, None)
+                if status == 'active':
+                    # Повторное назначение переключило бы выбранный менеджером чат
+                    if not self.routing.is_active(key) or self.routing.manager_of(key) != manager_id:
+                        self.routing.assign(key, manager_id)
+                elif self.routing.is_active(key):
+                    self.routing.release(key)
+                if status == 'pending':
+                    self.pending_queue.push(key, username, enqueued_at or time.time())
+                else:
+                    self.pending_queue.remove(key)
+        except sqlite3.Error as e:
+            logger.error(f"Error applying {kind} change for {key}: {e}")
+        finally:
+            self._release_connection(conn)
+
+    def get_routing_stats(self) -> dict:
+        """Получение статистики таблицы маршрутизации активных чатов"""
+        return self.routing.stats()
+
+    def get_assignment_stats(self) -> dict:
+        """Получение статистики назначения чатов менеджерам"""
+        return self.assigner.stats()
+
+    def get_checkpoint_stats(self) -> dict:
+        """Получение статистики фонового checkpoint
+
+        Returns:
+            dict: Количество запусков, занятых попыток и данные последнего checkpoint
+        """
+        return self._checkpointer.stats()
+
+    def get_archive_stats(self) -> dict:
+        """Получение статистики архивации истории закрытых чатов"""
+        return self._archiver.stats()
+
+    @write_method
+    def archive_closed_chats(self, closed_before: float, limit: int = 50) -> Tuple[int, int]:
+        """Перенос сообщений закрытых чатов в архивную базу
+
+        Сообщения до limit чатов, закрытых раньше closed_before (а также
+        закрытых до того, как время закрытия стало сохраняться), переносятся
+        в archive.messages. Если чат снова откроют, новые сообщения пишутся
+        в messages, а история читается из обеих баз.
+
+        В режиме WAL транзакция, изменяющая обе базы, не атомарна, поэтому
+        перенос идет двумя транзакциями, каждая изменяет одну базу:
+        1. копирование в архив (INSERT OR IGNORE, запись на диск с synchronous=FULL);
+        2. удаление из messages только тех сообщений, копия которых уже есть
+           в архиве, и отметка archived_at.
+        При сбое между ними сообщения временно видны в обеих базах, а
+        следующий запуск архивации выбирает те же чаты и завершает перенос.
+
+        Args:
+            closed_before: Время закрытия (unix time), раньше которого чат архивируется
+            limit: Максимум чатов за вызов
+
+        Returns:
+            Tuple[int, int]: Количество перенесенных чатов и сообщений
+        """
+        conn, cursor = self._get_connection()
+        try:
+            cursor.execute("PRAGMA archive.synchronous = FULL")
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute(
+                """
+                SELECT client_id FROM chats
+                WHERE status = 'closed' AND archived_at IS NULL AND (closed_at IS NULL OR closed_at < ?)
+                ORDER BY closed_at
+                LIMIT ?
+                """,
+                (closed_before, limit)
+            )
+            chat_ids = [row[0] for row in cursor.fetchall()]
+            if not chat_ids:
+                conn.rollback()
+                return 0, 0
+            for chat_id in chat_ids:
+                # OR IGNORE: сообщения, скопированные прерванным переносом, пропускаются
+                cursor.execute(
+                    """
+                    INSERT OR IGNORE INTO archive.messages
+                        (id, chat_id, sender_id, message_text, message_type, file_id, timestamp, is_read, session_id)
+                    SELECT id, chat_id, sender_id, message_text, message_type, file_id, timestamp, is_read, session_id
+                    FROM main.messages
+                    WHERE chat_id = ?
+                    """,
+                    (chat_id,)
+                )
+            conn.commit()
+
+            moved = 0
+            cursor.execute("BEGIN IMMEDIATE")
+            for chat_id in chat_ids:
+                cursor.execute(
+                    """
+                    DELETE FROM main.messages
+                    WHERE chat_id = ?1 AND id IN (SELECT id FROM archive.messages WHERE chat_id = ?1)
+                    """,
+                    (chat_id,)
+                )
+                moved += cursor.rowcount
+            # Чат, открытый заново между транзакциями, остается неархивированным
+            cursor.executemany(
+                "UPDATE chats SET archived_at = ? WHERE client_id = ? AND status = 'closed'",
+                [(time.time(), chat_id) for chat_id in chat_ids]
+            )
+            conn.commit()
+            return len(chat_ids), moved
+        except sqlite3.Error as e:
+            logger.error(f"Error archiving closed chats: {e}")
+            conn.rollback()
+            return 0, 0
+        finally:
+            self._release_connection(conn)
+
+    def _rebuild_routing_table(self):
+        """Восстановление таблицы маршрутизации из активных чатов"""
+        conn, cursor = self._get_connection()
+        try:
+            cursor.execute("SELECT client_id, manager_id FROM chats WHERE is_active = TRUE ORDER BY client_id")
+            self.routing.rebuild(cursor.fetchall())
+            logger.info(f"Chat routing table rebuilt: {self.routing.stats()['active_chats']} active chats")
+        except sqlite3.Error as e:
+            logger.error(f"Error rebuilding chat routing table: {e}")
+        finally:
+            self._release_connection(conn)
+
+    _MANAGER_LOAD_QUERY = """
+        SELECT id, active_chats, last_activity, is_active AND is_available
+        FROM managers
+    """
+
+    def _load_assigner(self):
+        """Заполнение очереди менеджеров из таблицы managers"""
+        conn, cursor = self._get_connection()
+        try:
+            cursor.execute(self._MANAGER_LOAD_QUERY)
+            self.assigner.load(cursor.fetchall())
+        except sqlite3.Error as e:
+            logger.error(f"Error loading chat assigner: {e}")
+        finally:
+            self._release_connection(conn)
+
+    def _load_pending_queue(self):
+        """Восстановление очереди ожидающих чатов"""
+        conn, cursor = self._get_connection()
+        try:
+            cursor.execute(
+                """
+                SELECT client_id, username, enqueued_at
+                FROM chats
+                WHERE status = 'pending'
+                ORDER BY enqueued_at, client_id
+                """
+            )
+            self.pending_queue.load(cursor.fetchall())
+        except sqlite3.Error as e:
+            logger.error(f"Error loading pending chat queue: {e}")
+        finally:
+            self._release_connection(conn)
+
+    def _refresh_assigner(self, cursor, manager_id: int):
+        """Обновление менеджера в очереди по только что записанной строке"""
+        cursor.execute(self._MANAGER_LOAD_QUERY + " WHERE id = ?", (manager_id,))
+        row = cursor.fetchone()
+        if row:
+            self.assigner.set_manager(*row)
+
+    def get_pool_stats(self) -> dict:
+        """Получение статистики пула соединений
+
+        Returns:
+            dict: Счетчики попаданий/промахов пула и число свободных соединений
+        """
+        return self._pool.stats()
+
+    def close(self):
+        """Остановка фоновых задач и закрытие всех соединений пула"""
+        self._archiver.stop()
+        self._checkpointer.stop()
+        if self.db_config.journal_mode.lower() == 'wal':
+            self._checkpointer.checkpoint("TRUNCATE")
+        self._pool.close()
 
     def _create_tables(self):
-        """Создание необходимых таблиц, если они еще не существуют"""
+        """Создание базовой схемы и приведение к ней неверсионированной базы
+
+        Выполняется миграцией только для базы с user_version = 0: создает
+        недостающие таблицы, добавляет поля, отсутствующие в старых версиях
+        таблиц chats и messages, и заполняет справочники.
+        """
         conn, cursor = self._get_connection()
         try:
             # Создаем таблицы только если они не существуют
@@ -353,7 +730,101 @@ class Database:
             logger.error(f"Database error: {e}")
             conn.rollback()
             raise
+        finally:
+            self._release_connection(conn)
+
+    def _run_migrations(self) -> bool:
+        """Применение версионированных миграций схемы
+
+        Текущая версия схемы хранится в PRAGMA user_version. Если схема уже
+        актуальна, миграции не выполняются вовсе. Неверсионированная база
+        (user_version = 0) сначала приводится к базовой схеме, затем каждая
+        миграция выполняется в отдельной транзакции вместе с обновлением версии.
+
+        Returns:
+            bool: True, если были применены миграции
+        """
+        conn, cursor = self._get_connection()
+        try:
+            cursor.execute("PRAGMA user_version")
+            current_version = cursor.fetchone()[0]
+
+            if current_version >= LATEST_VERSION:
+                if current_version > LATEST_VERSION:
+                    logger.warning(
+                        f"Database schema version {current_version} is newer than "
+                        f"supported version {LATEST_VERSION}"
+                    )
+                logger.info(f"Database schema is up to date (version {current_version})")
+                return False
+
+            if current_version == 0:
+                logger.info("Unversioned database, creating base schema")
+                self._create_tables()
+
+            for version, description, statements in MIGRATIONS:
+                if version <= current_version:
+                    continue
+                logger.info(f"Applying schema migration {version}: {description}")
+                cursor.execute("BEGIN")
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.execute(f"PRAGMA user_version = {version}")
+                conn.commit()
+                current_version = version
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error applying schema migration: {e}")
+            conn.rollback()
+            raise
+        finally:
+            self._release_connection(conn)
+
+    def check_query_plans(self) -> dict:
+        """Проверка планов выполнения горячих запросов
+
+        Выполняет EXPLAIN QUERY PLAN для запросов из HOT_QUERIES и ищет шаги,
+        которые сканируют таблицу целиком без индекса или сортируют строки
+        во временном дереве (USE TEMP B-TREE), а также индексы idx_*, которые
+        не использует ни один из этих запросов.
+
+        Returns:
+            dict: Имя запроса (или индекса) -> список найденных проблем.
+                  Пустой словарь, если все планы в порядке.
+        """
+        # Отдельное соединение без кэша выражений, чтобы план отражал текущую схему
+        conn = sqlite3.connect(self.db_file, cached_statements=0)
+        conn.execute("ATTACH DATABASE ? AS archive", (self.archive_file,))
+        cursor = conn.cursor()
+        try:
+            problems = {}
+            used_indexes = set()
+            for name, (query, params, *allowed) in HOT_QUERIES.items():
+                allowed = allowed[0] if allowed else ()
+                cursor.execute(f"EXPLAIN QUERY PLAN {query}", params)
+                details = [row[3] for row in cursor.fetchall()]
+                used_indexes.update(re.findall(r"INDEX (\w+)", " ".join(details)))
+                steps = [
+                    detail for detail in details
+                    if detail not in allowed and (
+                        (detail.startswith("SCAN ") and "INDEX" not in detail)
+                        or detail.startswith("USE TEMP B-TREE")
+                    )
+                ]
+                if steps:
+                    problems[name] = steps
+            for schema in ("main", "archive"):
+                cursor.execute(
+                    f"SELECT name FROM {schema}.sqlite_master WHERE type = 'index' AND name GLOB 'idx_*'"
+                )
+                for (index,) in cursor.fetchall():
+                    if index not in used_indexes:
+                        problems[index] = ["index is not used by any hot query"]
+            return problems
+        finally:
+            conn.close()
 
+    @cached_reference('contacts')
     def get_all_cities(self) -> list[str]:
         """Получение списка всех городов"""
         conn, cursor = self._get_connection()
@@ -366,8 +837,7 @@ class Database:
             logger.error(f"Error getting cities list: {e}")
             return []
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
 
     def get_city_by_id(self, city_id: int) -> Optional[str]:
         """Получение названия города по id"""
@@ -380,34 +850,258 @@ class Database:
             print(f"Ошибка получения города: {e}")
             return None
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
 
+    def _ensure_open_session(self, cursor, client_id: int, now: float):
+        """Начало нового обращения, если у клиента нет незакрытого
+
+        Обращения, перенесенные миграцией из старой схемы (is_legacy), не
+        продолжаются: следующее обращение клиента всегда новое.
+        Выполняется в транзакции вызывающего метода.
+        """
+        cursor.execute(
+            """
+            SELECT s.closed_at IS NULL AND NOT s.is_legacy
+            FROM chats c
+            JOIN sessions s ON s.id = c.current_session_id
+            WHERE c.client_id = ?
+            """,
+            (client_id,)
+        )
+        row = cursor.fetchone()
+        if row is not None and row[0]:
+            return
+        cursor.execute(
+            "INSERT INTO sessions (client_id, created_at) VALUES (?, ?) RETURNING id",
+            (client_id, now)
+        )
+        session_id = cursor.fetchone()[0]
+        cursor.execute(
+            "UPDATE chats SET current_session_id = ? WHERE client_id = ?",
+            (session_id, client_id)
+        )
+
+    def _record_manager_stats(self, cursor, manager_id: int, at: float,
+                              response_time: Optional[float] = None, **counters):
+        """Прибавление события обращения к статистике менеджера за час и день
+
+        Выполняется в транзакции вызывающего метода.
+
+        Args:
+            manager_id: ID менеджера
+            at: Время события (unix time)
+            response_time: Время ожидания принятого чата (сек); учитывается
+                как принятый чат, в сумме, минимуме и максимуме
+            counters: Приращения остальных счетчиков, например chats_closed=1
+                или rating_5=-1
+        """
+        if response_time is not None:
+            counters.update(chats_accepted=1, response_time_sum=response_time)
+        columns = list(counters)
+        moment = datetime.fromtimestamp(at)
+        for table, period, fmt in MANAGER_STATS_PERIODS:
+            cursor.execute(
+                f"""
+                INSERT INTO {table} ({period}, manager_id, {', '.join(columns)}, response_time_min, response_time_max)
+                VALUES (?, ?, {', '.join('?' * len(columns))}, ?, ?)
+                ON CONFLICT ({period}, manager_id) DO UPDATE SET
+                    {', '.join(f'{column} = {column} + excluded.{column}' for column in columns)},
+                    response_time_min = COALESCE(
+                        MIN(response_time_min, excluded.response_time_min), response_time_min, excluded.response_time_min
+                    ),
+                    response_time_max = COALESCE(
+                        MAX(response_time_max, excluded.response_time_max), response_time_max, excluded.response_time_max
+                    )
+                """,
+                (moment.strftime(fmt), manager_id, *counters.values(), response_time, response_time)
+            )
+
+    def _accept_session(self, cursor, client_id: int, manager_id: int):
+        """Отметка о принятии текущего обращения менеджером"""
+        now = time.time()
+        cursor.execute(
+            """
+            UPDATE sessions SET manager_id = ?, accepted_at = COALESCE(accepted_at, ?)
+            WHERE id = (SELECT current_session_id FROM chats WHERE client_id = ?)
+            RETURNING created_at, accepted_at
+            """,
+            (manager_id, now, client_id)
+        )
+        row = cursor.fetchone()
+        # Повторная активация уже принятого обращения в статистику не попадает
+        if row is not None and row[1] == now and row[0] is not None:
+            self._record_manager_stats(cursor, manager_id, now, response_time=now - row[0])
+
+    def _close_session(self, cursor, client_id: int, now: float):
+        """Отметка о закрытии текущего обращения"""
+        cursor.execute(
+            """
+            UPDATE sessions SET closed_at = ?
+            WHERE id = (SELECT current_session_id FROM chats WHERE client_id = ?) AND closed_at IS NULL
+            RETURNING manager_id, accepted_at
+            """,
+            (now, client_id)
+        )
+        row = cursor.fetchone()
+        # Без времени принятия длительность неизвестна - в статистику не попадает
+        if row is not None and row[0] is not None and row[1] is not None:
+            manager_id, accepted_at = row
+            self._record_manager_stats(cursor, manager_id, now, chats_closed=1, duration_sum=now - accepted_at)
+
+    _SESSION_COLUMNS = (
+        'id', 'client_id', 'manager_id', 'created_at', 'accepted_at', 'closed_at',
+        'rating', 'rating_comment', 'rated_at', 'is_legacy'
+    )
+
+    def _session_dict(self, row: Optional[tuple]) -> Optional[dict]:
+        if row is None:
+            return None
+        session = dict(zip(self._SESSION_COLUMNS, row))
+        session['is_legacy'] = bool(session['is_legacy'])
+        # Длительности обращения (сек) из сохраненных отметок времени;
+        # None, если какая-то из отметок неизвестна
+        session['wait_time'] = (
+            session['accepted_at'] - session['created_at']
+            if session['accepted_at'] is not None and session['created_at'] is not None else None
+        )
+        session['duration'] = (
+            session['closed_at'] - session['accepted_at']
+            if session['closed_at'] is not None and session['accepted_at'] is not None else None
+        )
+        return session
+
+    def get_session(self, session_id: int) -> Optional[dict]:
+        """Обращение по ID
+
+        Returns:
+            dict: Поля таблицы sessions, а также wait_time (ожидание принятия)
+                и duration (от принятия до закрытия) в секундах; None, если
+                обращение не найдено
+        """
+        conn, cursor = self._get_connection()
+        try:
+            cursor.execute(
+                f"SELECT {', '.join(self._SESSION_COLUMNS)} FROM sessions WHERE id = ?",
+                (session_id,)
+            )
+            return self._session_dict(cursor.fetchone())
+        except sqlite3.Error as e:
+            logger.error(f"Error getting session {session_id}: {e}")
+            return None
+        finally:
+            self._release_connection(conn)
+
+    def get_current_session(self, client_id: int) -> Optional[dict]:
+        """Текущее (последнее) обращение клиента, см. get_session()"""
+        conn, cursor = self._get_connection()
+        try:
+            cursor.execute(
+                f"""
+                SELECT {', '.join('s.' + column for column in self._SESSION_COLUMNS)}
+                FROM chats c
+                JOIN sessions s ON s.id = c.current_session_id
+                WHERE c.client_id = ?
+                """,
+                (client_id,)
+            )
+            return self._session_dict(cursor.fetchone())
+        except sqlite3.Error as e:
+            logger.error(f"Error getting current session for client {client_id}: {e}")
+            return None
+        finally:
+            self._release_connection(conn)
+
+    def get_current_session_id(self, client_id: int) -> Optional[int]:
+        """ID текущего обращения клиента или None"""
+        conn, cursor = self._get_connection()
+        try:
+            cursor.execute("SELECT current_session_id FROM chats WHERE client_id = ?", (client_id,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+        except sqlite3.Error as e:
+            logger.error(f"Error getting current session id for client {client_id}: {e}")
+            return None
+        finally:
+            self._release_connection(conn)
+
+    def get_client_sessions(self, client_id: int, limit: int = 10) -> List[dict]:
+        """Последние обращения клиента, от новых к старым, см. get_session()"""
+        conn, cursor = self._get_connection()
+        try:
+            cursor.execute(
+                f"""
+                SELECT {', '.join(self._SESSION_COLUMNS)}
+                FROM sessions
+                WHERE client_id = ?
+                ORDER BY id DESC
+                LIMIT ?
+                """,
+                (client_id, limit)
+            )
+            return [self._session_dict(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            logger.error(f"Error getting sessions for client {client_id}: {e}")
+            return []
+        finally:
+            self._release_connection(conn)
+
+    def get_session_history(self, session_id: int, limit: int = 50) -> list:
+        """Сообщения одного обращения (включая архив), от старых к новым"""
+        conn, cursor = self._get_connection()
+        try:
+            cursor.execute(
+                f"""
+                SELECT id, sender_id, message_text, message_type, file_id, timestamp, is_read
+                FROM {MESSAGE_HISTORY}
+                WHERE session_id = ?
+                ORDER BY id
+                LIMIT ?
+                """,
+                (session_id, limit)
+            )
+            return cursor.fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Error retrieving session history: {e}")
+            return []
+        finally:
+            self._release_connection(conn)
+
+    @write_method
     def create_chat(self, client_id: int, username: str) -> bool:
         """Создание или обновление чата"""
+        now = time.time()
         conn, cursor = self._get_connection()
         try:
             cursor.execute(
                 """
-                INSERT INTO chats (client_id, username, is_active, status) 
-                VALUES (?, ?, FALSE, 'pending')
+                INSERT INTO chats (client_id, username, is_active, status, enqueued_at) 
+                VALUES (?, ?, FALSE, 'pending', ?)
                 ON CONFLICT(client_id) DO UPDATE SET username = ?, status = CASE
                     WHEN status = 'closed' THEN 'pending'
                     ELSE status
+                END, enqueued_at = CASE
+                    WHEN status = 'closed' THEN excluded.enqueued_at
+                    ELSE enqueued_at
                 END
+                RETURNING status, enqueued_at
                 """,
-                (client_id, username, username)
+                (client_id, username, now, username)
             )
+            status, enqueued_at = cursor.fetchone()
+            self._ensure_open_session(cursor, client_id, now)
             conn.commit()
+            if status == 'pending':
+                self.pending_queue.push(client_id, username, enqueued_at or time.time())
+                self._publish('chat', client_id)
             logger.info(f"Chat created/updated for client {client_id}")
             return True
         except sqlite3.Error as e:
             logger.error(f"Error creating chat: {e}")
             return False
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
 
+    @write_method
     def activate_chat(self, client_id: int, manager_id: int) -> bool:
         """Активация чата менеджером"""
         conn, cursor = self._get_connection()
@@ -416,18 +1110,88 @@ class Database:
                 "UPDATE chats SET is_active = TRUE, manager_id = ?, status = 'active' WHERE client_id = ?",
                 (manager_id, client_id)
             )
+            self._accept_session(cursor, client_id, manager_id)
             conn.commit()
+            self.routing.assign(client_id, manager_id)
+            self.pending_queue.remove(client_id)
+            self._publish('chat', client_id)
             logger.info(f"Chat activated: client={client_id}, manager={manager_id}")
             return True
         except sqlite3.Error as e:
             logger.error(f"Error activating chat: {e}")
             return False
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
+
+    @write_method
+    def accept_chat(self, client_id: int, manager_id: int) -> bool:
+        """Принятие ожидающего чата менеджером
+
+        Активация чата и обновление счетчиков менеджера выполняются одной
+        транзакцией. Чат активируется, только если он все еще в статусе
+        'pending', поэтому из нескольких менеджеров, одновременно нажавших
+        "Принять", чат получает ровно один.
 
+        Args:
+            client_id: ID клиента
+            manager_id: ID менеджера
+
+        Returns:
+            bool: True, если чат назначен этому менеджеру, False если чат уже
+                принят, закрыт или произошла ошибка
+        """
+        start_time = time.monotonic()
+        conn, cursor = self._get_connection()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute(
+                """
+                UPDATE chats SET is_active = TRUE, manager_id = ?, status = 'active'
+                WHERE client_id = ? AND status = 'pending'
+                """,
+                (manager_id, client_id)
+            )
+            if cursor.rowcount == 0:
+                conn.rollback()
+                # Чат уже не ожидает - в очереди ему тоже не место
+                self.pending_queue.remove(client_id)
+                self.assigner.record_assignment(0.0, False)
+                logger.info(f"Chat for client {client_id} is no longer pending, manager {manager_id} lost the race")
+                return False
+            cursor.execute(
+                """
+                UPDATE managers
+                SET active_chats = active_chats + 1,
+                    total_chats = total_chats + 1,
+                    last_activity = CURRENT_TIMESTAMP
+                WHERE id = ?
+                """,
+                (manager_id,)
+            )
+            self._accept_session(cursor, client_id, manager_id)
+            conn.commit()
+            self.routing.assign(client_id, manager_id)
+            self.assigner.adjust(manager_id, 1)
+            self.assigner.record_assignment((time.monotonic() - start_time) * 1000, True)
+            wait = self.pending_queue.remove(client_id)
+            self._publish('chat', client_id)
+            self._publish('manager', manager_id)
+            logger.info(
+                f"Chat accepted: client={client_id}, manager={manager_id}"
+                + (f", waited {wait:.0f}s" if wait is not None else "")
+            )
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error accepting chat: {e}")
+            conn.rollback()
+            return False
+        finally:
+            self._release_connection(conn)
+
+    @write_method
     def close_chat(self, client_id: int) -> bool:
         """Закрытие чата"""
+        now = time.time()
         conn, cursor = self._get_connection()
         try:
             # Получаем информацию о чате перед закрытием
@@ -440,10 +1204,16 @@ class Database:
             if chat:
                 # Если чат найден, закрываем его
                 cursor.execute(
-                    "UPDATE chats SET is_active = FALSE, status = 'closed' WHERE client_id = ?",
-                    (client_id,)
+                    """
+                    UPDATE chats SET is_active = FALSE, status = 'closed', closed_at = ?, archived_at = NULL
+                    WHERE client_id = ?
+                    """,
+                    (now, client_id)
                 )
+                self._close_session(cursor, client_id, now)
                 conn.commit()
+                self.routing.release(client_id)
+                self._publish('chat', client_id)
                 logger.info(f"Chat closed: client={client_id}")
                 return True
             logger.warning(f"No active chat found for client={client_id}")
@@ -452,9 +1222,9 @@ class Database:
             logger.error(f"Error closing chat: {e}")
             return False
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
     
+    @write_method
     def transfer_chat(self, client_id: int, new_manager_id: int) -> bool:
         """Передача чата другому менеджеру
         
@@ -485,7 +1255,14 @@ class Database:
                 "UPDATE chats SET manager_id = ? WHERE client_id = ?",
                 (new_manager_id, client_id)
             )
+            # Обращение закрепляется за менеджером, который его завершит
+            cursor.execute(
+                "UPDATE sessions SET manager_id = ? WHERE id = (SELECT current_session_id FROM chats WHERE client_id = ?)",
+                (new_manager_id, client_id)
+            )
             conn.commit()
+            self.routing.assign(client_id, new_manager_id)
+            self._publish('chat', client_id)
             
             # Обновляем счетчики чатов
             if old_manager_id:
@@ -499,8 +1276,7 @@ class Database:
             conn.rollback()
             return False
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
             
     def get_chat_status(self, client_id: int) -> str:
         """Получение статуса чата клиента
@@ -523,9 +1299,9 @@ class Database:
             logger.error(f"Error getting chat status: {e}")
             return None
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
             
+    @write_method
     def set_chat_status(self, client_id: int, status: str) -> bool:
         """Изменение статуса чата
         
@@ -536,15 +1312,30 @@ class Database:
         Returns:
             bool: Успешность операции
         """
+        now = time.time()
         conn, cursor = self._get_connection()
         try:
             # Обновляем is_active в зависимости от статуса
             is_active = (status == 'active')
             
             cursor.execute(
-                "UPDATE chats SET status = ?, is_active = ? WHERE client_id = ?",
-                (status, is_active, client_id)
+                """
+                UPDATE chats SET status = ?, is_active = ?,
+                    enqueued_at = CASE WHEN ? = 'pending' AND status != 'pending' THEN ? ELSE enqueued_at END,
+                    closed_at = CASE WHEN ? = 'closed' AND status != 'closed' THEN ? ELSE closed_at END,
+                    archived_at = CASE WHEN ? = 'closed' AND status != 'closed' THEN NULL ELSE archived_at END
+                WHERE client_id = ?
+                RETURNING username, enqueued_at
+                """,
+                (status, is_active, status, now, status, now, status, client_id)
             )
+            queued = cursor.fetchone()
+            if queued and status == 'closed':
+                self._close_session(cursor, client_id, now)
+            elif queued and status == 'pending':
+                # Обращение начинается постановкой в очередь; 'active' без
+                # принятия менеджером нового обращения не открывает
+                self._ensure_open_session(cursor, client_id, now)
             
             # Если чат закрывается, сбрасываем manager_id
             if status == 'closed':
@@ -560,6 +1351,17 @@ class Database:
                     self.decrement_manager_active_chats(old_manager_id)
             
             conn.commit()
+            if is_active:
+                cursor.execute("SELECT manager_id FROM chats WHERE client_id = ?", (client_id,))
+                result = cursor.fetchone()
+                self.routing.assign(client_id, result[0] if result else None)
+            else:
+                self.routing.release(client_id)
+            if status == 'pending' and queued:
+                self.pending_queue.push(client_id, queued[0], queued[1] or time.time())
+            else:
+                self.pending_queue.remove(client_id)
+            self._publish('chat', client_id)
             logger.info(f"Chat status updated: client={client_id}, status={status}")
             return True
         except sqlite3.Error as e:
@@ -567,11 +1369,10 @@ class Database:
             conn.rollback()
             return False
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
             
     def get_pending_chats(self) -> list:
-        """Получение списка ожидающих чатов
+        """Получение списка ожидающих чатов, начиная с дольше всех ожидающего
         
         Returns:
             list: Список кортежей (client_id, username, client_name, client_phone, client_nickname)
@@ -583,7 +1384,7 @@ class Database:
                 SELECT client_id, username, client_name, client_phone, client_nickname
                 FROM chats 
                 WHERE status = 'pending'
-                ORDER BY client_id DESC
+                ORDER BY enqueued_at, client_id
                 """
             )
             return cursor.fetchall()
@@ -591,9 +1392,26 @@ class Database:
             logger.error(f"Error getting pending chats: {e}")
             return []
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
             
+    def get_oldest_pending_chat(self) -> Optional[Tuple[int, str, float]]:
+        """Чат, дольше всех ожидающий менеджера (из очереди в памяти)
+
+        Returns:
+            tuple: (client_id, username, время ожидания в секундах) или None
+        """
+        chat = self.pending_queue.oldest()
+        return (chat.client_id, chat.username, chat.wait_time()) if chat else None
+
+    def get_pending_wait_time(self, client_id: int) -> Optional[float]:
+        """Время ожидания чата клиента в секундах или None, если чат не ожидает"""
+        chat = self.pending_queue.get(client_id)
+        return chat.wait_time() if chat else None
+
+    def get_pending_queue_stats(self) -> dict:
+        """Получение статистики очереди ожидающих чатов"""
+        return self.pending_queue.stats()
+
     def get_active_chats_by_manager(self, manager_id: int) -> list:
         """Получение списка активных чатов менеджера
         
@@ -619,8 +1437,7 @@ class Database:
             logger.error(f"Error getting active chats for manager: {e}")
             return []
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
             
     def get_all_active_chats(self) -> list:
         """Получение списка всех активных чатов
@@ -643,13 +1460,25 @@ class Database:
             logger.error(f"Error getting all active chats: {e}")
             return []
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
 
     def get_active_chat(self, manager_id: int) -> Optional[tuple]:
-        """Получение активного чата для менеджера"""
+        """Получение текущего активного чата менеджера
+
+        Если у менеджера несколько активных чатов, возвращается тот, в
+        котором он сейчас ведет переписку (см. ChatRoutingTable).
+        """
         conn, cursor = self._get_connection()
         try:
+            client_id = self.routing.focused_client(manager_id)
+            if client_id is not None:
+                cursor.execute(
+                    "SELECT * FROM chats WHERE client_id = ? AND is_active = TRUE",
+                    (client_id,)
+                )
+                chat = cursor.fetchone()
+                if chat is not None:
+                    return chat
             cursor.execute(
                 "SELECT * FROM chats WHERE manager_id = ? AND is_active = TRUE",
                 (manager_id,)
@@ -659,24 +1488,11 @@ class Database:
             print(f"Ошибка получения активного чата: {e}")
             return None
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
 
     def is_client_in_active_chat(self, client_id: int) -> bool:
         """Проверка, находится ли клиент в активном чате"""
-        conn, cursor = self._get_connection()
-        try:
-            cursor.execute(
-                "SELECT EXISTS(SELECT 1 FROM chats WHERE client_id = ? AND is_active = TRUE)",
-                (client_id,)
-            )
-            return bool(cursor.fetchone()[0])
-        except sqlite3.Error as e:
-            print(f"Ошибка проверки активного чата: {e}")
-            return False
-        finally:
-            conn.close()
-            delattr(self._local, 'connection')
+        return self.routing.is_active(client_id)
 
     def get_client_id_by_username(self, username: str) -> Optional[int]:
         """Получение client_id по username"""
@@ -692,9 +1508,9 @@ class Database:
             print(f"Ошибка получения client_id: {e}")
             return None
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
 
+    @cached_reference('contacts')
     def get_streets_by_city(self, city_id: int) -> List[str]:
         """Получение списка улиц по id города"""
         conn, cursor = self._get_connection()
@@ -709,8 +1525,48 @@ class Database:
             logger.error(f"Error getting streets list: {e}")
             return []
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
+
+    @cached_reference('contacts')
+    def get_street_names(self) -> frozenset:
+        """Получение множества названий всех улиц
+
+        Множество загружается одним запросом и хранится в кэше
+        справочников до изменения таблицы streets.
+        """
+        conn, cursor = self._get_connection()
+        try:
+            cursor.execute("SELECT DISTINCT name FROM streets")
+            street_names = frozenset(row[0] for row in cursor.fetchall())
+            logger.info(f"Loaded street index: {len(street_names)} streets")
+            return street_names
+        except sqlite3.Error as e:
+            logger.error(f"Error loading street index: {e}")
+            return frozenset()
+        finally:
+            self._release_connection(conn)
+
+    def is_known_street(self, name: str) -> bool:
+        """Проверка, что улица с таким названием есть в справочнике"""
+        return name in self.get_street_names()
+
+    @write_method
+    def add_street(self, city_id: int, name: str) -> bool:
+        """Добавление новой улицы в город"""
+        conn, cursor = self._get_connection()
+        try:
+            cursor.execute(
+                "INSERT INTO streets (city_id, name) VALUES (?, ?)",
+                (city_id, name)
+            )
+            conn.commit()
+            self._invalidate_reference('contacts')
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error adding street: {e}")
+            return False
+        finally:
+            self._release_connection(conn)
 
     def get_street_by_id(self, street_id: int) -> Optional[Tuple[int, str]]:
         """Получение информации об улице по id"""
@@ -726,9 +1582,9 @@ class Database:
             print(f"Ошибка получения улицы: {e}")
             return None
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
 
+    @write_method
     def add_item(self, street_id: int, name: str, address: str, weekdays_time: str,
                  weekend_time: str, contact: str, geo_link: str, category: str) -> bool:
         """Добавление нового объекта"""
@@ -741,13 +1597,13 @@ class Database:
             """, (street_id, name, address, weekdays_time, weekend_time,
                   contact, geo_link, category))
             conn.commit()
+            self._invalidate_reference('contacts')
             return True
         except sqlite3.Error as e:
             logger.error(f"Error adding item: {e}")
             return False
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
 
     def get_items_by_city(self, city_id: int) -> List[Tuple]:
         """Получение списка объектов по id города"""
@@ -766,8 +1622,7 @@ class Database:
             logger.error(f"Error getting items by city: {e}")
             return []
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
 
     def get_items_by_category(self, city_id: int, category: str) -> List[Tuple]:
         """Получение списка объектов по категории в городе"""
@@ -785,8 +1640,7 @@ class Database:
             print(f"Ошибка получения списка объектов по категории: {e}")
             return []
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
 
     def get_item_by_id(self, item_id: int) -> Optional[Tuple]:
         """Получение информации об объекте по id"""
@@ -803,9 +1657,9 @@ class Database:
             print(f"Ошибка получения объекта: {e}")
             return None
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
 
+    @cached_reference('contacts')
     def get_items_by_address(self, street: str) -> List[Tuple]:
         """Получение информации о точках по адресу"""
         conn, cursor = self._get_connection()
@@ -826,8 +1680,7 @@ class Database:
             logger.error(f"Error getting items by address: {e}")
             return []
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
 
     def debug_street_info(self, street: str):
         """Отладочный метод для проверки информации об улице"""
@@ -849,9 +1702,9 @@ class Database:
             logger.error(f"Error in debug street info: {e}")
             return []
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
 
+    @write_method
     def save_message(self, chat_id: int, sender_id: int, message_text: str, 
                     message_type: str = 'text', file_id: str = None) -> bool:
         """Сохраняет сообщение в истории чата
@@ -871,8 +1724,8 @@ class Database:
             cursor.execute(
                 """
                 INSERT INTO messages 
-                (chat_id, sender_id, message_text, message_type, file_id)
-                VALUES (?, ?, ?, ?, ?)
+                (chat_id, sender_id, message_text, message_type, file_id, session_id)
+                VALUES (?1, ?2, ?3, ?4, ?5, (SELECT current_session_id FROM chats WHERE client_id = ?1))
                 """, 
                 (chat_id, sender_id, message_text, message_type, file_id)
             )
@@ -883,17 +1736,19 @@ class Database:
             logger.error(f"Error saving message: {e}")
             conn.rollback()
             return False
+        finally:
+            self._release_connection(conn)
 
     def get_chat_history(self, chat_id: int, limit: int = 50) -> list:
-        """Получает историю сообщений для чата с ограничением по количеству"""
+        """Получает историю сообщений для чата (включая архив) с ограничением по количеству"""
         conn, cursor = self._get_connection()
         try:
             cursor.execute(
-                """
+                f"""
                 SELECT id, sender_id, message_text, message_type, file_id, timestamp, is_read
-                FROM messages
+                FROM {MESSAGE_HISTORY}
                 WHERE chat_id = ?
-                ORDER BY timestamp DESC
+                ORDER BY id DESC
                 LIMIT ?
                 """,
                 (chat_id, limit)
@@ -904,7 +1759,149 @@ class Database:
         except sqlite3.Error as e:
             logger.error(f"Error retrieving chat history: {e}")
             return []
+        finally:
+            self._release_connection(conn)
+
+    def get_chat_history_page(self, chat_id: int, before_id: Optional[int] = None,
+                              after_id: Optional[int] = None, limit: int = 10) -> Tuple[list, bool, bool]:
+        """Страница истории сообщений чата (курсор по id сообщения)
+
+        Страница читается одним проходом по индексу (chat_id, id) в активной
+        базе и в архиве независимо от длины переписки.
+
+        Args:
+            chat_id: ID чата
+            before_id: Вернуть сообщения старше этого (предыдущая страница)
+            after_id: Вернуть сообщения новее этого (следующая страница)
+            limit: Размер страницы; без курсоров возвращается последняя страница
+
+        Returns:
+            Tuple[list, bool, bool]: Сообщения от старых к новым, есть ли
+                более старые и более новые сообщения
+        """
+        conn, cursor = self._get_connection()
+        try:
+            if after_id is not None:
+                cursor.execute(
+                    f"""
+                    SELECT id, sender_id, message_text, message_type, file_id, timestamp, is_read
+                    FROM {MESSAGE_HISTORY}
+                    WHERE chat_id = ? AND id > ?
+                    ORDER BY id
+                    LIMIT ?
+                    """,
+                    (chat_id, after_id, limit + 1)
+                )
+                messages = cursor.fetchall()
+                return messages[:limit], True, len(messages) > limit
+
+            if before_id is not None:
+                condition, params = "AND id < ?", (chat_id, before_id, limit + 1)
+            else:
+                condition, params = "", (chat_id, limit + 1)
+            cursor.execute(
+                f"""
+                SELECT id, sender_id, message_text, message_type, file_id, timestamp, is_read
+                FROM {MESSAGE_HISTORY}
+                WHERE chat_id = ? {condition}
+                ORDER BY id DESC
+                LIMIT ?
+                """,
+                params
+            )
+            messages = cursor.fetchall()
+            return list(reversed(messages[:limit])), len(messages) > limit, before_id is not None
+        except sqlite3.Error as e:
+            logger.error(f"Error retrieving chat history page: {e}")
+            return [], False, False
+        finally:
+            self._release_connection(conn)
+
+    def get_message_by_id(self, chat_id: int, message_id: int) -> Optional[tuple]:
+        """Сообщение чата по ID (None, если его нет или оно из другого чата)"""
+        conn, cursor = self._get_connection()
+        try:
+            cursor.execute(
+                f"""
+                SELECT id, sender_id, message_text, message_type, file_id, timestamp, is_read
+                FROM {MESSAGE_HISTORY}
+                WHERE id = ? AND chat_id = ?
+                """,
+                (message_id, chat_id)
+            )
+            return cursor.fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Error retrieving message {message_id}: {e}")
+            return None
+        finally:
+            self._release_connection(conn)
+
+    @staticmethod
+    def _fts_query(text: str) -> str:
+        """Запрос FTS5 из пользовательского текста: все слова, каждое как префикс"""
+        return " ".join(f'"{word}"*' for word in re.findall(r"\w+", text))
+
+    def search_messages(self, query: str, chat_id: Optional[int] = None,
+                        since: Optional[datetime] = None, limit: int = 20) -> list:
+        """Полнотекстовый поиск по истории сообщений, включая архив
+
+        Args:
+            query: Слова для поиска (сообщение должно содержать все слова,
+                слово может быть началом слова в сообщении)
+            chat_id: Искать только в этом чате
+            since: Искать только сообщения не старше этого времени (UTC)
+            limit: Максимум результатов
+
+        Returns:
+            list: (id, chat_id, sender_id, username, фрагмент с найденными
+                словами, timestamp), сначала наиболее релевантные (bm25)
+        """
+        match = self._fts_query(query)
+        if not match:
+            return []
+
+        conditions, params = "", [match]
+        if chat_id is not None:
+            conditions += " AND m.chat_id = ?"
+            params.append(chat_id)
+        if since is not None:
+            conditions += " AND m.timestamp >= ?"
+            params.append(since.strftime('%Y-%m-%d %H:%M:%S'))
+        params.append(limit)
+
+        # Каждая база ищется своим индексом (лучшие limit результатов),
+        # затем результаты объединяются по рангу
+        part = f"""
+            SELECT * FROM (
+                SELECT m.id, m.chat_id, m.sender_id,
+                       snippet(f.messages_fts, 0, '«', '»', '…', 12) AS snippet, m.timestamp, f.rank AS rank
+                FROM {{schema}}.messages_fts f
+                JOIN {{schema}}.messages m ON m.id = f.rowid
+                WHERE f.messages_fts MATCH ?{conditions}
+                ORDER BY f.rank
+                LIMIT ?
+            )
+        """
+        conn, cursor = self._get_connection()
+        try:
+            cursor.execute(
+                f"""
+                SELECT r.id, r.chat_id, r.sender_id, c.username, r.snippet, r.timestamp
+                FROM ({part.format(schema='main')} UNION ALL {part.format(schema='archive')}) r
+                LEFT JOIN chats c ON c.client_id = r.chat_id
+                ORDER BY r.rank
+                LIMIT ?
+                """,
+                params * 2 + [limit]
+            )
+            return cursor.fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Error searching messages: {e}")
+            return []
+        finally:
+            self._release_connection(conn)
 
+    @write_method
     def mark_messages_as_read(self, chat_id: int, user_id: int) -> bool:
         """Отмечает все сообщения к пользователю как прочитанные"""
         conn, cursor = self._get_connection()
@@ -923,6 +1920,76 @@ class Database:
             logger.error(f"Error marking messages as read: {e}")
             conn.rollback()
             return False
+        finally:
+            self._release_connection(conn)
+
+    @write_method
+    def write_message_batch(self, operations: list) -> tuple:
+        """Запись пакета операций журнала сообщений одной транзакцией
+
+        Args:
+            operations: Список ('message', (chat_id, sender_id, message_text, message_type,
+                file_id, timestamp, session_id)) и ('read', (chat_id, user_id)) в порядке поступления
+
+        Returns:
+            tuple: (количество записанных операций, список операций, не записанных
+                из-за временной ошибки и подлежащих повтору). Операции с постоянной
+                ошибкой (например, нарушение ограничения) не записываются и не возвращаются.
+        """
+        conn, cursor = self._get_connection()
+        try:
+            for kind, args in operations:
+                cursor.execute(self._JOURNAL_STATEMENTS[kind], args)
+            conn.commit()
+            return len(operations), []
+        except sqlite3.OperationalError as e:
+            # База заблокирована или недоступна - по одной операции записать тоже не выйдет
+            conn.rollback()
+            logger.error(f"Error writing message batch, {len(operations)} operations will be retried: {e}")
+            return 0, operations
+        except sqlite3.Error as e:
+            conn.rollback()
+            logger.error(f"Error writing message batch, retrying operations one by one: {e}")
+        finally:
+            self._release_connection(conn)
+
+        # Ошибочная операция не должна приводить к потере всего пакета
+        written = 0
+        failed = []
+        for index, (kind, args) in enumerate(operations):
+            try:
+                conn, cursor = self._get_connection()
+            except sqlite3.Error as e:
+                logger.error(f"Error getting connection for journal operations, will retry: {e}")
+                failed.extend(operations[index:])
+                break
+            try:
+                cursor.execute(self._JOURNAL_STATEMENTS[kind], args)
+                conn.commit()
+                written += 1
+            except sqlite3.OperationalError as e:
+                conn.rollback()
+                logger.error(f"Error writing journal operation {kind} {args[:2]}, will retry: {e}")
+                failed.append((kind, args))
+            except sqlite3.Error as e:
+                conn.rollback()
+                logger.critical(f"Dropping journal operation {kind} {args[:2]}: {e}")
+            finally:
+                self._release_connection(conn)
+        return written, failed
+
+    _JOURNAL_STATEMENTS = {
+        'message': """
+            INSERT INTO messages
+            (chat_id, sender_id, message_text, message_type, file_id, timestamp, session_id)
+            VALUES (?1, ?2, ?3, ?4, ?5, ?6, COALESCE(?7, (SELECT current_session_id FROM chats WHERE client_id = ?1)))
+        """,
+        'read': """
+            UPDATE messages
+            SET is_read = TRUE
+            WHERE chat_id = ? AND sender_id != ? AND is_read = FALSE
+        """
+    }
 
     def get_unread_messages_count(self, chat_id: int, user_id: int) -> int:
         """Возвращает количество непрочитанных сообщений для пользователя"""
@@ -940,37 +2007,30 @@ class Database:
         except sqlite3.Error as e:
             logger.error(f"Error counting unread messages: {e}")
             return 0
+        finally:
+            self._release_connection(conn)
 
     def __del__(self):
-        """Закрытие соединения при удалении объекта"""
+        """Закрытие соединений при удалении объекта"""
         try:
-            if hasattr(self._local, 'connection'):
-                self._local.connection.close()
-                delattr(self._local, 'connection')
+            if hasattr(self, '_archiver'):
+                self._archiver.stop()
+            if hasattr(self, '_checkpointer'):
+                self._checkpointer.stop()
+            if hasattr(self, '_pool'):
+                self._pool.close()
         except Exception as e:
             logger.error(f"Error in database cleanup: {e}")
 
     def get_available_managers_count(self) -> int:
-        """Получение количества свободных менеджеров"""
-        conn, cursor = self._get_connection()
-        try:
-            cursor.execute("""
-                SELECT COUNT(*)
-                FROM managers
-                WHERE is_active = TRUE AND is_available = TRUE
-            """)
-            available_managers = cursor.fetchone()[0] or 0
-            logger.info(f"Number of available managers: {available_managers}")
-            return available_managers
-        except sqlite3.Error as e:
-            logger.error(f"Error getting available managers count: {e}")
-            return 0
-        finally:
-            conn.close()
-            delattr(self._local, 'connection')
+        """Получение количества свободных менеджеров (из очереди менеджеров)"""
+        available_managers = self.assigner.available_count()
+        logger.info(f"Number of available managers: {available_managers}")
+        return available_managers
 
+    @write_method
     def save_chat_rating(self, chat_id: int, rating: int, comment: str = None) -> bool:
-        """Сохраняет оценку чата
+        """Сохраняет оценку текущего обращения клиента
         
         Args:
             chat_id: ID чата (client_id)
@@ -980,16 +2040,36 @@ class Database:
         Returns:
             bool: Успешность операции
         """
+        now = time.time()
         conn, cursor = self._get_connection()
         try:
+            cursor.execute("BEGIN IMMEDIATE")
             cursor.execute(
                 """
-                INSERT OR REPLACE INTO chat_ratings 
-                (chat_id, rating, comment)
-                VALUES (?, ?, ?)
-                """, 
-                (chat_id, rating, comment)
+                SELECT s.id, s.manager_id, s.rating, s.rated_at, s.is_legacy
+                FROM chats c
+                JOIN sessions s ON s.id = c.current_session_id
+                WHERE c.client_id = ?
+                """,
+                (chat_id,)
+            )
+            session = cursor.fetchone()
+            if session is None:
+                conn.rollback()
+                logger.warning(f"No session to rate for chat {chat_id}")
+                return False
+            session_id, manager_id, old_rating, old_rated_at, is_legacy = session
+
+            # Оценка относится к текущему обращению и не затирает оценки прошлых
+            cursor.execute(
+                "UPDATE sessions SET rating = ?, rating_comment = ?, rated_at = ? WHERE id = ?",
+                (rating, comment, now, session_id)
             )
+            if manager_id is not None and not is_legacy:
+                # Повторная оценка заменяет прежнюю в статистике того периода, где она учтена
+                if old_rating is not None and old_rated_at is not None:
+                    self._record_manager_stats(cursor, manager_id, old_rated_at, **{f'rating_{old_rating}': -1})
+                self._record_manager_stats(cursor, manager_id, now, **{f'rating_{rating}': 1})
             conn.commit()
             logger.info(f"Rating saved for chat {chat_id}: {rating}")
             return True
@@ -997,23 +2077,59 @@ class Database:
             logger.error(f"Error saving rating: {e}")
             conn.rollback()
             return False
+        finally:
+            self._release_connection(conn)
             
+    def get_user_state(self, user_id: int) -> Tuple[Optional[tuple], bool]:
+        """Получение состояния пользователя для обработки одного обновления
+
+        Активный чат сюда не входит: он берется из таблицы маршрутизации.
+
+        Args:
+            user_id: ID пользователя
+
+        Returns:
+            tuple: (оценка текущего обращения (rating, comment, rated_at) или None,
+                является ли пользователь администратором)
+        """
+        conn, cursor = self._get_connection()
+        try:
+            cursor.execute(
+                """
+                SELECT
+                    (SELECT is_admin FROM managers WHERE id = ?),
+                    s.rating, s.rating_comment, s.rated_at
+                FROM (SELECT 1)
+                LEFT JOIN chats c ON c.client_id = ?
+                LEFT JOIN sessions s ON s.id = c.current_session_id
+                """,
+                (user_id, user_id)
+            )
+            is_admin, *rating = cursor.fetchone()
+            return (tuple(rating) if rating[0] is not None else None), bool(is_admin)
+        except sqlite3.Error as e:
+            logger.error(f"Error getting user state: {e}")
+            return None, False
+        finally:
+            self._release_connection(conn)
+
     def get_chat_rating(self, chat_id: int) -> tuple:
-        """Получает оценку чата
+        """Получает оценку текущего обращения клиента
         
         Args:
             chat_id: ID чата (client_id)
             
         Returns:
-            tuple: (rating, comment, timestamp) или None
+            tuple: (rating, comment, rated_at) или None
         """
         conn, cursor = self._get_connection()
         try:
             cursor.execute(
                 """
-                SELECT rating, comment, timestamp
-                FROM chat_ratings
-                WHERE chat_id = ?
+                SELECT s.rating, s.rating_comment, s.rated_at
+                FROM chats c
+                JOIN sessions s ON s.id = c.current_session_id
+                WHERE c.client_id = ? AND s.rating IS NOT NULL
                 """,
                 (chat_id,)
             )
@@ -1021,7 +2137,10 @@ class Database:
         except sqlite3.Error as e:
             logger.error(f"Error retrieving chat rating: {e}")
             return None
+        finally:
+            self._release_connection(conn)
 
+    @write_method
     def add_manager(self, manager_id: int, name: str = None, is_admin: bool = False) -> bool:
         """Добавляет нового менеджера
         
@@ -1046,13 +2165,18 @@ class Database:
                 (manager_id, name, is_admin, manager_id, manager_id)
             )
             conn.commit()
+            self._refresh_assigner(cursor, manager_id)
+            self._publish('manager', manager_id)
             logger.info(f"Added manager: {manager_id} ({name})")
             return True
         except sqlite3.Error as e:
             logger.error(f"Error adding manager: {e}")
             conn.rollback()
             return False
+        finally:
+            self._release_connection(conn)
     
+    @write_method
     def set_manager_availability(self, manager_id: int, is_available: bool) -> bool:
         """Устанавливает доступность менеджера для новых чатов
         
@@ -1074,13 +2198,18 @@ class Database:
                 (is_available, manager_id)
             )
             conn.commit()
+            self._refresh_assigner(cursor, manager_id)
+            self._publish('manager', manager_id)
             logger.info(f"Manager {manager_id} availability set to {is_available}")
             return True
         except sqlite3.Error as e:
             logger.error(f"Error setting manager availability: {e}")
             conn.rollback()
             return False
+        finally:
+            self._release_connection(conn)
     
+    @write_method
     def update_manager_activity(self, manager_id: int) -> bool:
         """Обновляет время последней активности менеджера
         
@@ -1101,38 +2230,27 @@ class Database:
                 (manager_id,)
             )
             conn.commit()
+            self.assigner.touch(manager_id)
             return True
         except sqlite3.Error as e:
             logger.error(f"Error updating manager activity: {e}")
             conn.rollback()
             return False
+        finally:
+            self._release_connection(conn)
     
     def get_available_manager(self) -> int:
         """Получает ID доступного менеджера с наименьшим количеством активных чатов
         
+        При равной нагрузке выбирается менеджер, дольше всех не проявлявший
+        активности. Выбор выполняется по очереди менеджеров в памяти.
+
         Returns:
             int: ID менеджера или 0, если нет доступных менеджеров
         """
-        conn, cursor = self._get_connection()
-        try:
-            cursor.execute(
-                """
-                SELECT id
-                FROM managers
-                WHERE is_active = TRUE AND is_available = TRUE
-                ORDER BY active_chats ASC, last_activity ASC
-                LIMIT 1
-                """
-            )
-            result = cursor.fetchone()
-            return result[0] if result else 0
-        except sqlite3.Error as e:
-            logger.error(f"Error getting available manager: {e}")
-            return 0
-        finally:
-            conn.close()
-            delattr(self._local, 'connection')
+        return self.assigner.pick() or 0
     
+    @write_method
     def increment_manager_active_chats(self, manager_id: int) -> bool:
         """Увеличивает счетчик активных чатов менеджера
         
@@ -1155,12 +2273,17 @@ class Database:
                 (manager_id,)
             )
             conn.commit()
+            self.assigner.adjust(manager_id, 1)
+            self._publish('manager', manager_id)
             return True
         except sqlite3.Error as e:
             logger.error(f"Error incrementing manager active chats: {e}")
             conn.rollback()
             return False
+        finally:
+            self._release_connection(conn)
     
+    @write_method
     def decrement_manager_active_chats(self, manager_id: int) -> bool:
         """Уменьшает счетчик активных чатов менеджера
         
@@ -1182,11 +2305,15 @@ class Database:
                 (manager_id,)
             )
             conn.commit()
+            self.assigner.adjust(manager_id, -1)
+            self._publish('manager', manager_id)
             return True
         except sqlite3.Error as e:
             logger.error(f"Error decrementing manager active chats: {e}")
             conn.rollback()
             return False
+        finally:
+            self._release_connection(conn)
             
     def get_manager_stats(self, manager_id: int) -> tuple:
         """Получает статистику менеджера
@@ -1211,6 +2338,82 @@ class Database:
         except sqlite3.Error as e:
             logger.error(f"Error getting manager stats: {e}")
             return None
+        finally:
+            self._release_connection(conn)
+
+    def get_manager_report(self, days: int = 7, manager_id: Optional[int] = None) -> List[dict]:
+        """Отчет о работе менеджеров за последние days дней
+
+        Читает сводную статистику за диапазон периодов: почасовую для
+        отчета за сутки, подневную для более длинных. Границы диапазона
+        округляются до начала часа (дня).
+
+        Args:
+            days: Длина периода в днях
+            manager_id: ID менеджера; по умолчанию отчет по всем менеджерам
+
+        Returns:
+            list: Словари по менеджерам, от лучшего среднего рейтинга к худшему:
+                manager_id, manager_name, total_chats (закрытые), accepted_chats,
+                avg_rating, rating_count, ratings (по оценкам 1-5),
+                positive_ratings, negative_ratings, avg_response_time,
+                min_response_time, max_response_time, response_count,
+                avg_duration (сек) и period
+        """
+        table, period, fmt = MANAGER_STATS_PERIODS[0 if days <= 1 else 1]
+        end = datetime.now()
+        start = datetime.fromtimestamp(end.timestamp() - days * 86400)
+        condition = "AND s.manager_id = ?" if manager_id is not None else ""
+        params = (start.strftime(fmt), end.strftime(fmt)) + ((manager_id,) if manager_id is not None else ())
+
+        conn, cursor = self._get_connection()
+        try:
+            cursor.execute(
+                f"""
+                SELECT s.manager_id, m.name,
+                       SUM(s.chats_accepted), SUM(s.response_time_sum),
+                       MIN(s.response_time_min), MAX(s.response_time_max),
+                       SUM(s.chats_closed), SUM(s.duration_sum),
+                       SUM(s.rating_1), SUM(s.rating_2), SUM(s.rating_3), SUM(s.rating_4), SUM(s.rating_5)
+                FROM {table} s
+                LEFT JOIN managers m ON m.id = s.manager_id
+                WHERE s.{period} BETWEEN ? AND ? {condition}
+                GROUP BY s.manager_id
+                """,
+                params
+            )
+            rows = cursor.fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Error getting manager report: {e}")
+            return []
+        finally:
+            self._release_connection(conn)
+
+        report = []
+        for (row_manager_id, name, accepted, response_time_sum, response_time_min, response_time_max,
+             closed, duration_sum, *ratings) in rows:
+            rating_count = sum(ratings)
+            report.append({
+                'manager_id': row_manager_id,
+                'manager_name': name or f"Manager {row_manager_id}",
+                'total_chats': closed,
+                'accepted_chats': accepted,
+                'avg_rating': round(
+                    sum(score * count for score, count in enumerate(ratings, 1)) / rating_count, 2
+                ) if rating_count else 0,
+                'rating_count': rating_count,
+                'ratings': ratings,
+                'positive_ratings': ratings[3] + ratings[4],
+                'negative_ratings': ratings[0] + ratings[1],
+                'avg_response_time': round(response_time_sum / accepted, 2) if accepted else 0,
+                'min_response_time': round(response_time_min or 0, 2),
+                'max_response_time': round(response_time_max or 0, 2),
+                'response_count': accepted,
+                'avg_duration': round(duration_sum / closed, 2) if closed else 0,
+                'period': f"{start.strftime('%Y-%m-%d')} to {end.strftime('%Y-%m-%d')}"
+            })
+        report.sort(key=lambda manager: manager['avg_rating'], reverse=True)
+        return report
 
     def get_active_chat_by_client_id(self, client_id: int) -> Optional[tuple]:
         """Получение информации о чате по ID клиента"""
@@ -1225,34 +2428,13 @@ class Database:
             logger.error(f"Error getting active chat by client ID: {e}")
             return None
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
 
+    @write_method
     def save_client_contact_info(self, client_id: int, name: str, phone: str, nickname: str) -> bool:
         """Сохранение контактной информации клиента"""
         conn, cursor = self._get_connection()
         try:
-            # Проверяем существование полей в таблице
-            cursor.execute("PRAGMA table_info(chats)")
-            columns = {column[1] for column in cursor.fetchall()}
-            
-            # Логируем информацию о структуре таблицы для отладки
-            logger.info(f"Columns in chats table: {columns}")
-            
-            # Проверяем наличие нужных полей в таблице
-            required_fields = ['client_name', 'client_phone', 'client_nickname']
-            missing_fields = [field for field in required_fields if field not in columns]
-            
-            if missing_fields:
-                logger.error(f"Missing fields in chats table: {missing_fields}")
-                # Пытаемся добавить недостающие поля
-                for field in missing_fields:
-                    try:
-                        cursor.execute(f"ALTER TABLE chats ADD COLUMN {field} TEXT")
-                        logger.info(f"Added missing field: {field}")
-                    except sqlite3.Error as e:
-                        logger.error(f"Error adding field {field}: {e}")
-            
             # Проверяем наличие записи для этого пользователя
             cursor.execute("SELECT COUNT(*) FROM chats WHERE client_id = ?", (client_id,))
             count = cursor.fetchone()[0]
@@ -1293,12 +2475,7 @@ class Database:
             logger.error(f"Unexpected error saving client contact info: {e}", exc_info=True)
             return False
         finally:
-            try:
-                conn.close()
-                delattr(self._local, 'connection')
-            except Exception as e:
-                logger.error(f"Error closing connection: {e}")
-                # Не прерываем выполнение при ошибке закрытия соединения
+            self._release_connection(conn)
 
     def get_client_contact_info(self, client_id: int) -> Optional[Tuple[str, str, str]]:
         """Получение контактной информации клиента"""
@@ -1314,10 +2491,30 @@ class Database:
             logger.error(f"Error getting client contact info: {e}")
             return None
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
 
     # Методы для работы с каталогом товаров
+    @cached_reference('catalog')
+    def get_catalog_index(self) -> CatalogIndex:
+        """Получить дерево каталога товаров с готовыми клавиатурами"""
+        conn, cursor = self._get_connection()
+        try:
+            cursor.execute("""
+                SELECT id, category, subcategory, type, size,
+                       product_name, description, price, external_url, image_url
+                FROM products
+                ORDER BY id
+            """)
+            catalog = CatalogIndex(cursor.fetchall())
+            logger.info(f"Loaded catalog index: {len(catalog)} products in {len(catalog.categories)} categories")
+            return catalog
+        except sqlite3.Error as e:
+            logger.error(f"Error loading catalog index: {e}")
+            return CatalogIndex(())
+        finally:
+            self._release_connection(conn)
+
+    @cached_reference('catalog')
     def get_product_categories(self) -> list[str]:
         """Получить все категории товаров"""
         conn, cursor = self._get_connection()
@@ -1328,9 +2525,9 @@ class Database:
             logger.error(f"Error getting product categories: {e}")
             return []
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
     
+    @cached_reference('catalog')
     def get_product_subcategories(self, category: str) -> list[str]:
         """Получить все подкатегории для выбранной категории"""
         conn, cursor = self._get_connection()
@@ -1344,9 +2541,9 @@ class Database:
             logger.error(f"Error getting product subcategories: {e}")
             return []
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
     
+    @cached_reference('catalog')
     def get_product_types(self, category: str, subcategory: str) -> list[str]:
         """Получить все типы для выбранной категории и подкатегории"""
         conn, cursor = self._get_connection()
@@ -1360,9 +2557,9 @@ class Database:
             logger.error(f"Error getting product types: {e}")
             return []
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
     
+    @cached_reference('catalog')
     def get_product_sizes(self, category: str, subcategory: str, type: str = None) -> list[str]:
         """Получить все размеры для выбранной категории, подкатегории и типа (если применимо)"""
         conn, cursor = self._get_connection()
@@ -1382,8 +2579,7 @@ class Database:
             logger.error(f"Error getting product sizes: {e}")
             return []
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
     
     def get_products_by_params(self, category: str, subcategory: str, type: str = None, size: str = None) -> list[tuple]:
         """Получить все товары, соответствующие фильтрам"""
@@ -1406,9 +2602,9 @@ class Database:
             logger.error(f"Error getting products: {e}")
             return []
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
     
+    @write_method
     def add_product(self, category: str, subcategory: str, size: str, external_url: str, 
                    type: str = None, product_name: str = None, description: str = None, 
                    price: str = None, image_url: str = None) -> bool:
@@ -1420,14 +2616,14 @@ class Database:
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
             """, (category, subcategory, type, size, product_name, description, price, external_url, image_url))
             conn.commit()
+            self._invalidate_reference('catalog')
             return True
         except sqlite3.Error as e:
             logger.error(f"Error adding product: {e}")
             conn.rollback()
             return False
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
 
     def is_admin(self, user_id: int) -> bool:
         """Проверяет, является ли пользователь администратором
@@ -1450,8 +2646,7 @@ class Database:
             logger.error(f"Error checking admin status: {e}")
             return False
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
     
     def get_all_managers(self) -> list:
         """Получение списка всех менеджеров
@@ -1473,8 +2668,7 @@ class Database:
             logger.error(f"Error getting managers list: {e}")
             return []
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
     
     def get_manager_name(self, manager_id: int) -> str:
         """Получение имени менеджера
@@ -1497,9 +2691,9 @@ class Database:
             logger.error(f"Error getting manager name: {e}")
             return None
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
     
+    @write_method
     def update_manager_name(self, manager_id: int, name: str) -> bool:
         """Обновляет имя менеджера
         
@@ -1524,9 +2718,74 @@ class Database:
             conn.rollback()
             return False
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
-    
+            self._release_connection(conn)
+
+    @write_method
+    def write_navigation_states(self, changes: dict) -> bool:
+        """Запись пакета изменений состояния навигации одной транзакцией
+
+        Args:
+            changes: {user_id: (category, subcategory, type, updated_at)}; None вместо
+                кортежа означает удаление состояния пользователя
+        """
+        saved = [(user_id, *fields) for user_id, fields in changes.items() if fields is not None]
+        deleted = [(user_id,) for user_id, fields in changes.items() if fields is None]
+        conn, cursor = self._get_connection()
+        try:
+            cursor.executemany("""
+                INSERT OR REPLACE INTO navigation_state (user_id, category, subcategory, type, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, saved)
+            cursor.executemany("DELETE FROM navigation_state WHERE user_id = ?", deleted)
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            conn.rollback()
+            logger.error(f"Error writing navigation states: {e}")
+            return False
+        finally:
+            self._release_connection(conn)
+
+    def load_navigation_states(self, limit: int, since: float) -> List[Tuple]:
+        """Получение последних состояний навигации, измененных после since
+
+        Returns:
+            List[Tuple]: (user_id, category, subcategory, type, updated_at) от новых к старым
+        """
+        conn, cursor = self._get_connection()
+        try:
+            cursor.execute("""
+                SELECT user_id, category, subcategory, type, updated_at
+                FROM navigation_state
+                WHERE updated_at >= ?
+                ORDER BY updated_at DESC
+                LIMIT ?
+            """, (since, limit))
+            return cursor.fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Error loading navigation states: {e}")
+            return []
+        finally:
+            self._release_connection(conn)
+
+    @write_method
+    def purge_navigation_states(self, before: float) -> int:
+        """Удаление состояний навигации, не изменявшихся с момента before
+
+        Returns:
+            int: Количество удаленных записей
+        """
+        conn, cursor = self._get_connection()
+        try:
+            cursor.execute("DELETE FROM navigation_state WHERE updated_at < ?", (before,))
+            conn.commit()
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            logger.error(f"Error purging navigation states: {e}")
+            return 0
+        finally:
+            self._release_connection(conn)
+
     def get_dashboard_stats(self) -> dict:
         """Получение статистики для панели администратора
         
@@ -1550,8 +2809,7 @@ class Database:
             result['available_managers'] = cursor.fetchone()[0]
             
             # Количество ожидающих чатов
-            cursor.execute("SELECT COUNT(*) FROM chats WHERE status = 'pending'")
-            result['pending_chats'] = cursor.fetchone()[0]
+            result['pending_chats'] = len(self.pending_queue)
             
             # Количество активных чатов
             cursor.execute("SELECT COUNT(*) FROM chats WHERE status = 'active'")
@@ -1567,5 +2825,159 @@ class Database:
                 'active_chats': 0
             }
         finally:
-            conn.close()
-            delattr(self._local, 'connection')
+            self._release_connection(conn)
+
+
+class AsyncDatabase:
+    """Асинхронный фасад над Database для использования в обработчиках aiogram
+
+    Каждый публичный метод Database доступен здесь как корутина с тем же
+    именем и аргументами. Запросы на чтение выполняются параллельно в пуле
+    потоков-читателей (у каждого потока свое соединение из пула), а все
+    изменения проходят через одну очередь и выполняются единственным
+    потоком-писателем в порядке поступления. Таким образом медленный commit
+    не блокирует цикл событий и чтения других пользователей.
+
+    Если включен журнал сообщений (journal_flush_interval > 0), save_message
+    и mark_messages_as_read ставят операцию в журнал и сразу возвращают True,
+    а запись выполняется пакетами. Чтения истории через фасад сначала
+    сбрасывают журнал; перед чтением истории через синхронный Database
+    нужно вызвать flush_journal().
+    """
+
+    # Методы Database, которые изменяют данные и должны идти через писателя
+    WRITE_METHODS = frozenset(
+        name for name, attr in vars(Database).items() if getattr(attr, '_writes', False)
+    )
+
+    # Методы, которые при включенном журнале записываются пакетами
+    JOURNAL_METHODS = frozenset({'save_message', 'mark_messages_as_read'})
+
+    # Чтения сообщений, перед которыми журнал сбрасывается в базу
+    JOURNAL_READ_METHODS = frozenset({
+        'get_chat_history', 'get_chat_history_page', 'get_message_by_id', 'search_messages',
+        'get_unread_messages_count'
+    })
+
+    def __init__(self, db: Database, readers: Optional[int] = None):
+        self.db = db
+        readers = readers or max(1, db.db_config.pool_size - 1)
+        self.journal: Optional[MessageJournal] = None
+        if db.db_config.journal_flush_interval > 0:
+            self.journal = MessageJournal(
+                lambda operations: self._write(db.write_message_batch, (operations,), {}),
+                lambda chat_id: self._read(db.get_current_session_id, (chat_id,), {}),
+                flush_interval=db.db_config.journal_flush_interval,
+                max_batch=db.db_config.journal_max_batch
+            )
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._write_queue: Optional[asyncio.Queue] = None
+        self._writer_task: Optional[asyncio.Task] = None
+
+        # Метрики
+        self.reads = 0
+        self.writes = 0
+        self.max_write_queue_depth = 0
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.db, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        if self.journal is not None and name in self.JOURNAL_METHODS:
+            method = getattr(self.journal, name)
+            self.__dict__[name] = method
+            return method
+
+        if name in self.WRITE_METHODS:
+            async def method(*args, **kwargs):
+                return await self._write(attr, args, kwargs)
+        elif self.journal is not None and name in self.JOURNAL_READ_METHODS:
+            async def method(*args, **kwargs):
+                await self.journal.flush()
+                return await self._read(attr, args, kwargs)
+        else:
+            async def method(*args, **kwargs):
+                return await self._read(attr, args, kwargs)
+
+        method.__name__ = name
+        method.__doc__ = attr.__doc__
+        # Кэшируем обертку, чтобы __getattr__ вызывался для имени только один раз
+        self.__dict__[name] = method
+        return method
+
+    async def start(self):
+        """Запуск потока-писателя и журнала сообщений"""
+        if self._writer_task is None:
+            self._write_queue = asyncio.Queue()
+            self._writer_task = asyncio.create_task(self._writer_loop())
+            logger.info("Async database writer started")
+        if self.journal is not None:
+            await self.journal.start()
+
+    async def flush_journal(self):
+        """Запись накопленных сообщений перед чтением истории в обход фасада"""
+        if self.journal is not None:
+            await self.journal.flush()
+
+    async def close(self):
+        """Дожидается выполнения всех поставленных в очередь изменений и останавливает потоки"""
+        if self.journal is not None:
+            await self.journal.close()
+        if self._writer_task is not None:
+            await self._write_queue.join()
+            self._writer_task.cancel()
+            try:
+                await self._writer_task
+            except asyncio.CancelledError:
+                pass
+            self._writer_task = None
+        self._readers.shutdown(wait=True)
+        self._writer.shutdown(wait=True)
+        logger.info("Async database stopped")
+
+    async def _read(self, func, args, kwargs):
+        self.reads += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, partial(func, *args, **kwargs))
+
+    async def _write(self, func, args, kwargs):
+        if self._writer_task is None:
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._write_queue.put((func, args, kwargs, future))
+        self.max_write_queue_depth = max(self.max_write_queue_depth, self._write_queue.qsize())
+        return await future
+
+    async def _writer_loop(self):
+        """Последовательное выполнение изменений из очереди"""
+        loop = asyncio.get_running_loop()
+        while True:
+            func, args, kwargs, future = await self._write_queue.get()
+            try:
+                result = await loop.run_in_executor(self._writer, partial(func, *args, **kwargs))
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                logger.error(f"Error in async database write {func.__name__}: {e}")
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.writes += 1
+                self._write_queue.task_done()
+
+    def stats(self) -> dict:
+        """Статистика асинхронного слоя
+
+        Returns:
+            dict: Количество чтений/записей, текущая и максимальная глубина очереди записи
+        """
+        return {
+            'reads': self.reads,
+            'writes': self.writes,
+            'write_queue_depth': self._write_queue.qsize() if self._write_queue else 0,
+            'max_write_queue_depth': self.max_write_queue_depth,
+            'journal': self.journal.stats() if self.journal else None,
+            'pool': self.db.get_pool_stats()
+        }
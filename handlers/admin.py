@@ -1,5 +1,5 @@
 from aiogram import types, Bot
-from database import Database
+from database import AsyncDatabase
 from keyboards import (
     get_main_keyboard, 
     get_admin_keyboard,
@@ -9,17 +9,16 @@ from keyboards import (
     get_extended_chat_keyboard
 )
 import logging
-from utils.analytics import AnalyticsReporter
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
 
-async def handle_admin_panel(message: types.Message, db: Database):
+async def handle_admin_panel(message: types.Message, db: AsyncDatabase):
     """Обработчик для открытия панели администратора"""
     user_id = message.from_user.id
     
     # Проверяем, является ли пользователь администратором
-    if not db.is_admin(user_id):
+    if not await db.is_admin(user_id):
         await message.answer(
             "У вас нет прав доступа к панели администратора",
             reply_markup=get_main_keyboard()
@@ -31,15 +30,15 @@ async def handle_admin_panel(message: types.Message, db: Database):
         reply_markup=get_admin_keyboard()
     )
 
-async def handle_admin_stats(message: types.Message, db: Database):
+async def handle_admin_stats(message: types.Message, db: AsyncDatabase):
     """Обработчик для отображения статистики"""
     user_id = message.from_user.id
     
     # Проверяем, является ли пользователь администратором
-    if not db.is_admin(user_id):
+    if not await db.is_admin(user_id):
         return
     
-    stats = db.get_dashboard_stats()
+    stats = await db.get_dashboard_stats()
     
     await message.answer(
         f"📊 *Статистика системы:*\n\n"
@@ -51,15 +50,15 @@ async def handle_admin_stats(message: types.Message, db: Database):
         reply_markup=get_admin_keyboard()
     )
 
-async def handle_admin_pending_chats(message: types.Message, db: Database):
+async def handle_admin_pending_chats(message: types.Message, db: AsyncDatabase):
     """Обработчик для отображения ожидающих чатов"""
     user_id = message.from_user.id
     
     # Проверяем, является ли пользователь администратором
-    if not db.is_admin(user_id):
+    if not await db.is_admin(user_id):
         return
     
-    pending_chats = db.get_pending_chats()
+    pending_chats = await db.get_pending_chats()
     
     if not pending_chats:
         await message.answer(
@@ -68,20 +67,23 @@ async def handle_admin_pending_chats(message: types.Message, db: Database):
         )
         return
     
+    oldest = await db.get_oldest_pending_chat()
+    wait_text = f"Дольше всех ожидает {oldest[1]}: {oldest[2] / 60:.0f} мин.\n" if oldest else ""
+
     await message.answer(
-        f"Найдено {len(pending_chats)} ожидающих чатов. Выберите чат для принятия:",
+        f"Найдено {len(pending_chats)} ожидающих чатов. {wait_text}Выберите чат для принятия:",
         reply_markup=get_pending_chats_keyboard(pending_chats)
     )
 
-async def handle_admin_active_chats(message: types.Message, db: Database):
+async def handle_admin_active_chats(message: types.Message, db: AsyncDatabase):
     """Обработчик для отображения активных чатов"""
     user_id = message.from_user.id
     
     # Проверяем, является ли пользователь администратором
-    if not db.is_admin(user_id):
+    if not await db.is_admin(user_id):
         return
     
-    active_chats = db.get_all_active_chats()
+    active_chats = await db.get_all_active_chats()
     
     if not active_chats:
         await message.answer(
@@ -94,7 +96,7 @@ async def handle_admin_active_chats(message: types.Message, db: Database):
     
     for chat in active_chats:
         client_id, username, client_name, client_phone, manager_id = chat
-        manager_name = db.get_manager_name(manager_id) or f"ID: {manager_id}"
+        manager_name = await db.get_manager_name(manager_id) or f"ID: {manager_id}"
         
         formatted_chats.append((
             client_id, 
@@ -108,15 +110,15 @@ async def handle_admin_active_chats(message: types.Message, db: Database):
         reply_markup=get_active_chats_keyboard(formatted_chats)
     )
 
-async def handle_admin_managers(message: types.Message, db: Database):
+async def handle_admin_managers(message: types.Message, db: AsyncDatabase):
     """Обработчик для отображения списка менеджеров"""
     user_id = message.from_user.id
     
     # Проверяем, является ли пользователь администратором
-    if not db.is_admin(user_id):
+    if not await db.is_admin(user_id):
         return
     
-    managers = db.get_all_managers()
+    managers = await db.get_all_managers()
     
     if not managers:
         await message.answer(
@@ -151,13 +153,13 @@ async def handle_admin_managers(message: types.Message, db: Database):
         )
     )
 
-async def handle_admin_take_chat(message: types.Message, bot: Bot, db: Database):
+async def handle_admin_take_chat(message: types.Message, bot: Bot, db: AsyncDatabase):
     """Обработчик для принятия чата администратором"""
     user_id = message.from_user.id
     admin_name = message.from_user.first_name or "Администратор"
     
     # Проверяем, является ли пользователь администратором
-    if not db.is_admin(user_id):
+    if not await db.is_admin(user_id):
         return
     
     # Извлекаем имя клиента из текста кнопки
@@ -172,7 +174,7 @@ async def handle_admin_take_chat(message: types.Message, bot: Bot, db: Database)
     client_info = text.replace("Взять чат с ", "")
     
     # Ищем клиента по имени и телефону
-    pending_chats = db.get_pending_chats()
+    pending_chats = await db.get_pending_chats()
     target_client_id = None
     
     for chat in pending_chats:
@@ -193,14 +195,8 @@ async def handle_admin_take_chat(message: types.Message, bot: Bot, db: Database)
         )
         return
     
-    # Принимаем чат
-    if db.activate_chat(target_client_id, user_id):
-        # Увеличиваем счетчик активных чатов администратора
-        db.increment_manager_active_chats(user_id)
-        
-        # Обновляем активность администратора
-        db.update_manager_activity(user_id)
-        
+    # Принимаем чат (активация и счетчики администратора - одной транзакцией)
+    if await db.accept_chat(target_client_id, user_id):
         # Уведомляем клиента о подключении администратора
         await bot.send_message(
             target_client_id,
@@ -215,7 +211,7 @@ async def handle_admin_take_chat(message: types.Message, bot: Bot, db: Database)
         )
         
         # Сохраняем приветственное сообщение в истории
-        db.save_message(target_client_id, user_id, greeting_message, 'text')
+        await db.save_message(target_client_id, user_id, greeting_message, 'text')
         
         # Уведомляем администратора
         await message.answer(
@@ -228,12 +224,12 @@ async def handle_admin_take_chat(message: types.Message, bot: Bot, db: Database)
             reply_markup=get_admin_keyboard()
         )
 
-async def handle_admin_manager_stats(message: types.Message, db: Database, config):
+async def handle_admin_manager_stats(message: types.Message, db: AsyncDatabase, config):
     """Обработчик для отображения детальной статистики по менеджеру"""
     user_id = message.from_user.id
     
     # Проверяем, является ли пользователь администратором
-    if not db.is_admin(user_id):
+    if not await db.is_admin(user_id):
         return
     
     # Извлекаем ID менеджера из текста кнопки
@@ -249,7 +245,7 @@ async def handle_admin_manager_stats(message: types.Message, db: Database, confi
     manager_id = int(manager_info.split("(")[1].split(")")[0])
     
     # Получаем базовую статистику менеджера из БД
-    manager_stats = db.get_manager_stats(manager_id)
+    manager_stats = await db.get_manager_stats(manager_id)
     if not manager_stats:
         await message.answer(
             "Не удалось получить статистику для этого менеджера",
@@ -258,28 +254,17 @@ async def handle_admin_manager_stats(message: types.Message, db: Database, confi
         return
     
     active_chats, total_chats, rating = manager_stats
-    manager_name = db.get_manager_name(manager_id) or f"Менеджер {manager_id}"
+    manager_name = await db.get_manager_name(manager_id) or f"Менеджер {manager_id}"
     
     # Получаем расширенную статистику из аналитики
     # За последние 7 дней
-    week_report = AnalyticsReporter.get_manager_performance_report(
-        config.db.database, manager_id=manager_id, days=7
-    )
+    week_report = await db.get_manager_report(days=7, manager_id=manager_id)
     
     # За последние 30 дней
-    month_report = AnalyticsReporter.get_manager_performance_report(
-        config.db.database, manager_id=manager_id, days=30
-    )
-    
-    # Получаем отчет о времени отклика
-    response_report = AnalyticsReporter.get_response_time_report(days=30)
-    response_stats = None
+    month_report = await db.get_manager_report(days=30, manager_id=manager_id)
     
-    # Ищем менеджера в отчете о времени отклика
-    for manager_report in response_report:
-        if str(manager_report['manager_id']) == str(manager_id):
-            response_stats = manager_report
-            break
+    # Время отклика за 30 дней
+    response_stats = month_report[0] if month_report and month_report[0]['response_count'] else None
     
     # Формируем сообщение
     stats_text = f"📊 *Статистика менеджера: {manager_name}*\n\n"
@@ -1,19 +1,14 @@
 from aiogram import types
 from database import Database
-from keyboards.reply import (
-    get_main_keyboard,
-    get_catalog_categories_keyboard,
-    get_catalog_subcategories_keyboard,
-    get_catalog_types_keyboard,
-    get_catalog_sizes_keyboard
-)
+from keyboards.reply import get_main_keyboard
 import logging
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from utils.nav_state import NavigationStateStore
 
 logger = logging.getLogger(__name__)
 
-# Словари для хранения выбранных значений пользователя
-user_catalog_selections = {}  # user_id -> {category, subcategory, type}
+# Выбор пользователей в каталоге: user_id -> NavigationState (category, subcategory, type_name)
+navigation_states = NavigationStateStore()
 
 
 async def handle_catalog(message: types.Message, db: Database):
@@ -23,13 +18,12 @@ async def handle_catalog(message: types.Message, db: Database):
     logger.info(f"User {username} (ID: {user_id}) requested catalog")
 
     # Очищаем предыдущие выборы пользователя, если есть
-    if user_id in user_catalog_selections:
-        del user_catalog_selections[user_id]
+    navigation_states.clear(user_id)
 
-    # Получаем список категорий из базы данных
-    categories = db.get_product_categories()
+    # Получаем дерево каталога
+    catalog = db.get_catalog_index()
     
-    if not categories:
+    if not catalog.categories:
         await message.answer(
             "В каталоге пока нет товаров. Пожалуйста, вернитесь позже.",
             reply_markup=get_main_keyboard()
@@ -38,7 +32,7 @@ async def handle_catalog(message: types.Message, db: Database):
     
     await message.answer(
         "Выберите категорию товаров:",
-        reply_markup=get_catalog_categories_keyboard(categories)
+        reply_markup=catalog.root.keyboard
     )
 
 
@@ -51,21 +45,22 @@ async def handle_category_selection(message: types.Message, db: Database):
     logger.info(f"User {username} (ID: {user_id}) selected category: {category}")
 
     # Сохраняем выбранную категорию
-    user_catalog_selections[user_id] = {"category": category}
+    navigation_states.start(user_id, category)
 
-    # Получаем список подкатегорий для выбранной категории
-    subcategories = db.get_product_subcategories(category)
+    # Получаем подкатегории выбранной категории
+    catalog = db.get_catalog_index()
+    category_node = catalog.node(category)
     
-    if not subcategories:
+    if category_node is None or not category_node.children:
         await message.answer(
             f"В категории {category} пока нет товаров. Пожалуйста, выберите другую категорию.",
-            reply_markup=get_catalog_categories_keyboard(db.get_product_categories())
+            reply_markup=catalog.root.keyboard
         )
         return
     
     await message.answer(
         f"Выберите подкатегорию в категории {category}:",
-        reply_markup=get_catalog_subcategories_keyboard(subcategories)
+        reply_markup=category_node.keyboard
     )
 
 
@@ -78,45 +73,41 @@ async def handle_subcategory_selection(message: types.Message, db: Database):
     logger.info(f"User {username} (ID: {user_id}) selected subcategory: {subcategory}")
 
     # Проверяем, что категория была выбрана ранее
-    if user_id not in user_catalog_selections:
+    state = navigation_states.get(user_id)
+    if state is None or not state.category:
         await handle_catalog(message, db)
         return
 
-    category = user_catalog_selections[user_id].get("category")
-    if not category:
-        await handle_catalog(message, db)
-        return
+    category = state.category
 
     # Сохраняем выбранную подкатегорию
-    user_catalog_selections[user_id]["subcategory"] = subcategory
+    navigation_states.update(user_id, subcategory=subcategory)
+
+    catalog = db.get_catalog_index()
+    subcategory_node = catalog.node(category, subcategory)
 
     # Для дисков проверяем, есть ли типы
-    if category == "Диски":
-        types = db.get_product_types(category, subcategory)
-        if types:
-            # Сохраняем информацию и показываем типы
-            await message.answer(
-                f"Выберите тип дисков в подкатегории {subcategory}:",
-                reply_markup=get_catalog_types_keyboard(types)
-            )
-            return
+    if category == "Диски" and subcategory_node is not None and subcategory_node.types:
+        # Сохраняем информацию и показываем типы
+        await message.answer(
+            f"Выберите тип дисков в подкатегории {subcategory}:",
+            reply_markup=subcategory_node.types_keyboard
+        )
+        return
 
     # Если это не диски или у дисков нет типов, показываем размеры
-    sizes = db.get_product_sizes(category, subcategory)
-    
-    if not sizes:
+    if subcategory_node is None or not subcategory_node.children:
+        category_node = catalog.node(category)
         await message.answer(
             f"В подкатегории {subcategory} пока нет размеров. "
             "Пожалуйста, выберите другую подкатегорию.",
-            reply_markup=get_catalog_subcategories_keyboard(
-                db.get_product_subcategories(category)
-            )
+            reply_markup=category_node.keyboard if category_node else catalog.root.keyboard
         )
         return
     
     await message.answer(
         f"Выберите размер в подкатегории {subcategory}:",
-        reply_markup=get_catalog_sizes_keyboard(sizes)
+        reply_markup=subcategory_node.keyboard
     )
 
 
@@ -129,33 +120,32 @@ async def handle_type_selection(message: types.Message, db: Database):
     logger.info(f"User {username} (ID: {user_id}) selected type: {type_name}")
 
     # Проверяем, что категория и подкатегория были выбраны ранее
-    if (user_id not in user_catalog_selections or 
-        "category" not in user_catalog_selections[user_id] or 
-        "subcategory" not in user_catalog_selections[user_id]):
+    state = navigation_states.get(user_id)
+    if state is None or state.category is None or state.subcategory is None:
         await handle_catalog(message, db)
         return
 
-    category = user_catalog_selections[user_id]["category"]
-    subcategory = user_catalog_selections[user_id]["subcategory"]
+    category = state.category
+    subcategory = state.subcategory
 
     # Сохраняем выбранный тип
-    user_catalog_selections[user_id]["type"] = type_name
+    navigation_states.update(user_id, type_name=type_name)
 
     # Получаем размеры для выбранного типа
-    sizes = db.get_product_sizes(category, subcategory, type_name)
+    catalog = db.get_catalog_index()
+    type_node = catalog.node(category, subcategory, type_name)
     
-    if not sizes:
+    if type_node is None or not type_node.children:
+        subcategory_node = catalog.node(category, subcategory)
         await message.answer(
             f"Для типа {type_name} пока нет размеров. Пожалуйста, выберите другой тип.",
-            reply_markup=get_catalog_types_keyboard(
-                db.get_product_types(category, subcategory)
-            )
+            reply_markup=subcategory_node.types_keyboard if subcategory_node else catalog.root.keyboard
         )
         return
     
     await message.answer(
         f"Выберите размер для типа {type_name}:",
-        reply_markup=get_catalog_sizes_keyboard(sizes)
+        reply_markup=type_node.keyboard
     )
 
 
@@ -168,25 +158,24 @@ async def handle_size_selection(message: types.Message, db: Database):
     logger.info(f"User {username} (ID: {user_id}) selected size: {size}")
 
     # Проверяем, что необходимые данные были выбраны ранее
-    if (user_id not in user_catalog_selections or 
-        "category" not in user_catalog_selections[user_id] or 
-        "subcategory" not in user_catalog_selections[user_id]):
+    state = navigation_states.get(user_id)
+    if state is None or state.category is None or state.subcategory is None:
         await handle_catalog(message, db)
         return
 
-    category = user_catalog_selections[user_id]["category"]
-    subcategory = user_catalog_selections[user_id]["subcategory"]
-    type_name = user_catalog_selections[user_id].get("type")  # Может быть None
+    category = state.category
+    subcategory = state.subcategory
+    type_name = state.type_name  # Может быть None
 
     # Получаем товары по выбранным параметрам
-    products = db.get_products_by_params(category, subcategory, type_name, size)
+    catalog = db.get_catalog_index()
+    sizes_node = catalog.node(category, subcategory, type_name)
+    products = catalog.products(category, subcategory, type_name, size)
     
     if not products:
         await message.answer(
             f"К сожалению, товары для размера {size} не найдены. Пожалуйста, выберите другой размер.",
-            reply_markup=get_catalog_sizes_keyboard(
-                db.get_product_sizes(category, subcategory, type_name)
-            )
+            reply_markup=sizes_node.keyboard if sizes_node else catalog.root.keyboard
         )
         return
 
@@ -217,21 +206,12 @@ async def handle_size_selection(message: types.Message, db: Database):
     # После отправки ссылки, отправляем сообщение с возможностью вернуться
     back_text = "Хотите посмотреть другие товары?"
     
-    # В зависимости от уровня навигации определяем, куда вернуться
-    if type_name:
-        # Если был выбран тип, возвращаемся к выбору размера для того же типа
-        sizes = db.get_product_sizes(category, subcategory, type_name)
-        await message.answer(
-            back_text,
-            reply_markup=get_catalog_sizes_keyboard(sizes)
-        )
-    else:
-        # Если тип не выбирался, возвращаемся к выбору размера для той же подкатегории
-        sizes = db.get_product_sizes(category, subcategory)
-        await message.answer(
-            back_text,
-            reply_markup=get_catalog_sizes_keyboard(sizes)
-        )
+    # Возвращаемся к выбору размера на том же уровне навигации:
+    # для выбранного типа или для всей подкатегории, если тип не выбирался
+    await message.answer(
+        back_text,
+        reply_markup=sizes_node.keyboard
+    )
 
 
 async def handle_back_to_categories(message: types.Message, db: Database):
@@ -239,8 +219,7 @@ async def handle_back_to_categories(message: types.Message, db: Database):
     user_id = message.from_user.id
     
     # Очищаем выбор пользователя
-    if user_id in user_catalog_selections:
-        del user_catalog_selections[user_id]
+    navigation_states.clear(user_id)
     
     # Возвращаемся к списку категорий
     await handle_catalog(message, db)
@@ -251,23 +230,25 @@ async def handle_back_to_subcategories(message: types.Message, db: Database):
     user_id = message.from_user.id
     
     # Проверяем, что категория была выбрана
-    if user_id not in user_catalog_selections or "category" not in user_catalog_selections[user_id]:
+    state = navigation_states.get(user_id)
+    if state is None or state.category is None:
         await handle_catalog(message, db)
         return
     
-    category = user_catalog_selections[user_id]["category"]
+    category = state.category
     
     # Удаляем выбор подкатегории и типа, если есть
-    if "subcategory" in user_catalog_selections[user_id]:
-        del user_catalog_selections[user_id]["subcategory"]
-    if "type" in user_catalog_selections[user_id]:
-        del user_catalog_selections[user_id]["type"]
+    navigation_states.update(user_id, subcategory=None, type_name=None)
     
-    # Получаем список подкатегорий и отображаем их
-    subcategories = db.get_product_subcategories(category)
+    # Отображаем подкатегории
+    category_node = db.get_catalog_index().node(category)
+    if category_node is None:
+        await handle_catalog(message, db)
+        return
+
     await message.answer(
         f"Выберите подкатегорию в категории {category}:",
-        reply_markup=get_catalog_subcategories_keyboard(subcategories)
+        reply_markup=category_node.keyboard
     )
 
 
@@ -276,13 +257,14 @@ async def handle_back_from_sizes(message: types.Message, db: Database):
     user_id = message.from_user.id
     
     # Проверяем, что необходимые данные были выбраны
-    if user_id not in user_catalog_selections:
+    state = navigation_states.get(user_id)
+    if state is None:
         await handle_catalog(message, db)
         return
     
-    category = user_catalog_selections[user_id].get("category")
-    subcategory = user_catalog_selections[user_id].get("subcategory")
-    type_name = user_catalog_selections[user_id].get("type")
+    category = state.category
+    subcategory = state.subcategory
+    type_name = state.type_name
     
     if not category or not subcategory:
         await handle_catalog(message, db)
@@ -290,14 +272,14 @@ async def handle_back_from_sizes(message: types.Message, db: Database):
     
     # Если был выбран тип, возвращаемся к выбору типа
     if type_name:
-        types = db.get_product_types(category, subcategory)
-        if types:
+        subcategory_node = db.get_catalog_index().node(category, subcategory)
+        if subcategory_node is not None and subcategory_node.types:
             await message.answer(
                 f"Выберите тип дисков в подкатегории {subcategory}:",
-                reply_markup=get_catalog_types_keyboard(types)
+                reply_markup=subcategory_node.types_keyboard
             )
             # Удаляем выбор типа
-            del user_catalog_selections[user_id]["type"]
+            navigation_states.update(user_id, type_name=None)
             return
     
     # В противном случае возвращаемся к выбору подкатегории
@@ -1,19 +1,27 @@
 from aiogram import types, Bot
-from database import Database
+from aiogram.exceptions import TelegramBadRequest
+from database import AsyncDatabase
 from keyboards import (
     get_main_keyboard, 
     get_chat_keyboard, 
     get_manager_keyboard, 
     get_rating_keyboard,
     get_share_contact_keyboard,
-    get_admin_keyboard
+    get_admin_keyboard,
+    get_history_page_keyboard,
+    HISTORY_CALLBACK_PREFIX
 )
 import logging
 from datetime import datetime
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+from utils.notifications import NotificationDispatcher
+from utils.logger import ManagerMetrics
 
 logger = logging.getLogger(__name__)
 
+# Количество сообщений на странице истории
+HISTORY_PAGE_SIZE = 10
+
 
 async def handle_start(message: types.Message, config=None, db=None):
     user_id = message.from_user.id
@@ -23,7 +31,7 @@ async def handle_start(message: types.Message, config=None, db=None):
     
     if is_manager:
         # Проверяем, является ли менеджер администратором
-        is_admin = db and db.is_admin(user_id)
+        is_admin = db and await db.is_admin(user_id)
         
         if is_admin:
             # Если это администратор, показываем меню с опцией администратора
@@ -52,7 +60,7 @@ async def handle_start(message: types.Message, config=None, db=None):
         client_info = None
         if db:
             try:
-                client_info = db.get_client_contact_info(user_id)
+                client_info = await db.get_client_contact_info(user_id)
                 logger.info(f"Получена информация о клиенте: {client_info}")
             except Exception as e:
                 logger.error(f"Ошибка при получении данных клиента: {e}")
@@ -77,13 +85,14 @@ async def handle_start(message: types.Message, config=None, db=None):
             logger.info(f"Новый пользователь: {user_id}")
 
 
-async def handle_support_request(message: types.Message, bot: Bot, db: Database, config):
+async def handle_support_request(message: types.Message, bot: Bot, db: AsyncDatabase, config,
+                                 notifier: NotificationDispatcher):
     """Обработка запроса на связь с менеджером"""
     user_id = message.from_user.id
     username = message.from_user.username or message.from_user.first_name
 
-    # Проверяем наличие свободных менеджеров
-    available_managers = db.get_available_managers_count()
+    # Проверяем наличие свободных менеджеров (по очереди менеджеров в памяти)
+    available_managers = db.assigner.available_count()
     logger.info(f"Available managers: {available_managers}")
 
     if available_managers <= 0:
@@ -95,7 +104,7 @@ async def handle_support_request(message: types.Message, bot: Bot, db: Database,
         return
 
     # Проверяем, не находится ли пользователь уже в чате
-    if db.is_client_in_active_chat(user_id):
+    if await db.is_client_in_active_chat(user_id):
         await message.answer(
             "У вас уже есть активный чат с менеджером.",
             reply_markup=get_chat_keyboard()
@@ -103,11 +112,11 @@ async def handle_support_request(message: types.Message, bot: Bot, db: Database,
         return
 
     # Проверяем, есть ли у пользователя контактные данные в базе
-    client_info = db.get_client_contact_info(user_id)
+    client_info = await db.get_client_contact_info(user_id)
     
     if client_info and client_info[0] and client_info[1]:  # Если есть имя и телефон
         # Создаем чат без запроса контактных данных
-        if not db.create_chat(user_id, username):
+        if not await db.create_chat(user_id, username):
             logger.error(f"Не удалось создать чат для пользователя {user_id}")
             await message.answer(
                 "Произошла ошибка при создании чата. Пожалуйста, попробуйте позже.",
@@ -122,7 +131,7 @@ async def handle_support_request(message: types.Message, bot: Bot, db: Database,
         )
         
         # Получаем доступного менеджера с наименьшей нагрузкой
-        manager_id = db.get_available_manager()
+        manager_id = db.assigner.pick() or 0
         
         # Получаем данные клиента
         client_name = client_info[0]
@@ -141,25 +150,19 @@ async def handle_support_request(message: types.Message, bot: Bot, db: Database,
         # Отправляем уведомление менеджеру(ам)
         if manager_id > 0:
             # Уведомляем конкретного менеджера
-            await bot.send_message(
+            await notifier.send(
                 manager_id,
                 client_info_text,
                 reply_markup=manager_keyboard
             )
             logger.info(f"Запрос на чат отправлен менеджеру {manager_id}")
         else:
-            # Уведомляем всех менеджеров
-            notification_sent = False
-            for mgr_id in config.config.managers:
-                try:
-                    await bot.send_message(
-                        mgr_id,
-                        client_info_text,
-                        reply_markup=manager_keyboard
-                    )
-                    notification_sent = True
-                except Exception as e:
-                    logger.error(f"Ошибка отправки уведомления менеджеру {mgr_id}: {e}")
+            # Уведомляем всех менеджеров одновременно
+            notification_sent = await notifier.fan_out(
+                config.config.managers,
+                client_info_text,
+                reply_markup=manager_keyboard
+            )
             
             if notification_sent:
                 logger.info("Запрос на чат отправлен всем менеджерам")
@@ -178,13 +181,13 @@ async def handle_support_request(message: types.Message, bot: Bot, db: Database,
         )
 
 
-async def handle_share_contact(message: types.Message, bot: Bot, db: Database, config):
+async def handle_share_contact(message: types.Message, bot: Bot, db: AsyncDatabase, config):
     """Обработка нажатия на кнопку 'Поделиться контактом'"""
     user_id = message.from_user.id
     username = message.from_user.username or message.from_user.first_name
     
     # Создаем или обновляем запись в базе данных 
-    if not db.create_chat(user_id, username):
+    if not await db.create_chat(user_id, username):
         logger.error(f"Failed to create chat record for user {user_id}")
         await message.answer(
             "Произошла ошибка при подготовке чата. Пожалуйста, попробуйте позже.",
@@ -199,7 +202,8 @@ async def handle_share_contact(message: types.Message, bot: Bot, db: Database, c
     )
 
 
-async def process_contact_data(message: types.Message, bot: Bot, db: Database, config):
+async def process_contact_data(message: types.Message, bot: Bot, db: AsyncDatabase, config,
+                               notifier: NotificationDispatcher):
     """Обработка полученных контактных данных"""
     user_id = message.from_user.id
     username = message.from_user.username or message.from_user.first_name
@@ -212,43 +216,12 @@ async def process_contact_data(message: types.Message, bot: Bot, db: Database, c
     
     logger.info(f"Получен контакт от пользователя {user_id}: имя={name}, телефон={phone}")
     
-    # Перезагружаем базу данных перед дальнейшими операциями
-    # для применения возможных изменений структуры таблиц
-    try:
-        if "_create_tables" in dir(db):
-            db._create_tables()
-            logger.info("Структура базы данных обновлена")
-    except Exception as e:
-        logger.error(f"Ошибка при обновлении структуры базы данных: {e}")
-    
-    # Проверяем существование таблицы и полей для отладки
-    try:
-        conn, cursor = db._get_connection()
-        cursor.execute("PRAGMA table_info(chats)")
-        columns = cursor.fetchall()
-        column_names = [col[1] for col in columns]
-        logger.info(f"Структура таблицы chats: {column_names}")
-        
-        # Проверяем запись для текущего пользователя
-        cursor.execute("SELECT * FROM chats WHERE client_id = ?", (user_id,))
-        user_record = cursor.fetchone()
-        if user_record:
-            logger.info(f"Найдена запись для пользователя: {user_record}")
-        else:
-            logger.info(f"Запись для пользователя {user_id} не найдена")
-    except Exception as e:
-        logger.error(f"Ошибка при проверке структуры базы данных: {e}")
-    finally:
-        if 'conn' in locals():
-            conn.close()
-            delattr(db._local, 'connection')
-    
     # Проверяем, существует ли запись в базе данных для этого пользователя
     # и создаем ее, если она отсутствует
-    chat_info = db.get_client_contact_info(user_id)
+    chat_info = await db.get_client_contact_info(user_id)
     if not chat_info:
         logger.info(f"Не найдена существующая запись для пользователя {user_id}, создаем новую")
-        if not db.create_chat(user_id, username):
+        if not await db.create_chat(user_id, username):
             logger.error(f"Не удалось создать запись чата для пользователя {user_id}")
             await message.answer(
                 "Произошла ошибка при создании чата. Пожалуйста, попробуйте позже.",
@@ -262,7 +235,7 @@ async def process_contact_data(message: types.Message, bot: Bot, db: Database, c
     # Сохраняем данные клиента
     try:
         logger.info(f"Попытка сохранить контактные данные: user_id={user_id}, name={name}, phone={phone}")
-        success = db.save_client_contact_info(user_id, name, phone, username)
+        success = await db.save_client_contact_info(user_id, name, phone, username)
         if not success:
             logger.error(f"Не удалось сохранить контактные данные для пользователя {user_id}")
             await message.answer(
@@ -281,7 +254,7 @@ async def process_contact_data(message: types.Message, bot: Bot, db: Database, c
     
     # Проверяем, сохранились ли данные
     try:
-        updated_info = db.get_client_contact_info(user_id)
+        updated_info = await db.get_client_contact_info(user_id)
         logger.info(f"Проверка после сохранения: {updated_info}")
     except Exception as e:
         logger.error(f"Ошибка при проверке сохраненных данных: {e}")
@@ -294,7 +267,7 @@ async def process_contact_data(message: types.Message, bot: Bot, db: Database, c
     )
     
     # Получаем доступного менеджера с наименьшей нагрузкой
-    manager_id = db.get_available_manager()
+    manager_id = await db.get_available_manager()
     logger.info(f"Available manager for user {user_id}: {manager_id}")
     
     # Формируем сообщение с данными клиента
@@ -309,18 +282,12 @@ async def process_contact_data(message: types.Message, bot: Bot, db: Database, c
     
     # Определяем вспомогательную функцию для отправки уведомлений всем менеджерам
     async def send_to_all_managers():
-        notification_sent = False
-        for mgr_id in config.config.managers:
-            try:
-                await bot.send_message(
-                    mgr_id,
-                    client_info,
-                    reply_markup=manager_keyboard
-                )
-                notification_sent = True
-                logger.info(f"Chat request sent to manager {mgr_id}")
-            except Exception as e:
-                logger.error(f"Error sending notification to manager {mgr_id}: {e}")
+        notification_sent = await notifier.fan_out(
+            config.config.managers,
+            client_info,
+            reply_markup=manager_keyboard
+        )
+        logger.info(f"Chat request sent to {notification_sent} of {len(config.config.managers)} managers")
         
         if not notification_sent:
             logger.error(f"Failed to notify any manager for user {user_id}")
@@ -332,15 +299,9 @@ async def process_contact_data(message: types.Message, bot: Bot, db: Database, c
     
     if manager_id > 0:
         # Уведомляем конкретного менеджера
-        try:
-            await bot.send_message(
-                manager_id,
-                client_info,
-                reply_markup=manager_keyboard
-            )
+        if await notifier.send(manager_id, client_info, reply_markup=manager_keyboard):
             logger.info(f"Chat request sent to manager {manager_id}")
-        except Exception as e:
-            logger.error(f"Error sending message to manager {manager_id}: {str(e)}")
+        else:
             # Если не удалось отправить конкретному менеджеру, отправляем всем
             await send_to_all_managers()
     else:
@@ -348,29 +309,8 @@ async def process_contact_data(message: types.Message, bot: Bot, db: Database, c
         await send_to_all_managers()
 
 
-async def handle_chat_history(message: types.Message, db: Database):
-    """Отображение истории сообщений для пользователя"""
-    user_id = message.from_user.id
-    
-    # Проверяем, есть ли у пользователя активный чат
-    if not db.is_client_in_active_chat(user_id):
-        await message.answer(
-            "У вас нет активного чата с менеджером.",
-            reply_markup=get_main_keyboard()
-        )
-        return
-    
-    # Получаем историю сообщений
-    messages = db.get_chat_history(user_id)
-    
-    if not messages:
-        await message.answer(
-            "История сообщений пуста.",
-            reply_markup=get_chat_keyboard()
-        )
-        return
-    
-    # Форматируем сообщения для вывода
+def _format_history_page(messages: list, user_id: int) -> str:
+    """Текст страницы истории сообщений"""
     history_text = "📋 История сообщений:\n\n"
     
     for msg in messages:
@@ -411,14 +351,74 @@ async def handle_chat_history(message: types.Message, db: Database):
         # Добавляем форматированное сообщение
         history_text += f"{time_str} - {sender} {type_icon}:\n{msg_text}{view_command}\n\n"
     
-    # Отправляем историю
+    return history_text
+
+
+async def handle_chat_history(message: types.Message, db: AsyncDatabase):
+    """Отображение последней страницы истории сообщений для пользователя"""
+    user_id = message.from_user.id
+    
+    # Проверяем, есть ли у пользователя активный чат
+    if not await db.is_client_in_active_chat(user_id):
+        await message.answer(
+            "У вас нет активного чата с менеджером.",
+            reply_markup=get_main_keyboard()
+        )
+        return
+    
+    # Получаем последнюю страницу истории
+    messages, has_older, has_newer = await db.get_chat_history_page(user_id, limit=HISTORY_PAGE_SIZE)
+    
+    if not messages:
+        await message.answer(
+            "История сообщений пуста.",
+            reply_markup=get_chat_keyboard()
+        )
+        return
+    
+    # Если страниц несколько, под сообщением показываем кнопки листания
+    pager = get_history_page_keyboard(messages[0][0], messages[-1][0], has_older, has_newer)
     await message.answer(
-        history_text,
-        reply_markup=get_chat_keyboard()
+        _format_history_page(messages, user_id),
+        reply_markup=pager or get_chat_keyboard()
     )
 
 
-async def handle_view_media(message: types.Message, db: Database, bot: Bot):
+async def handle_history_page(callback: types.CallbackQuery, db: AsyncDatabase):
+    """Переход к предыдущей или следующей странице истории сообщений"""
+    user_id = callback.from_user.id
+    
+    try:
+        direction, cursor = callback.data[len(HISTORY_CALLBACK_PREFIX):].split(":")
+        cursor = int(cursor)
+    except ValueError:
+        logger.error(f"Invalid history callback data: {callback.data}")
+        await callback.answer()
+        return
+    
+    if direction == "older":
+        page = await db.get_chat_history_page(user_id, before_id=cursor, limit=HISTORY_PAGE_SIZE)
+    else:
+        page = await db.get_chat_history_page(user_id, after_id=cursor, limit=HISTORY_PAGE_SIZE)
+    messages, has_older, has_newer = page
+    
+    if not messages:
+        await callback.answer("Больше сообщений нет")
+        return
+    
+    try:
+        await callback.message.edit_text(
+            _format_history_page(messages, user_id),
+            reply_markup=get_history_page_keyboard(messages[0][0], messages[-1][0], has_older, has_newer)
+        )
+    except TelegramBadRequest as e:
+        # Повторное нажатие той же кнопки дает ту же страницу
+        if "message is not modified" not in str(e):
+            raise
+    await callback.answer()
+
+
+async def handle_view_media(message: types.Message, db: AsyncDatabase, bot: Bot):
     """Отображение медиа-файла из истории по ID сообщения"""
     user_id = message.from_user.id
     
@@ -431,15 +431,8 @@ async def handle_view_media(message: types.Message, db: Database, bot: Bot):
         msg_id = int(message.text.replace("/view_", ""))
         logger.info(f"User {user_id} requested media view for message ID: {msg_id}")
         
-        # Получаем историю сообщений
-        messages = db.get_chat_history(user_id)
-        
-        # Ищем нужное сообщение
-        target_msg = None
-        for msg in messages:
-            if msg[0] == msg_id:
-                target_msg = msg
-                break
+        # Сообщение ищется только в чате пользователя
+        target_msg = await db.get_message_by_id(user_id, msg_id)
         
         if not target_msg:
             logger.warning(f"Message ID {msg_id} not found for user {user_id}")
@@ -505,7 +498,7 @@ async def handle_view_media(message: types.Message, db: Database, bot: Bot):
         await message.answer("Произошла ошибка при загрузке файла")
 
 
-async def handle_rate_chat_request(message: types.Message, db: Database):
+async def handle_rate_chat_request(message: types.Message, db: AsyncDatabase):
     """Отправляет запрос на оценку чата"""
     user_id = message.from_user.id
     
@@ -515,7 +508,22 @@ async def handle_rate_chat_request(message: types.Message, db: Database):
     )
 
 
-async def handle_rating(message: types.Message, db: Database):
+def _log_rating(session: dict, user_id: int, rating: int, comment: str = None):
+    """Запись оценки в метрики менеджера, который вел обращение клиента"""
+    if not session or not session['manager_id']:
+        return
+    try:
+        ManagerMetrics.log_rating_received(
+            client_id=user_id,
+            manager_id=session['manager_id'],
+            rating=rating,
+            comment=comment
+        )
+    except Exception as e:
+        logger.error(f"Error logging rating: {e}")
+
+
+async def handle_rating(message: types.Message, db: AsyncDatabase):
     """Обработка оценки чата"""
     user_id = message.from_user.id
     
@@ -531,56 +539,11 @@ async def handle_rating(message: types.Message, db: Database):
             await message.answer("Оценка должна быть от 1 до 5")
             return
         
-        # Получаем информацию о чате для логирования
-        active_chat = db.get_active_chat_by_client_id(user_id)
-        last_chat = None
-        
-        # Если чат все еще активен, используем его для логирования
-        if active_chat and active_chat[1]:
-            manager_id = active_chat[1]
-            
-            # Логируем оценку
-            try:
-                from utils.logger import ManagerMetrics
-                ManagerMetrics.log_rating_received(
-                    client_id=user_id,
-                    manager_id=manager_id,
-                    rating=rating
-                )
-            except Exception as e:
-                logger.error(f"Error logging rating: {e}")
-        else:
-            # Чат завершен, нужно найти последний чат пользователя
-            try:
-                # Получаем историю сообщений для определения менеджера
-                chat_history = db.get_chat_history(user_id, limit=10)
-                if chat_history:
-                    # Ищем сообщения от менеджера
-                    manager_ids = set()
-                    for msg in chat_history:
-                        sender_id = msg[2]
-                        if sender_id != user_id:  # Если отправитель не клиент, это менеджер
-                            manager_ids.add(sender_id)
-                    
-                    if manager_ids:
-                        # Берем первого найденного менеджера
-                        manager_id = next(iter(manager_ids))
-                        
-                        # Логируем оценку
-                        try:
-                            from utils.logger import ManagerMetrics
-                            ManagerMetrics.log_rating_received(
-                                client_id=user_id,
-                                manager_id=manager_id,
-                                rating=rating
-                            )
-                        except Exception as e:
-                            logger.error(f"Error logging rating for closed chat: {e}")
-            except Exception as e:
-                logger.error(f"Error finding manager for rating: {e}")
+        # Логируем оценку для менеджера текущего обращения
+        _log_rating(await db.get_current_session(user_id), user_id, rating)
         
         # Сохраняем оценку
-        if db.save_chat_rating(user_id, rating):
+        if await db.save_chat_rating(user_id, rating):
             await message.answer(
                 f"Спасибо за вашу оценку: {rating}/5!\n"
                 "Если у вас есть комментарий, отправьте его следующим сообщением "
@@ -599,7 +562,7 @@ async def handle_rating(message: types.Message, db: Database):
         await message.answer("Некорректная оценка", reply_markup=get_rating_keyboard())
 
 
-async def handle_rating_comment(message: types.Message, db: Database):
+async def handle_rating_comment(message: types.Message, db: AsyncDatabase):
     """Обработка комментария к оценке"""
     user_id = message.from_user.id
     
@@ -611,50 +574,23 @@ async def handle_rating_comment(message: types.Message, db: Database):
         return
     
     # Получаем текущую оценку
-    rating_data = db.get_chat_rating(user_id)
+    session = await db.get_current_session(user_id)
     
-    if not rating_data:
+    if not session or session['rating'] is None:
         await message.answer(
             "Сначала нужно оценить чат.",
             reply_markup=get_rating_keyboard()
         )
         return
     
-    rating = rating_data[0]
+    rating = session['rating']
     comment = message.text
     
-    # Получаем информацию о чате для логирования
-    try:
-        # Получаем историю сообщений для определения менеджера
-        chat_history = db.get_chat_history(user_id, limit=10)
-        if chat_history:
-            # Ищем сообщения от менеджера
-            manager_ids = set()
-            for msg in chat_history:
-                sender_id = msg[2]
-                if sender_id != user_id:  # Если отправитель не клиент, это менеджер
-                    manager_ids.add(sender_id)
-            
-            if manager_ids:
-                # Берем первого найденного менеджера
-                manager_id = next(iter(manager_ids))
-                
-                # Логируем комментарий к оценке
-                try:
-                    from utils.logger import ManagerMetrics
-                    ManagerMetrics.log_rating_received(
-                        client_id=user_id,
-                        manager_id=manager_id,
-                        rating=rating,
-                        comment=comment
-                    )
-                except Exception as e:
-                    logger.error(f"Error logging rating comment: {e}")
-    except Exception as e:
-        logger.error(f"Error finding manager for rating comment: {e}")
+    # Логируем комментарий к оценке
+    _log_rating(session, user_id, rating, comment)
     
     # Обновляем запись с комментарием
-    if db.save_chat_rating(user_id, rating, comment):
+    if await db.save_chat_rating(user_id, rating, comment):
         await message.answer(
             "Спасибо за ваш отзыв!",
             reply_markup=get_main_keyboard()
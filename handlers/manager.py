@@ -1,5 +1,5 @@
 from aiogram import types, Bot
-from database import Database
+from database import AsyncDatabase
 from keyboards import (
     get_chat_keyboard, 
     get_main_keyboard, 
@@ -9,13 +9,17 @@ from keyboards import (
     get_extended_chat_keyboard
 )
 from utils.logger import ManagerMetrics
-from datetime import datetime
+import logging
 
+logger = logging.getLogger(__name__)
 
-async def handle_accept_chat(message: types.Message, bot: Bot, db: Database, managers_list: list):
+# Сколько чатов из очереди пробовать, если их одновременно принимают другие менеджеры
+TAKE_NEXT_ATTEMPTS = 5
+
+
+async def handle_accept_chat(message: types.Message, bot: Bot, db: AsyncDatabase, managers_list: list):
     """Обработчик для принятия чата менеджером"""
     manager_id = message.from_user.id
-    manager_name = message.from_user.first_name or "Менеджер"
     
     # Проверяем, является ли пользователь менеджером
     if manager_id not in managers_list:
@@ -33,90 +37,122 @@ async def handle_accept_chat(message: types.Message, bot: Bot, db: Database, man
         username = username_part.strip()
 
     # Находим чат в БД и активируем его
-    client_id = db.get_client_id_by_username(username)
+    client_id = await db.get_client_id_by_username(username)
     if not client_id:
         await message.answer("Не удалось найти чат с указанным пользователем")
         return
         
-    # Проверяем, не занят ли уже чат другим менеджером
-    if db.is_client_in_active_chat(client_id):
-        active_chat = db.get_active_chat_by_client_id(client_id)
-        if active_chat and active_chat[1] and active_chat[1] != manager_id:
+    # Время ожидания фиксируем до принятия: после него чат уходит из очереди
+    pending = db.pending_queue.get(client_id)
+    response_time = pending.wait_time() if pending else None
+
+    # Активируем чат и обновляем счетчики менеджера одной транзакцией;
+    # при одновременном нажатии чат достается только одному менеджеру
+    if not await db.accept_chat(client_id, manager_id):
+        if db.routing.manager_of(client_id) == manager_id:
+            await message.answer(
+                "Вы уже подключены к этому чату.",
+                reply_markup=get_extended_chat_keyboard()
+            )
+        else:
             await message.answer(
                 f"Этот чат уже принят другим менеджером.",
                 reply_markup=get_main_keyboard()
             )
+        return
+
+    await _start_chat(message, bot, db, client_id, username, response_time)
+
+
+async def handle_take_next_chat(message: types.Message, bot: Bot, db: AsyncDatabase, managers_list: list):
+    """Обработчик для принятия чата, дольше всех ожидающего в очереди
+
+    Кнопка есть и в списке ожидающих чатов панели администратора, поэтому
+    чат из очереди может взять и администратор, не входящий в MANAGERS_IDS.
+    """
+    manager_id = message.from_user.id
+
+    if manager_id not in managers_list and not await db.is_admin(manager_id):
+        return
+
+    # Если самый старый чат одновременно принял другой менеджер, он уходит из
+    # очереди и берется следующий
+    accepted = False
+    for _ in range(TAKE_NEXT_ATTEMPTS):
+        pending = db.pending_queue.oldest()
+        if pending is None:
+            await message.answer(
+                "В очереди нет ожидающих чатов.",
+                reply_markup=get_manager_status_keyboard()
+            )
             return
-    
+        response_time = pending.wait_time()
+        if await db.accept_chat(pending.client_id, manager_id):
+            accepted = True
+            break
+        if pending.client_id in db.pending_queue:
+            # Чат остался в очереди - это ошибка базы, а не проигранная гонка
+            logger.error(f"Manager {manager_id} failed to accept chat {pending.client_id}")
+            break
+
+    if not accepted:
+        await message.answer(
+            "Не удалось принять чат. Попробуйте еще раз позже.",
+            reply_markup=get_manager_status_keyboard()
+        )
+        return
+
+    await _start_chat(message, bot, db, pending.client_id, pending.username, response_time)
+
+
+async def _start_chat(message: types.Message, bot: Bot, db: AsyncDatabase, client_id: int,
+                      username: str, response_time: float = None):
+    """Приветствие клиента и уведомление менеджера после принятия чата"""
+    manager_id = message.from_user.id
+    manager_name = message.from_user.first_name or "Менеджер"
+
     # Получаем имя клиента из контактной информации
-    client_contact = db.get_client_contact_info(client_id)
+    client_contact = await db.get_client_contact_info(client_id)
     client_name = client_contact[0] if client_contact and client_contact[0] else username
+
+    # Уведомляем клиента о подключении менеджера
+    await bot.send_message(
+        client_id,
+        "Менеджер подключился к чату. Вы можете задать ваш вопрос.",
+        reply_markup=get_chat_keyboard()
+    )
     
-    # Активируем чат и обновляем счетчики для менеджера
-    if db.activate_chat(client_id, manager_id):
-        # Увеличиваем счетчик активных чатов менеджера
-        db.increment_manager_active_chats(manager_id)
-        
-        # Обновляем активность менеджера
-        db.update_manager_activity(manager_id)
-        
-        # Уведомляем клиента о подключении менеджера
-        await bot.send_message(
-            client_id,
-            "Менеджер подключился к чату. Вы можете задать ваш вопрос.",
-            reply_markup=get_chat_keyboard()
-        )
-        
-        # Отправляем автоматическое приветствие от имени менеджера
-        greeting_message = f"Здравствуйте, {client_name}! Меня зовут {manager_name}. Чем могу вам помочь?"
-        await bot.send_message(
-            client_id,
-            greeting_message,
-            reply_markup=get_chat_keyboard()
-        )
-        
-        # Сохраняем приветственное сообщение в истории
-        db.save_message(client_id, manager_id, greeting_message, 'text')
-        
-        # Уведомляем менеджера
-        await message.answer(
-            f"Вы подключились к чату с клиентом {username}",
-            reply_markup=get_extended_chat_keyboard()
-        )
+    # Отправляем автоматическое приветствие от имени менеджера
+    greeting_message = f"Здравствуйте, {client_name}! Меня зовут {manager_name}. Чем могу вам помочь?"
+    await bot.send_message(
+        client_id,
+        greeting_message,
+        reply_markup=get_chat_keyboard()
+    )
+    
+    # Сохраняем приветственное сообщение в истории
+    await db.save_message(client_id, manager_id, greeting_message, 'text')
+    
+    # Уведомляем менеджера
+    await message.answer(
+        f"Вы подключились к чату с клиентом {username}",
+        reply_markup=get_extended_chat_keyboard()
+    )
+
+    # Логируем принятие чата для аналитики; время отклика - время ожидания в очереди
+    ManagerMetrics.log_chat_accepted(
+        client_id=client_id,
+        manager_id=manager_id,
+        response_time=response_time
+    )
 
-        # Логируем принятие чата для аналитики
-        try:
-            # Получаем сообщения из чата для определения времени создания
-            chat_history = db.get_chat_history(client_id, limit=1)
-            if chat_history:
-                # Берем время первого сообщения как время создания чата
-                chat_start_time = datetime.fromisoformat(chat_history[-1][5].replace(' ', 'T'))
-                response_time = (datetime.now() - chat_start_time).total_seconds()
-                
-                # Логируем событие с временем отклика
-                ManagerMetrics.log_chat_accepted(
-                    client_id=client_id,
-                    manager_id=manager_id,
-                    response_time=response_time
-                )
-            else:
-                # Если история пуста, просто логируем принятие чата без времени отклика
-                ManagerMetrics.log_chat_accepted(
-                    client_id=client_id,
-                    manager_id=manager_id
-                )
-        except Exception as e:
-            # Если возникает ошибка при логировании, игнорируем её,
-            # чтобы не прерывать основной процесс
-            pass
-
-
-async def handle_manager_status(message: types.Message, db: Database):
+
+async def handle_manager_status(message: types.Message, db: AsyncDatabase):
     """Обработчик для управления статусом менеджера"""
     manager_id = message.from_user.id
     
     # Получаем статистику менеджера
-    stats = db.get_manager_stats(manager_id)
+    stats = await db.get_manager_stats(manager_id)
     if not stats:
         await message.answer("Не удалось получить информацию о вашем статусе")
         return
@@ -133,11 +169,11 @@ async def handle_manager_status(message: types.Message, db: Database):
     )
 
 
-async def handle_set_availability(message: types.Message, db: Database, available: bool):
+async def handle_set_availability(message: types.Message, db: AsyncDatabase, available: bool):
     """Обработчик для установки доступности менеджера"""
     manager_id = message.from_user.id
     
-    if db.set_manager_availability(manager_id, available):
+    if await db.set_manager_availability(manager_id, available):
         status = "доступен для новых чатов" if available else "недоступен для новых чатов"
         await message.answer(
             f"Ваш статус изменен. Теперь вы {status}.",
@@ -150,11 +186,11 @@ async def handle_set_availability(message: types.Message, db: Database, availabl
         )
 
 
-async def handle_manager_active_chats(message: types.Message, db: Database):
+async def handle_manager_active_chats(message: types.Message, db: AsyncDatabase):
     """Обработчик для отображения активных чатов менеджера"""
     manager_id = message.from_user.id
     
-    active_chats = db.get_active_chats_by_manager(manager_id)
+    active_chats = await db.get_active_chats_by_manager(manager_id)
     
     if not active_chats:
         await message.answer(
@@ -169,7 +205,7 @@ async def handle_manager_active_chats(message: types.Message, db: Database):
     )
 
 
-async def handle_chat_selection(message: types.Message, db: Database):
+async def handle_chat_selection(message: types.Message, db: AsyncDatabase):
     """Обработчик для выбора чата из списка"""
     manager_id = message.from_user.id
     
@@ -181,7 +217,7 @@ async def handle_chat_selection(message: types.Message, db: Database):
     client_info = text.replace("Чат с ", "")
     
     # Ищем клиента по имени и телефону
-    active_chats = db.get_active_chats_by_manager(manager_id)
+    active_chats = await db.get_active_chats_by_manager(manager_id)
     target_client_id = None
     
     for chat in active_chats:
@@ -202,6 +238,9 @@ async def handle_chat_selection(message: types.Message, db: Database):
         )
         return
     
+    # Сообщения менеджера теперь пересылаются этому клиенту
+    db.routing.focus(manager_id, target_client_id)
+
     # Показываем клавиатуру чата
     await message.answer(
         f"Вы в чате с клиентом {client_info}",
@@ -209,12 +248,12 @@ async def handle_chat_selection(message: types.Message, db: Database):
     )
 
 
-async def handle_transfer_chat_request(message: types.Message, db: Database):
+async def handle_transfer_chat_request(message: types.Message, db: AsyncDatabase):
     """Обработчик для запроса на передачу чата другому менеджеру"""
     manager_id = message.from_user.id
     
     # Проверяем, есть ли у менеджера активный чат
-    active_chat = db.get_active_chat(manager_id)
+    active_chat = await db.get_active_chat(manager_id)
     if not active_chat:
         await message.answer(
             "У вас нет активного чата для передачи",
@@ -223,7 +262,7 @@ async def handle_transfer_chat_request(message: types.Message, db: Database):
         return
     
     # Получаем список доступных менеджеров
-    managers = db.get_all_managers()
+    managers = await db.get_all_managers()
     available_managers = [m for m in managers if m[0] != manager_id]
     
     if not available_managers:
@@ -239,12 +278,12 @@ async def handle_transfer_chat_request(message: types.Message, db: Database):
     )
 
 
-async def handle_transfer_chat(message: types.Message, bot: Bot, db: Database):
+async def handle_transfer_chat(message: types.Message, bot: Bot, db: AsyncDatabase):
     """Обработчик для передачи чата другому менеджеру"""
     manager_id = message.from_user.id
     
     # Проверяем, есть ли у менеджера активный чат
-    active_chat = db.get_active_chat(manager_id)
+    active_chat = await db.get_active_chat(manager_id)
     if not active_chat:
         await message.answer(
             "У вас нет активного чата для передачи",
@@ -260,7 +299,7 @@ async def handle_transfer_chat(message: types.Message, bot: Bot, db: Database):
         return
     
     # Получаем список всех менеджеров
-    managers = db.get_all_managers()
+    managers = await db.get_all_managers()
     
     # Ищем нового менеджера по тексту кнопки
     new_manager_id = None
@@ -286,13 +325,13 @@ async def handle_transfer_chat(message: types.Message, bot: Bot, db: Database):
         return
     
     # Передаем чат новому менеджеру
-    if db.transfer_chat(client_id, new_manager_id):
+    if await db.transfer_chat(client_id, new_manager_id):
         # Получаем имя клиента
-        client_contact = db.get_client_contact_info(client_id)
+        client_contact = await db.get_client_contact_info(client_id)
         client_name = client_contact[0] if client_contact and client_contact[0] else "Клиент"
         
         # Получаем имя нового менеджера
-        new_manager_name = db.get_manager_name(new_manager_id) or "Менеджер"
+        new_manager_name = await db.get_manager_name(new_manager_id) or "Менеджер"
         
         # Уведомляем клиента о смене менеджера
         await bot.send_message(
@@ -316,4 +355,38 @@ async def handle_transfer_chat(message: types.Message, bot: Bot, db: Database):
         await message.answer(
             "Не удалось передать чат",
             reply_markup=get_extended_chat_keyboard()
-        )
\ No newline at end of file
+        )
+
+async def handle_search_messages(message: types.Message, db: AsyncDatabase):
+    """Поиск по истории переписки: /search [@username] слова"""
+    words = message.text.split()[1:]
+    
+    chat_id = None
+    if words and words[0].startswith("@"):
+        username = words.pop(0)[1:]
+        chat_id = await db.get_client_id_by_username(username)
+        if chat_id is None:
+            await message.answer(f"Клиент @{username} не найден")
+            return
+    
+    query = " ".join(words)
+    if not query:
+        await message.answer(
+            "Укажите слова для поиска, например:\n"
+            "/search доставка\n"
+            "/search @username размер"
+        )
+        return
+    
+    results = await db.search_messages(query, chat_id=chat_id)
+    if not results:
+        await message.answer(f"По запросу «{query}» ничего не найдено")
+        return
+    
+    text = f"🔎 Найдено по запросу «{query}»: {len(results)}\n\n"
+    for msg_id, msg_chat_id, sender_id, username, snippet, timestamp in results:
+        client = f"@{username}" if username else str(msg_chat_id)
+        sender = "Клиент" if sender_id == msg_chat_id else "Менеджер"
+        text += f"{timestamp} - {client} ({sender}):\n{snippet}\n\n"
+    
+    await message.answer(text)
@@ -14,6 +14,7 @@ from .reply import (
     get_pending_chats_keyboard,
     get_managers_list_keyboard
 )
+from .inline import HISTORY_CALLBACK_PREFIX, get_history_page_keyboard
 
 __all__ = [
     "get_main_keyboard",
@@ -29,5 +30,7 @@ __all__ = [
     "get_chat_transfer_keyboard",
     "get_extended_chat_keyboard",
     "get_pending_chats_keyboard",
-    "get_managers_list_keyboard"
+    "get_managers_list_keyboard",
+    "HISTORY_CALLBACK_PREFIX",
+    "get_history_page_keyboard"
 ]
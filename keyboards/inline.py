@@ -0,0 +1,20 @@
+from typing import Optional
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+
+# Префикс callback-данных кнопок листания истории: history:older:<id> / history:newer:<id>
+HISTORY_CALLBACK_PREFIX = "history:"
+
+
+def get_history_page_keyboard(first_id: int, last_id: int, has_older: bool,
+                              has_newer: bool) -> Optional[InlineKeyboardMarkup]:
+    """Кнопки перехода к более старой и более новой странице истории"""
+    buttons = []
+    if has_older:
+        buttons.append(InlineKeyboardButton(text="⬅️ Раньше", callback_data=f"{HISTORY_CALLBACK_PREFIX}older:{first_id}"))
+    if has_newer:
+        buttons.append(InlineKeyboardButton(text="Позже ➡️", callback_data=f"{HISTORY_CALLBACK_PREFIX}newer:{last_id}"))
+    if not buttons:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[buttons])
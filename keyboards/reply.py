@@ -95,6 +95,7 @@ def get_manager_status_keyboard() -> ReplyKeyboardMarkup:
             KeyboardButton(text="Доступен для чатов"),
             KeyboardButton(text="Недоступен для чатов")
         ],
+        [KeyboardButton(text="Взять следующий чат")],
         [KeyboardButton(text="Активные чаты")],
         [KeyboardButton(text="Главное меню")]
     ]
@@ -208,7 +209,7 @@ def get_pending_chats_keyboard(chats_list: list) -> ReplyKeyboardMarkup:
     Args:
         chats_list: Список кортежей (client_id, username, client_name, client_phone, client_nickname)
     """
-    keyboard = []
+    keyboard = [[KeyboardButton(text="Взять следующий чат")]]
     for chat in chats_list:
         client_id, username, client_name, client_phone, client_nickname = chat
         display_name = client_name if client_name else username
@@ -1,13 +1,16 @@
 import asyncio
 import logging
-from aiogram import Bot, Dispatcher, types
+from aiogram import Bot, Dispatcher, F, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command
 from config import load_config
-from database import Database
+from database import Database, AsyncDatabase
 from handlers.client import (
     handle_start, 
     handle_support_request, 
     handle_chat_history, 
+    handle_history_page,
     handle_view_media,
     handle_rating,
     handle_rating_comment,
@@ -16,6 +19,8 @@ from handlers.client import (
 )
 from handlers.manager import (
     handle_accept_chat, 
+    handle_take_next_chat,
+    handle_search_messages,
     handle_manager_status, 
     handle_set_availability,
     handle_manager_active_chats,
@@ -49,26 +54,42 @@ from handlers.catalog import (
     handle_back_to_categories,
     handle_back_to_subcategories,
     handle_back_from_sizes,
-    user_catalog_selections
+    navigation_states
 )
+from keyboards import HISTORY_CALLBACK_PREFIX
 from utils.logger import (
     logger, 
     PerformanceMonitor, 
     BotMonitoring
 )
 from utils.analytics import ManagerAnalytics, BotAnalytics
+from utils.router import MessageRouter
+from utils.notifications import NotificationDispatcher
+from utils.outbound import OutboundQueue, REPORT, send_priority
+from utils.webhook import WebhookServer
+from utils.sharding import ShardFront, ShardWorker, worker_command
+from utils.nav_state import SQLiteNavigationBackend
+from utils.update_context import UpdateContext, UpdateContextMiddleware
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 
 # Загрузка конфигурации
 config = load_config()
-bot = Bot(token=config.config.token)
+if config.config.telegram_api_url:
+    bot = Bot(
+        token=config.config.token,
+        session=AiohttpSession(api=TelegramAPIServer.from_base(config.config.telegram_api_url))
+    )
+else:
+    bot = Bot(token=config.config.token)
 dp = Dispatcher()
 # Сначала инициализируем базу данных
-db = Database(config.db.database)
+db = Database(config.db.database, config.db)
+# Асинхронный фасад для обработчиков, которые не должны блокировать цикл событий
+adb = AsyncDatabase(db)
 # Затем добавляем зависимости
-dp.workflow_data.update({"db": db, "config": config, "bot": bot})  # Добавляем зависимости
+dp.workflow_data.update({"db": db, "adb": adb, "config": config, "bot": bot})  # Добавляем зависимости
 
 # Инициализация менеджеров
 for manager_id in config.config.managers:
@@ -78,236 +99,299 @@ for manager_id in config.config.managers:
 if config.config.admin_manager_id:
     db.add_manager(config.config.admin_manager_id, is_admin=True)
 
+# Хранилище выбора в каталоге: ограничение размера, срок жизни и постоянное хранение
+navigation_states.configure(
+    max_entries=config.config.nav_state_max_entries,
+    ttl=config.config.nav_state_ttl,
+    flush_interval=config.config.nav_state_flush_interval,
+    # Пользователь может переехать в другой процесс-обработчик при его перезапуске
+    backend=SQLiteNavigationBackend(db, adb)
+    if config.config.nav_state_backend == "sqlite" or config.config.shard_workers > 1 else None
+)
+navigation_states.restore()
+
+# Все запросы бота к Telegram проходят через общую очередь с ограничением частоты
+outbound = OutboundQueue(
+    # В многопроцессном режиме общий лимит бота делится между процессами-обработчиками
+    global_rate=config.config.send_global_rate / max(1, config.config.shard_workers),
+    chat_rate=config.config.send_chat_rate,
+    chat_burst=config.config.send_chat_burst,
+    workers=config.config.send_workers,
+    max_pending=config.config.send_max_pending,
+    max_retries=config.config.send_max_retries
+)
+bot.session.middleware(outbound)
+
+# Параллельная рассылка уведомлений менеджерам
+notifier = NotificationDispatcher(bot, max_retries=config.config.send_max_retries)
+
 # Инициализация аналитики и мониторинга
 analytics = ManagerAnalytics(db, bot, config)
 bot_monitoring = BotAnalytics(db, bot, config)
 
+# Состояние пользователя (активный чат, оценка, роль) загружается один раз за обновление
+dp.message.outer_middleware(UpdateContextMiddleware(adb, config.config.managers))
+
+# Таблица маршрутизации текстовых сообщений вместо цепочки фильтров aiogram
+router = MessageRouter(
+    managers=config.config.managers,
+    is_admin=lambda user_id: UpdateContext.current().is_admin()
+)
+
+
+def catalog_choices(user_id: int, level: str, types: bool = False):
+    """Допустимые значения следующего шага каталога для пользователя
+
+    Args:
+        level: Последний выбранный уровень: 'category', 'subcategory' или 'type'
+        types: Вернуть типы подкатегории вместо ее дочерних узлов
+    """
+    state = navigation_states.get(user_id)
+    if state is None:
+        return ()
+    path = [state.category or '', state.subcategory or '']
+    if level == 'category':
+        path = path[:1]
+    elif level == 'type':
+        path.append(state.type_name)
+    node = db.get_catalog_index().node(*path)
+    if node is None:
+        return ()
+    return node.types if types else node.children
+
 
 # Регистрация хендлеров без декораторов PerformanceMonitor для критичных функций
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message):
-    await handle_start(message, config, db)
+    await handle_start(message, config, adb)
 
 
-@dp.message(lambda message: message.text == "Контакты")
+@router.exact("Контакты")
 @PerformanceMonitor.measure("contacts")
 async def contacts(message: types.Message):
     await handle_contacts(message, db)
 
 
-@dp.message(lambda message: message.text == "Каталог")
+@router.exact("Каталог")
 @PerformanceMonitor.measure("catalog")
 async def catalog(message: types.Message):
     await handle_catalog(message, db)
 
 
-@dp.message(lambda message: message.text in db.get_product_categories() if hasattr(db, 'get_product_categories') else False)
+@router.member(lambda message: db.get_catalog_index().categories)
 async def category_selection(message: types.Message):
     await handle_category_selection(message, db)
 
 
-@dp.message(lambda message: message.text == "Назад к категориям")
+@router.exact("Назад к категориям")
 async def back_to_categories(message: types.Message):
     await handle_back_to_categories(message, db)
 
 
-@dp.message(lambda message: message.text in (
-    db.get_product_subcategories(user_catalog_selections.get(message.from_user.id, {}).get('category', '')) 
-    if hasattr(db, 'get_product_subcategories') and message.from_user.id in user_catalog_selections 
-    else []
-))
+@router.member(lambda message: catalog_choices(message.from_user.id, 'category'))
 async def subcategory_selection(message: types.Message):
     await handle_subcategory_selection(message, db)
 
 
-@dp.message(lambda message: message.text == "Назад к подкатегориям")
+@router.exact("Назад к подкатегориям")
 async def back_to_subcategories(message: types.Message):
     await handle_back_to_subcategories(message, db)
 
 
-@dp.message(lambda message: message.text in (
-    db.get_product_types(
-        user_catalog_selections.get(message.from_user.id, {}).get('category', ''),
-        user_catalog_selections.get(message.from_user.id, {}).get('subcategory', '')
-    ) if hasattr(db, 'get_product_types') and message.from_user.id in user_catalog_selections 
-    else []
-))
+@router.member(lambda message: catalog_choices(message.from_user.id, 'subcategory', types=True))
 async def type_selection(message: types.Message):
     await handle_type_selection(message, db)
 
 
-@dp.message(lambda message: message.text in (
-    db.get_product_sizes(
-        user_catalog_selections.get(message.from_user.id, {}).get('category', ''),
-        user_catalog_selections.get(message.from_user.id, {}).get('subcategory', ''),
-        user_catalog_selections.get(message.from_user.id, {}).get('type', None)
-    ) if hasattr(db, 'get_product_sizes') and message.from_user.id in user_catalog_selections 
-    else []
-))
+@router.member(lambda message: catalog_choices(message.from_user.id, 'type'))
 async def size_selection(message: types.Message):
     await handle_size_selection(message, db)
 
 
-@dp.message(lambda message: message.text == "Назад" and message.from_user.id in user_catalog_selections)
+@router.exact("Назад", guard=lambda message: message.from_user.id in navigation_states)
 async def back_from_sizes(message: types.Message):
     await handle_back_from_sizes(message, db)
 
 
-@dp.message(lambda message: message.text == "Назад")
+@router.exact("Назад")
 async def back(message: types.Message):
     await handle_back(message)
 
 
-@dp.message(lambda message: message.text == "Назад к городам")
+@router.exact("Назад к городам")
 async def back_to_cities(message: types.Message):
     await handle_back_to_cities(message, db)
 
 
-@dp.message(lambda message: message.text in db.get_all_cities())
+@router.member(lambda message: db.get_all_cities())
 async def city_selected(message: types.Message):
     await handle_city_selection(message, db)
 
 
-@dp.message(lambda message: message.text == "Связаться с менеджером")
+@router.exact("Связаться с менеджером")
 @PerformanceMonitor.measure("support_request")
 async def request_support(message: types.Message):
-    await handle_support_request(message, bot, db, config)
+    await handle_support_request(message, bot, adb, config, notifier)
 
 
-@dp.message(lambda message: message.text == "Поделиться контактом")
+@router.exact("Поделиться контактом")
 async def share_contact(message: types.Message):
-    await handle_share_contact(message, bot, db, config)
+    await handle_share_contact(message, bot, adb, config)
 
 
-@dp.message(lambda message: message.contact is not None)
+@router.when(lambda message: message.contact is not None)
 async def contact_handler(message: types.Message):
-    await process_contact_data(message, bot, db, config)
+    await process_contact_data(message, bot, adb, config, notifier)
 
 
-@dp.message(lambda message: message.text.startswith("Принять чат"))
+@router.prefix("Принять чат")
 @PerformanceMonitor.measure("accept_chat")
 async def accept_chat(message: types.Message):
-    await handle_accept_chat(message, bot, db, config.config.managers)
+    await handle_accept_chat(message, bot, adb, config.config.managers)
+
+
+@router.exact("Взять следующий чат", role=MessageRouter.MANAGER)
+@router.exact("Взять следующий чат", role=MessageRouter.ADMIN)
+@PerformanceMonitor.measure("accept_chat")
+async def take_next_chat(message: types.Message):
+    await handle_take_next_chat(message, bot, adb, config.config.managers)
 
 
-@dp.message(lambda message: message.text == "Завершить чат")
+@router.prefix("/search", role=MessageRouter.MANAGER)
+@router.prefix("/search", role=MessageRouter.ADMIN)
+async def search_messages(message: types.Message):
+    await handle_search_messages(message, adb)
+
+
+@router.exact("Завершить чат")
 @PerformanceMonitor.measure("close_chat")
 async def close_chat(message: types.Message):
-    await handle_close_chat(message, bot, db, config)
+    # Сообщения из журнала должны попасть в обращение до его закрытия
+    await adb.flush_journal()
+    await handle_close_chat(message, bot, adb, config)
 
 
-@dp.message(lambda message: message.text == "История сообщений")
+@router.exact("История сообщений")
 async def chat_history(message: types.Message):
-    await handle_chat_history(message, db)
+    await handle_chat_history(message, adb)
+
+
+@dp.callback_query(F.data.startswith(HISTORY_CALLBACK_PREFIX))
+async def history_page(callback: types.CallbackQuery):
+    await handle_history_page(callback, adb)
 
 
-@dp.message(lambda message: message.text.startswith("/view_"))
+@router.prefix("/view_")
 async def view_media(message: types.Message):
-    await handle_view_media(message, db, bot)
+    await handle_view_media(message, adb, bot)
 
 
-@dp.message(lambda message: message.text.startswith("Оценка: "))
+@router.prefix("Оценка: ")
 @PerformanceMonitor.measure("rate_chat")
 async def rate_chat(message: types.Message):
-    await handle_rating(message, db)
+    await handle_rating(message, adb)
 
 
-@dp.message(lambda message: message.text in [street for city_id in range(1, 18)
-           for street in db.get_streets_by_city(city_id)])
+@router.member(lambda message: db.get_street_names())
 async def street_selected(message: types.Message):
     await handle_street_selection(message, db)
 
 
-@dp.message(lambda message: message.text == "Пропустить" or 
-            (db.get_chat_rating(message.from_user.id) is not None and 
-             not message.text.startswith("Оценка: ") and
-             not message.text.startswith("/") and
-             not db.is_client_in_active_chat(message.from_user.id)))
+async def is_rating_comment(message: types.Message) -> bool:
+    """Текст после оценки чата, когда у клиента нет активного чата"""
+    if message.text is None or message.text.startswith("/"):
+        return False
+    ctx = UpdateContext.current()
+    return not ctx.in_active_chat() and await ctx.get_rating() is not None
+
+
+@router.exact("Пропустить")
+@router.when(is_rating_comment)
 async def add_rating_comment(message: types.Message):
-    await handle_rating_comment(message, db)
+    await handle_rating_comment(message, adb)
 
 
-@dp.message(lambda message: message.text == "Главное меню")
+@router.exact("Главное меню")
 async def main_menu(message: types.Message):
-    await handle_start(message, config, db)
+    await handle_start(message, config, adb)
 
 
-@dp.message(lambda message: message.text == "Доступен для чатов")
+@router.exact("Доступен для чатов")
 @PerformanceMonitor.measure("manager_available")
 async def set_available(message: types.Message):
-    await handle_set_availability(message, db, True)
+    await handle_set_availability(message, adb, True)
 
 
-@dp.message(lambda message: message.text == "Недоступен для чатов")
+@router.exact("Недоступен для чатов")
 @PerformanceMonitor.measure("manager_unavailable")
 async def set_unavailable(message: types.Message):
-    await handle_set_availability(message, db, False)
+    await handle_set_availability(message, adb, False)
 
 
-@dp.message(lambda message: message.text == "Статус менеджера")
+@router.exact("Статус менеджера")
 async def manager_status(message: types.Message):
-    await handle_manager_status(message, db)
+    await handle_manager_status(message, adb)
 
 
-@dp.message(lambda message: message.text == "Активные чаты" and message.from_user.id in config.config.managers)
+@router.exact("Активные чаты", role=MessageRouter.MANAGER)
 async def manager_active_chats(message: types.Message):
-    await handle_manager_active_chats(message, db)
+    await handle_manager_active_chats(message, adb)
 
 
-@dp.message(lambda message: message.text == "Передать другому менеджеру")
+@router.exact("Передать другому менеджеру")
 async def transfer_chat_request(message: types.Message):
-    await handle_transfer_chat_request(message, db)
+    await handle_transfer_chat_request(message, adb)
 
 
-@dp.message(lambda message: message.text.startswith("Передать: "))
+@router.prefix("Передать: ")
 @PerformanceMonitor.measure("transfer_chat")
 async def transfer_chat(message: types.Message):
-    await handle_transfer_chat(message, bot, db)
+    await handle_transfer_chat(message, bot, adb)
 
 
-@dp.message(lambda message: message.text.startswith("Чат с "))
+@router.prefix("Чат с ")
 async def chat_selection(message: types.Message):
-    await handle_chat_selection(message, db)
+    await handle_chat_selection(message, adb)
 
 
-@dp.message(lambda message: message.text == "Панель администратора" and db.is_admin(message.from_user.id))
+@router.exact("Панель администратора", role=MessageRouter.ADMIN)
 async def admin_panel(message: types.Message):
-    await handle_admin_panel(message, db)
+    await handle_admin_panel(message, adb)
 
 
-@dp.message(lambda message: message.text == "Статистика" and db.is_admin(message.from_user.id))
+@router.exact("Статистика", role=MessageRouter.ADMIN)
 async def admin_stats(message: types.Message):
-    await handle_admin_stats(message, db)
+    await handle_admin_stats(message, adb)
 
 
-@dp.message(lambda message: message.text == "Ожидающие чаты" and db.is_admin(message.from_user.id))
+@router.exact("Ожидающие чаты", role=MessageRouter.ADMIN)
 async def admin_pending_chats(message: types.Message):
-    await handle_admin_pending_chats(message, db)
+    await handle_admin_pending_chats(message, adb)
 
 
-@dp.message(lambda message: message.text == "Активные чаты" and db.is_admin(message.from_user.id))
+@router.exact("Активные чаты", role=MessageRouter.ADMIN)
 async def admin_active_chats(message: types.Message):
-    await handle_admin_active_chats(message, db)
+    await handle_admin_active_chats(message, adb)
 
 
-@dp.message(lambda message: message.text == "Управление менеджерами" and db.is_admin(message.from_user.id))
+@router.exact("Управление менеджерами", role=MessageRouter.ADMIN)
 async def admin_managers(message: types.Message):
-    await handle_admin_managers(message, db)
+    await handle_admin_managers(message, adb)
 
 
-@dp.message(lambda message: message.text.startswith("Взять чат с ") and db.is_admin(message.from_user.id))
+@router.prefix("Взять чат с ", role=MessageRouter.ADMIN)
 @PerformanceMonitor.measure("admin_take_chat")
 async def admin_take_chat(message: types.Message):
-    await handle_admin_take_chat(message, bot, db)
+    await handle_admin_take_chat(message, bot, adb)
 
 
-@dp.message(lambda message: message.text.startswith("Статистика: ") and db.is_admin(message.from_user.id))
+@router.prefix("Статистика: ", role=MessageRouter.ADMIN)
 async def admin_manager_specific_stats(message: types.Message):
-    await handle_admin_manager_stats(message, db, config)
+    await handle_admin_manager_stats(message, adb, config)
 
 
 # Новые хендлеры для отчетов и аналитики
-@dp.message(lambda message: message.text == "Отчеты" and db.is_admin(message.from_user.id))
+@router.exact("Отчеты", role=MessageRouter.ADMIN)
 async def admin_reports(message: types.Message):
     await message.answer(
         "📊 *Меню отчетов*\n\n"
@@ -325,21 +409,19 @@ async def admin_reports(message: types.Message):
     )
 
 
-@dp.message(lambda message: message.text == "Отчет за сегодня" and db.is_admin(message.from_user.id))
+@router.exact("Отчет за сегодня", role=MessageRouter.ADMIN)
 async def admin_daily_report(message: types.Message):
     await message.answer("Генерирую отчет за сегодня...")
     await analytics.generate_daily_report()
     await message.answer("✅ Отчет успешно сгенерирован и отправлен вам.")
 
 
-@dp.message(lambda message: message.text == "Отчет за неделю" and db.is_admin(message.from_user.id))
+@router.exact("Отчет за неделю", role=MessageRouter.ADMIN)
 async def admin_weekly_report(message: types.Message):
     await message.answer("Генерирую недельный отчет...")
     
     # Получаем отчеты
-    manager_report = AnalyticsReporter.get_manager_performance_report(
-        config.db.database, days=7
-    )
+    manager_report = await adb.get_manager_report(days=7)
     
     if not manager_report:
         await message.answer("Нет данных для формирования отчета за указанный период.")
@@ -358,16 +440,17 @@ async def admin_weekly_report(message: types.Message):
         )
     
     # Отправляем отчет
-    await message.answer(
-        report_text,
-        parse_mode="Markdown"
-    )
+    with send_priority(REPORT):
+        await message.answer(
+            report_text,
+            parse_mode="Markdown"
+        )
 
 
-@dp.message(lambda message: message.text == "Отчет по менеджерам" and db.is_admin(message.from_user.id))
+@router.exact("Отчет по менеджерам", role=MessageRouter.ADMIN)
 async def admin_manager_report(message: types.Message):
     # Получаем список всех менеджеров
-    managers = db.get_all_managers()
+    managers = await adb.get_all_managers()
     
     if not managers:
         await message.answer("В системе нет зарегистрированных менеджеров.")
@@ -392,7 +475,7 @@ async def admin_manager_report(message: types.Message):
     )
 
 
-@dp.message(lambda message: message.text.startswith("Отчет: ") and db.is_admin(message.from_user.id))
+@router.prefix("Отчет: ", role=MessageRouter.ADMIN)
 async def admin_specific_manager_report(message: types.Message):
     # Извлекаем ID менеджера из текста
     text = message.text
@@ -403,21 +486,94 @@ async def admin_specific_manager_report(message: types.Message):
     await analytics.send_manager_report(manager_id, message.from_user.id)
 
 
-@dp.message()
+@router.fallback
 @PerformanceMonitor.measure("handle_messages")
 async def handle_messages(message: types.Message):
-    await handle_message(message, bot, db, config)
+    await handle_message(message, bot, adb, config, UpdateContext.current())
+
+
+# Все сообщения, кроме /start, проходят через таблицу маршрутизации
+router.attach(dp)
+
+
+async def run_shard_front():
+    """Процесс-приемник: получает обновления и передает их процессам-обработчикам"""
+    front = ShardFront(config.config.shard_workers, worker_command(), socket_path=config.config.shard_socket)
+    await front.start()
+    try:
+        if config.config.mode == "webhook":
+            server = WebhookServer(
+                dp, bot,
+                path=config.config.webhook_path,
+                secret=config.config.webhook_secret,
+                max_concurrency=config.config.webhook_workers,
+                drain_timeout=config.config.webhook_drain_timeout,
+                process=front.forward
+            )
+            await server.run(
+                host=config.config.webhook_host,
+                port=config.config.webhook_port,
+                webhook_url=config.config.webhook_url
+            )
+        else:
+            await bot.delete_webhook()
+            await front.run_polling(bot, dp.resolve_used_update_types())
+    finally:
+        await front.close()
+        await bot.session.close()
+        db.close()
 
 
 async def main():
-    # Запускаем аналитику и мониторинг
-    await bot_monitoring.start_monitoring()
-    
-    # Запускаем планировщик отчетов в фоновом режиме
-    asyncio.create_task(analytics.start_scheduler())
+    shard_index = config.config.shard_index
+    if config.config.shard_workers > 1 and shard_index < 0:
+        await run_shard_front()
+        return
+
+    # Запускаем поток-писатель асинхронной базы данных
+    await adb.start()
+    await navigation_states.start_writer()
+
+    # Аналитика, мониторинг и отчеты работают в одном процессе
+    if shard_index <= 0:
+        await bot_monitoring.start_monitoring()
+
+        # Запускаем планировщик отчетов в фоновом режиме
+        asyncio.create_task(analytics.start_scheduler())
     
     # Запускаем бота
-    await dp.start_polling(bot)
+    try:
+        if shard_index >= 0:
+            worker = ShardWorker(
+                dp, bot, db, shard_index, config.config.shard_socket,
+                max_concurrency=config.config.webhook_workers
+            )
+            await worker.run()
+            await bot.session.close()
+        elif config.config.mode == "webhook":
+            if not config.config.webhook_secret:
+                logger.warning("WEBHOOK_SECRET is not set, webhook requests are not authenticated")
+            server = WebhookServer(
+                dp, bot,
+                path=config.config.webhook_path,
+                secret=config.config.webhook_secret,
+                max_concurrency=config.config.webhook_workers,
+                drain_timeout=config.config.webhook_drain_timeout
+            )
+            await server.run(
+                host=config.config.webhook_host,
+                port=config.config.webhook_port,
+                webhook_url=config.config.webhook_url
+            )
+            await bot.session.close()
+        else:
+            await dp.start_polling(bot)
+    finally:
+        # Дожидаемся отправки сообщений и записи всех изменений из очередей
+        await outbound.close()
+        await navigation_states.close()
+        await adb.close()
+        db.close()
 
 
 # Обработчик сигналов для корректного завершения работы
@@ -3,12 +3,12 @@ from datetime import datetime, timedelta
 import json
 from aiogram import Bot, types
 from .logger import (
-    AnalyticsReporter, 
     logger, 
     ManagerMetrics, 
     BotMonitoring
 )
 from database import Database
+from .outbound import NOTIFY, REPORT, send_priority
 
 
 class ManagerAnalytics:
@@ -24,12 +24,13 @@ class ManagerAnalytics:
         """Генерация ежедневного отчета по работе менеджеров"""
         try:
             # Получаем отчет о работе менеджеров за последние 24 часа
-            manager_report = AnalyticsReporter.get_manager_performance_report(
-                self.config.db.database, days=1
-            )
+            manager_report = self.db.get_manager_report(days=1)
             
-            # Получаем отчет о времени отклика
-            response_report = AnalyticsReporter.get_response_time_report(days=1)
+            # Время отклика - по менеджерам, принимавшим чаты
+            response_report = sorted(
+                (manager for manager in manager_report if manager['response_count']),
+                key=lambda manager: manager['avg_response_time']
+            )
             
             # Формируем текст отчета
             report_text = "📊 *Ежедневный отчет по работе менеджеров*\n\n"
@@ -50,9 +51,8 @@ class ManagerAnalytics:
             if response_report:
                 report_text += "*Время отклика:*\n"
                 for manager in response_report:
-                    manager_name = self.db.get_manager_name(manager['manager_id']) or f"Менеджер {manager['manager_id']}"
                     report_text += (
-                        f"👨‍💼 {manager_name} (ID: {manager['manager_id']})\n"
+                        f"👨‍💼 {manager['manager_name']} (ID: {manager['manager_id']})\n"
                         f"   - Среднее время: {manager['avg_response_time']} сек\n"
                         f"   - Мин. время: {manager['min_response_time']} сек\n"
                         f"   - Макс. время: {manager['max_response_time']} сек\n"
@@ -73,11 +73,12 @@ class ManagerAnalytics:
             
             # Отправляем отчет администратору
             if self.report_chat_id:
-                await self.bot.send_message(
-                    self.report_chat_id,
-                    report_text,
-                    parse_mode="Markdown"
-                )
+                with send_priority(REPORT):
+                    await self.bot.send_message(
+                        self.report_chat_id,
+                        report_text,
+                        parse_mode="Markdown"
+                    )
                 logger.info(f"Daily report sent to admin (ID: {self.report_chat_id})")
             else:
                 logger.warning("No admin ID configured to send daily report")
@@ -115,9 +116,7 @@ class ManagerAnalytics:
         """Отправляет отчет о работе конкретного менеджера"""
         try:
             # Получаем отчет о работе менеджера
-            manager_report = AnalyticsReporter.get_manager_performance_report(
-                self.config.db.database, manager_id=manager_id, days=days
-            )
+            manager_report = self.db.get_manager_report(days=days, manager_id=manager_id)
             
             if not manager_report:
                 await self.bot.send_message(
@@ -140,11 +139,12 @@ class ManagerAnalytics:
             )
             
             # Отправляем отчет
-            await self.bot.send_message(
-                chat_id,
-                report_text,
-                parse_mode="Markdown"
-            )
+            with send_priority(REPORT):
+                await self.bot.send_message(
+                    chat_id,
+                    report_text,
+                    parse_mode="Markdown"
+                )
         
         except Exception as e:
             logger.error(f"Error sending manager report: {e}")
@@ -155,72 +155,118 @@ class ManagerAnalytics:
 
 
 class BotAnalytics:
-    """Класс для анализа и мониторинга работы бота"""
+    """Класс для анализа и мониторинга работы бота
+
+    Очередь ожидающих чатов проверяется сразу при поступлении нового
+    чата (подписка на PendingChatQueue) и раз в минуту - для контроля
+    времени ожидания. Одинаковые предупреждения отправляются
+    администратору не чаще одного раза в ALERT_COOLDOWN секунд.
+    """
+
+    # Длина очереди, при которой отправляется предупреждение
+    PENDING_QUEUE_ALERT = 5
+    # Время ожидания самого старого чата для предупреждения (сек)
+    PENDING_WAIT_ALERT = 10 * 60
+    ALERT_COOLDOWN = 15 * 60
+    CHECK_INTERVAL = 60
     
     def __init__(self, db: Database, bot: Bot, config):
         self.db = db
         self.bot = bot
         self.config = config
         self.admin_id = config.config.admin_manager_id
+        self._loop = None
+        self._last_alerts = {}
     
     async def start_monitoring(self):
         """Запускает мониторинг состояния бота"""
         # Логируем запуск бота
         BotMonitoring.log_bot_start()
+
+        # Новые чаты в очереди проверяются сразу, без ожидания следующей проверки
+        self._loop = asyncio.get_running_loop()
+        self.db.pending_queue.subscribe(self._on_chat_enqueued)
         
         # Запускаем фоновую задачу для мониторинга состояния бота
         asyncio.create_task(self._monitor_bot_health())
+
+    def _on_chat_enqueued(self, chat):
+        """Подписчик очереди; вызывается в потоке, записавшем чат"""
+        self._loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self._check_health()))
     
     async def _monitor_bot_health(self):
         """Фоновая задача для мониторинга состояния бота"""
         while True:
-            try:
-                # Проверяем состояние бота каждые 15 минут
-                await asyncio.sleep(15 * 60)
-                
-                # Получаем статистику
+            await asyncio.sleep(self.CHECK_INTERVAL)
+            await self._check_health()
+
+    async def _check_health(self):
+        """Проверка очереди ожидающих чатов и отправка предупреждений администратору"""
+        try:
+            queue = self.db.pending_queue
+            pending_chats = len(queue)
+            if not pending_chats:
+                return
+            available_managers = self.db.assigner.available_count()
+            oldest = queue.oldest()
+            oldest_wait = oldest.wait_time() if oldest else 0.0
+
+            # Проверяем критичные условия
+            critical_issues = {}
+
+            # Проверка 1: Менее 1 доступного менеджера при наличии ожидающих чатов
+            if available_managers < 1:
+                critical_issues['no_managers'] = (
+                    f"⚠️ Нет доступных менеджеров, но есть {pending_chats} ожидающих чатов!"
+                )
+
+            # Проверка 2: Большое количество ожидающих чатов
+            if pending_chats >= self.PENDING_QUEUE_ALERT:
+                critical_issues['queue_length'] = (
+                    f"⚠️ Большая очередь чатов: {pending_chats} ожидающих обработки!"
+                )
+
+            # Проверка 3: Клиент слишком долго ждет менеджера
+            if oldest_wait >= self.PENDING_WAIT_ALERT:
+                critical_issues['wait_time'] = (
+                    f"⚠️ Клиент {oldest.username} ожидает менеджера {oldest_wait / 60:.0f} мин!"
+                )
+
+            now = asyncio.get_running_loop().time()
+            issues = [
+                key for key in critical_issues
+                if now - self._last_alerts.get(key, -self.ALERT_COOLDOWN) >= self.ALERT_COOLDOWN
+            ]
+
+            # Если есть новые критичные проблемы, отправляем уведомление
+            if issues and self.admin_id:
+                for key in issues:
+                    self._last_alerts[key] = now
+                issues = [critical_issues[key] for key in issues]
                 stats = self.db.get_dashboard_stats()
-                
-                # Проверяем критичные условия
-                critical_issues = []
-                
-                # Проверка 1: Менее 1 доступного менеджера при наличии ожидающих чатов
-                if stats['available_managers'] < 1 and stats['pending_chats'] > 0:
-                    critical_issues.append(
-                        f"⚠️ Нет доступных менеджеров, но есть {stats['pending_chats']} ожидающих чатов!"
-                    )
-                
-                # Проверка 2: Большое количество ожидающих чатов (более 5)
-                if stats['pending_chats'] >= 5:
-                    critical_issues.append(
-                        f"⚠️ Большая очередь чатов: {stats['pending_chats']} ожидающих обработки!"
-                    )
-                
-                # Если есть критичные проблемы, отправляем уведомление
-                if critical_issues and self.admin_id:
-                    alert_text = "🚨 *ВНИМАНИЕ: Обнаружены проблемы в работе бота*\n\n"
-                    alert_text += "\n".join(critical_issues)
-                    alert_text += "\n\n*Текущая статистика:*\n"
-                    alert_text += (
-                        f"👥 Всего менеджеров: {stats['total_managers']}\n"
-                        f"✅ Доступно менеджеров: {stats['available_managers']}\n"
-                        f"⏳ Ожидающих чатов: {stats['pending_chats']}\n"
-                        f"💬 Активных чатов: {stats['active_chats']}\n"
-                    )
-                    
+                alert_text = "🚨 *ВНИМАНИЕ: Обнаружены проблемы в работе бота*\n\n"
+                alert_text += "\n".join(issues)
+                alert_text += "\n\n*Текущая статистика:*\n"
+                alert_text += (
+                    f"👥 Всего менеджеров: {stats['total_managers']}\n"
+                    f"✅ Доступно менеджеров: {stats['available_managers']}\n"
+                    f"⏳ Ожидающих чатов: {stats['pending_chats']}\n"
+                    f"💬 Активных чатов: {stats['active_chats']}\n"
+                )
+
+                with send_priority(NOTIFY):
                     await self.bot.send_message(
                         self.admin_id,
                         alert_text,
                         parse_mode="Markdown"
                     )
-                    
-                    logger.warning(
-                        f"Bot health alert sent to admin. Issues: {', '.join(critical_issues)}"
-                    )
-            
-            except Exception as e:
-                logger.error(f"Error in bot health monitoring: {e}")
-                await asyncio.sleep(60)  # В случае ошибки ждем 1 минуту
+
+                logger.warning(
+                    f"Bot health alert sent to admin. Issues: {', '.join(issues)}"
+                )
+
+        except Exception as e:
+            logger.error(f"Error in bot health monitoring: {e}")
     
     def log_bot_stop(self):
         """Логирует остановку бота"""
@@ -0,0 +1,103 @@
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+from utils.logger import logger
+
+
+class MessageArchiver:
+    """Фоновый перенос истории закрытых чатов в архив
+
+    Раз в interval секунд переносит сообщения чатов, закрытых больше
+    after_days дней назад, из таблицы messages в архивную базу (см.
+    Database.archive_closed_chats), чтобы таблица горячего пути и ее
+    индексы оставались небольшими. Чтение истории объединяет обе базы,
+    поэтому перенос незаметен для обработчиков.
+    """
+
+    def __init__(self, db, after_days: float = 30.0, interval: float = 3600.0, batch: int = 50):
+        self.db = db
+        self.after_days = after_days
+        self.interval = interval
+        self.batch = batch
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+        # Статистика
+        self.runs = 0
+        self.total_chats = 0
+        self.total_messages = 0
+        self.last_chats = 0
+        self.last_messages = 0
+        self.last_duration_ms = 0.0
+        self.last_run_at: Optional[str] = None
+
+    def start(self):
+        """Запуск фонового потока"""
+        if self._thread is None and self.interval > 0 and self.after_days > 0:
+            self._thread = threading.Thread(target=self._run, name="message-archiver", daemon=True)
+            self._thread.start()
+            logger.info(f"Message archiver started (after {self.after_days} days, interval={self.interval}s)")
+
+    def stop(self):
+        """Остановка фонового потока"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        # Первый проход сразу после запуска завершает перенос, прерванный сбоем
+        while True:
+            self.archive()
+            if self._stop.wait(self.interval):
+                break
+
+    def archive(self) -> int:
+        """Перенос всех чатов, закрытых раньше срока, пакетами по batch чатов
+
+        Returns:
+            int: Количество перенесенных сообщений
+        """
+        start_time = time.monotonic()
+        closed_before = time.time() - self.after_days * 86400
+        chats = messages = 0
+        while not self._stop.is_set():
+            batch_chats, batch_messages = self.db.archive_closed_chats(closed_before, self.batch)
+            chats += batch_chats
+            messages += batch_messages
+            if batch_chats < self.batch:
+                break
+
+        with self._lock:
+            self.runs += 1
+            self.total_chats += chats
+            self.total_messages += messages
+            self.last_chats = chats
+            self.last_messages = messages
+            self.last_duration_ms = round((time.monotonic() - start_time) * 1000, 2)
+            self.last_run_at = datetime.now().isoformat()
+        if chats:
+            logger.info(f"Archived {messages} messages of {chats} closed chats")
+        return messages
+
+    def stats(self) -> dict:
+        """Статистика архивации
+
+        Returns:
+            dict: Количество запусков, перенесенных чатов и сообщений и данные последнего запуска
+        """
+        with self._lock:
+            return {
+                'after_days': self.after_days,
+                'interval': self.interval,
+                'runs': self.runs,
+                'total_chats': self.total_chats,
+                'total_messages': self.total_messages,
+                'last_chats': self.last_chats,
+                'last_messages': self.last_messages,
+                'last_duration_ms': self.last_duration_ms,
+                'last_run_at': self.last_run_at
+            }
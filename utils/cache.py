@@ -0,0 +1,120 @@
+import threading
+import time
+from functools import wraps
+from typing import Any, Callable, Hashable, Optional
+
+from utils.logger import logger
+
+
+class ReferenceCache:
+    """Кэш справочных данных (города, улицы, точки, каталог товаров)
+
+    Записи разбиты на группы. У каждой группы есть версия, которая
+    увеличивается при сбросе группы: запись, прочитанная из базы до
+    сброса, не попадет в кэш после него. Кроме явного сброса записи
+    устаревают по TTL на случай изменения данных в обход бота.
+    """
+
+    def __init__(self, ttl: float = 3600.0):
+        self.ttl = ttl
+        self._entries = {}   # (группа, ключ) -> (значение, время истечения)
+        self._versions = {}  # группа -> версия
+        self._lock = threading.Lock()
+
+        # Статистика кэша
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidations = 0
+
+    def version(self, group: str) -> int:
+        """Текущая версия группы"""
+        with self._lock:
+            return self._versions.get(group, 0)
+
+    def get(self, group: str, key: Hashable) -> Optional[Any]:
+        """Получение значения из кэша или None, если записи нет"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((group, key))
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self.hits += 1
+                    return value
+                del self._entries[(group, key)]
+                self.expired += 1
+            self.misses += 1
+            return None
+
+    def set(self, group: str, key: Hashable, value: Any, version: Optional[int] = None):
+        """Сохранение значения
+
+        Args:
+            version: Версия группы на момент чтения из базы. Если группа
+                с тех пор была сброшена, значение не сохраняется.
+        """
+        with self._lock:
+            if version is not None and version != self._versions.get(group, 0):
+                return
+            self._entries[(group, key)] = (value, time.monotonic() + self.ttl)
+
+    def invalidate(self, group: str):
+        """Сброс всех записей группы"""
+        with self._lock:
+            self._versions[group] = self._versions.get(group, 0) + 1
+            for entry_key in [entry_key for entry_key in self._entries if entry_key[0] == group]:
+                del self._entries[entry_key]
+            self.invalidations += 1
+        logger.info(f"Reference cache group '{group}' invalidated")
+
+    def clear(self):
+        """Сброс всего кэша"""
+        with self._lock:
+            for group in {entry_key[0] for entry_key in self._entries} | set(self._versions):
+                self._versions[group] = self._versions.get(group, 0) + 1
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        """Статистика кэша
+
+        Returns:
+            dict: Попадания, промахи, доля попаданий, число записей и версии групп
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'ttl': self.ttl,
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / requests, 4) if requests else 0.0,
+                'expired': self.expired,
+                'invalidations': self.invalidations,
+                'versions': dict(self._versions)
+            }
+
+
+def cached_reference(group: str) -> Callable:
+    """Декоратор метода Database, кэширующий результат в группе справочника
+
+    Ключом служат имя метода и аргументы вызова. Пустые результаты не
+    кэшируются: методы базы возвращают пустой список и при ошибке.
+    Списки возвращаются копией, чтобы вызывающий код не мог изменить
+    закэшированное значение.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            cache: ReferenceCache = self._reference_cache
+            key = (method.__name__, args, tuple(sorted(kwargs.items())))
+            value = cache.get(group, key)
+            if value is None:
+                version = cache.version(group)
+                value = method(self, *args, **kwargs)
+                if value:
+                    cache.set(group, key, value, version)
+            return list(value) if isinstance(value, list) else value
+        return wrapper
+    return decorator
@@ -0,0 +1,122 @@
+from typing import Iterable, Optional
+
+from aiogram.types import ReplyKeyboardMarkup
+
+from keyboards.reply import (
+    get_catalog_categories_keyboard,
+    get_catalog_subcategories_keyboard,
+    get_catalog_types_keyboard,
+    get_catalog_sizes_keyboard
+)
+
+
+class CatalogNode:
+    """Узел дерева каталога
+
+    Дочерние узлы хранятся в словаре по названию, клавиатура для выбора
+    дочернего узла строится один раз при загрузке каталога. У узла
+    подкатегории дополнительно есть типы (для дисков), у узла размера -
+    список товаров.
+    """
+
+    __slots__ = ('name', 'children', 'keyboard', 'types', 'types_keyboard', 'products')
+
+    def __init__(self, name: Optional[str] = None):
+        self.name = name
+        self.children = {}
+        self.keyboard: Optional[ReplyKeyboardMarkup] = None
+        self.types = {}
+        self.types_keyboard: Optional[ReplyKeyboardMarkup] = None
+        self.products = []
+
+    def child(self, name: str) -> 'CatalogNode':
+        node = self.children.get(name)
+        if node is None:
+            node = self.children[name] = CatalogNode(name)
+        return node
+
+
+class CatalogIndex:
+    """Дерево каталога товаров: категория -> подкатегория -> (тип) -> размер
+
+    Загружается из таблицы products одним запросом. Каждый шаг навигации
+    по каталогу - поиск в словаре, без SQL и без построения клавиатуры.
+    """
+
+    def __init__(self, rows: Iterable[tuple]):
+        """
+        Args:
+            rows: Строки (id, category, subcategory, type, size, product_name,
+                description, price, external_url, image_url), упорядоченные по id
+        """
+        self.root = CatalogNode()
+        self.product_count = 0
+
+        for product_id, category, subcategory, type_name, size, *details in rows:
+            if not category or not subcategory or not size:
+                continue
+            product = (product_id, *details)
+            subcategory_node = self.root.child(category).child(subcategory)
+            # Размеры подкатегории без учета типа
+            subcategory_node.child(size).products.append(product)
+            if type_name:
+                subcategory_node.types.setdefault(type_name, CatalogNode(type_name)).child(size).products.append(product)
+            self.product_count += 1
+
+        self._build_keyboards()
+
+    @staticmethod
+    def _sort(node: CatalogNode):
+        node.children = dict(sorted(node.children.items()))
+
+    def _build_keyboards(self):
+        self._sort(self.root)
+        self.root.keyboard = get_catalog_categories_keyboard(list(self.root.children))
+        for category_node in self.root.children.values():
+            self._sort(category_node)
+            category_node.keyboard = get_catalog_subcategories_keyboard(list(category_node.children))
+            for subcategory_node in category_node.children.values():
+                self._sort(subcategory_node)
+                subcategory_node.keyboard = get_catalog_sizes_keyboard(list(subcategory_node.children))
+                if subcategory_node.types:
+                    subcategory_node.types = dict(sorted(subcategory_node.types.items()))
+                    subcategory_node.types_keyboard = get_catalog_types_keyboard(list(subcategory_node.types))
+                    for type_node in subcategory_node.types.values():
+                        self._sort(type_node)
+                        type_node.keyboard = get_catalog_sizes_keyboard(list(type_node.children))
+
+    def __len__(self) -> int:
+        return self.product_count
+
+    @property
+    def categories(self) -> dict:
+        """Категории каталога: название -> узел"""
+        return self.root.children
+
+    def node(self, category: Optional[str] = None, subcategory: Optional[str] = None,
+             type_name: Optional[str] = None) -> Optional[CatalogNode]:
+        """Поиск узла по пути в дереве
+
+        Без аргументов возвращает корень, с категорией - узел категории и т.д.
+        Если тип не указан, узел подкатегории содержит размеры всех типов.
+        """
+        node = self.root
+        if category is None:
+            return node
+        node = node.children.get(category)
+        if node is None or subcategory is None:
+            return node
+        node = node.children.get(subcategory)
+        if node is None or type_name is None:
+            return node
+        return node.types.get(type_name)
+
+    def products(self, category: str, subcategory: str, type_name: Optional[str], size: str) -> list:
+        """Товары для выбранного размера
+
+        Returns:
+            list: Кортежи (id, product_name, description, price, external_url, image_url)
+        """
+        node = self.node(category, subcategory, type_name)
+        size_node = node.children.get(size) if node is not None else None
+        return size_node.products if size_node is not None else []
@@ -0,0 +1,134 @@
+import heapq
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+
+from utils.logger import logger
+
+
+def _parse_timestamp(value) -> float:
+    """Перевод CURRENT_TIMESTAMP SQLite (UTC) в секунды"""
+    if not value:
+        return 0.0
+    try:
+        return datetime.strptime(str(value)[:19], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        return 0.0
+
+
+class ChatAssigner:
+    """Выбор наименее загруженного доступного менеджера
+
+    Менеджеры хранятся в куче по ключу (active_chats, last_activity):
+    выбор и обновление нагрузки выполняются за O(log n) без запросов к
+    базе. Устаревшие элементы кучи не удаляются сразу, а пропускаются
+    при выборе по номеру версии менеджера.
+
+    Сами назначения выполняет Database.accept_chat() одной транзакцией
+    с проверкой статуса чата (compare-and-set); здесь же собирается
+    статистика их задержки.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heap = []      # [active_chats, last_activity, manager_id, version]
+        self._managers = {}  # manager_id -> [active_chats, last_activity, available, version]
+        self._available = 0
+
+        # Статистика назначений
+        self.picks = 0
+        self.assignments = 0
+        self.conflicts = 0
+        self.last_assign_ms = 0.0
+        self.max_assign_ms = 0.0
+        self.total_assign_ms = 0.0
+
+    def load(self, rows: Iterable[tuple]):
+        """Заполнение по строкам (id, active_chats, last_activity, доступен ли менеджер)"""
+        with self._lock:
+            self._heap.clear()
+            self._managers.clear()
+            self._available = 0
+            for manager_id, active_chats, last_activity, available in rows:
+                self._set(manager_id, active_chats or 0, _parse_timestamp(last_activity), bool(available))
+        logger.info(f"Chat assigner loaded: {len(self._managers)} managers, {self._available} available")
+
+    def _set(self, manager_id: int, active_chats: int, last_activity: float, available: bool):
+        state = self._managers.get(manager_id)
+        if state is not None and state[2]:
+            self._available -= 1
+        version = state[3] + 1 if state is not None else 0
+        self._managers[manager_id] = [active_chats, last_activity, available, version]
+        if available:
+            self._available += 1
+            heapq.heappush(self._heap, [active_chats, last_activity, manager_id, version])
+        # Куча разрослась из-за устаревших элементов - перестраиваем
+        if len(self._heap) > 2 * len(self._managers) + 16:
+            self._heap = [
+                [state[0], state[1], mid, state[3]]
+                for mid, state in self._managers.items() if state[2]
+            ]
+            heapq.heapify(self._heap)
+
+    def set_manager(self, manager_id: int, active_chats: int, last_activity, available: bool):
+        """Обновление данных менеджера значениями из базы"""
+        with self._lock:
+            self._set(manager_id, active_chats or 0, _parse_timestamp(last_activity), bool(available))
+
+    def adjust(self, manager_id: int, delta: int):
+        """Изменение счетчика активных чатов менеджера (с обновлением активности)"""
+        with self._lock:
+            state = self._managers.get(manager_id)
+            if state is not None:
+                self._set(manager_id, max(0, state[0] + delta), time.time(), state[2])
+
+    def touch(self, manager_id: int):
+        """Обновление времени последней активности менеджера"""
+        self.adjust(manager_id, 0)
+
+    def pick(self) -> Optional[int]:
+        """Доступный менеджер с наименьшим числом активных чатов или None"""
+        with self._lock:
+            self.picks += 1
+            while self._heap:
+                active_chats, last_activity, manager_id, version = self._heap[0]
+                state = self._managers.get(manager_id)
+                if state is not None and state[2] and state[3] == version:
+                    return manager_id
+                heapq.heappop(self._heap)
+            return None
+
+    def available_count(self) -> int:
+        """Количество доступных менеджеров"""
+        with self._lock:
+            return self._available
+
+    def record_assignment(self, elapsed_ms: float, assigned: bool):
+        """Учет попытки назначения чата"""
+        with self._lock:
+            if not assigned:
+                self.conflicts += 1
+                return
+            self.assignments += 1
+            self.last_assign_ms = round(elapsed_ms, 2)
+            self.max_assign_ms = max(self.max_assign_ms, self.last_assign_ms)
+            self.total_assign_ms += elapsed_ms
+
+    def stats(self) -> dict:
+        """Статистика назначений
+
+        Returns:
+            dict: Доступные менеджеры, назначения, конфликты и задержка назначения
+        """
+        with self._lock:
+            return {
+                'managers': len(self._managers),
+                'available': self._available,
+                'picks': self.picks,
+                'assignments': self.assignments,
+                'conflicts': self.conflicts,
+                'last_assign_ms': self.last_assign_ms,
+                'max_assign_ms': self.max_assign_ms,
+                'avg_assign_ms': round(self.total_assign_ms / self.assignments, 2) if self.assignments else 0.0
+            }
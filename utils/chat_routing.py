@@ -0,0 +1,120 @@
+import threading
+from typing import Iterable, List, Optional
+
+
+class ChatRoutingTable:
+    """Таблица маршрутизации активных чатов в памяти
+
+    Хранит соответствие клиент -> менеджер и менеджер -> клиенты для всех
+    активных чатов, а также чат, в котором менеджер сейчас ведет переписку
+    (выбранный через "Чат с ..." или принятый последним). Таблица
+    обновляется методами Database, изменяющими чаты, и восстанавливается
+    из таблицы chats при запуске, поэтому пересылка сообщений не обращается
+    к базе данных.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._client_manager = {}   # client_id -> manager_id (None, если менеджер не назначен)
+        self._manager_clients = {}  # manager_id -> {client_id: None} в порядке назначения
+        self._focus = {}            # manager_id -> client_id текущего чата
+
+        # Статистика
+        self.lookups = 0
+        self.updates = 0
+
+    def rebuild(self, rows: Iterable[tuple]):
+        """Заполнение таблицы строками (client_id, manager_id) активных чатов"""
+        with self._lock:
+            self._client_manager.clear()
+            self._manager_clients.clear()
+            self._focus.clear()
+            for client_id, manager_id in rows:
+                self._assign(client_id, manager_id)
+            self.updates += 1
+
+    def _assign(self, client_id: int, manager_id: Optional[int]):
+        self._release(client_id)
+        self._client_manager[client_id] = manager_id
+        if manager_id is not None:
+            self._manager_clients.setdefault(manager_id, {})[client_id] = None
+            self._focus[manager_id] = client_id
+
+    def _release(self, client_id: int) -> Optional[int]:
+        manager_id = self._client_manager.pop(client_id, None)
+        if manager_id is None:
+            return None
+        clients = self._manager_clients.get(manager_id)
+        if clients is not None:
+            clients.pop(client_id, None)
+            if not clients:
+                del self._manager_clients[manager_id]
+        if self._focus.get(manager_id) == client_id:
+            # Переключаемся на последний назначенный из оставшихся чатов
+            if clients:
+                self._focus[manager_id] = next(reversed(clients))
+            else:
+                del self._focus[manager_id]
+        return manager_id
+
+    def assign(self, client_id: int, manager_id: Optional[int]):
+        """Активный чат клиента назначен менеджеру (активация или передача)"""
+        with self._lock:
+            self._assign(client_id, manager_id)
+            self.updates += 1
+
+    def release(self, client_id: int) -> Optional[int]:
+        """Чат клиента перестал быть активным
+
+        Returns:
+            int: ID менеджера, который вел чат, или None
+        """
+        with self._lock:
+            self.updates += 1
+            return self._release(client_id)
+
+    def is_active(self, client_id: int) -> bool:
+        """Есть ли у клиента активный чат"""
+        with self._lock:
+            self.lookups += 1
+            return client_id in self._client_manager
+
+    def manager_of(self, client_id: int) -> Optional[int]:
+        """Менеджер активного чата клиента"""
+        with self._lock:
+            self.lookups += 1
+            return self._client_manager.get(client_id)
+
+    def clients_of(self, manager_id: int) -> List[int]:
+        """Клиенты активных чатов менеджера в порядке назначения"""
+        with self._lock:
+            self.lookups += 1
+            return list(self._manager_clients.get(manager_id, ()))
+
+    def focused_client(self, manager_id: int) -> Optional[int]:
+        """Клиент, с которым менеджер сейчас ведет переписку"""
+        with self._lock:
+            self.lookups += 1
+            return self._focus.get(manager_id)
+
+    def focus(self, manager_id: int, client_id: int) -> bool:
+        """Переключение менеджера на один из его активных чатов"""
+        with self._lock:
+            if self._client_manager.get(client_id) != manager_id:
+                return False
+            self._focus[manager_id] = client_id
+            return True
+
+    def stats(self) -> dict:
+        """Статистика таблицы маршрутизации
+
+        Returns:
+            dict: Количество активных чатов, занятых менеджеров, обращений и изменений
+        """
+        with self._lock:
+            return {
+                'active_chats': len(self._client_manager),
+                'managers': len(self._manager_clients),
+                'lookups': self.lookups,
+                'updates': self.updates
+            }
@@ -0,0 +1,274 @@
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Optional
+
+from utils.logger import logger
+
+
+class ConnectionPool:
+    """Ограниченный пул долгоживущих соединений SQLite
+
+    Соединения создаются один раз и переиспользуются между вызовами.
+    Внутри одного потока пул реентерабелен: вложенные вызовы методов
+    базы данных получают то же самое соединение, что и внешний вызов,
+    поэтому незакоммиченные изменения внешнего метода видны вложенному.
+    """
+
+    def __init__(self, db_file: str, max_size: int = 5, statement_cache_size: int = 128,
+                 health_check_interval: float = 30.0, timeout: float = 10.0,
+                 pragmas: Optional[dict] = None, attach: Optional[dict] = None):
+        self.db_file = db_file
+        self.pragmas = pragmas or {}
+        # Дополнительные файлы баз {имя схемы: путь}, подключаемые к каждому соединению
+        self.attach = attach or {}
+        self.max_size = max_size
+        self.statement_cache_size = statement_cache_size
+        self.health_check_interval = health_check_interval
+        self.timeout = timeout
+
+        self._idle = deque()  # (connection, время последнего использования)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._local = threading.local()
+        self._closed = False
+
+        # Счетчики пула
+        self.hits = 0
+        self.misses = 0
+        self.health_check_failures = 0
+        self.exhausted = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """Открытие нового соединения с настройками из профиля хранения"""
+        conn = sqlite3.connect(
+            self.db_file,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=self.statement_cache_size
+        )
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        for schema, path in self.attach.items():
+            conn.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+        return conn
+
+    def _is_healthy(self, conn: sqlite3.Connection) -> bool:
+        """Проверка, что соединение все еще пригодно для работы"""
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error as e:
+            logger.warning(f"Pooled connection failed health check: {e}")
+            return False
+
+    def _checkout(self) -> sqlite3.Connection:
+        """Выдача свободного соединения из пула или создание нового"""
+        while True:
+            with self._lock:
+                item = self._idle.pop() if self._idle else None
+                if item is None:
+                    self.misses += 1
+            if item is None:
+                return self._connect()
+
+            conn, last_used = item
+            if time.monotonic() - last_used > self.health_check_interval and not self._is_healthy(conn):
+                with self._lock:
+                    self.health_check_failures += 1
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+                continue
+
+            with self._lock:
+                self.hits += 1
+            return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """Получение соединения для текущего потока"""
+        lease = getattr(self._local, 'lease', None)
+        if lease is not None:
+            # Вложенный вызов в том же потоке - используем то же соединение
+            lease[1] += 1
+            return lease[0]
+
+        if self._closed:
+            raise sqlite3.ProgrammingError("Connection pool is closed")
+
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.exhausted += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                raise sqlite3.OperationalError(
+                    f"Connection pool exhausted ({self.max_size} connections in use)"
+                )
+
+        try:
+            conn = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+
+        self._local.lease = [conn, 1]
+        return conn
+
+    def release(self, conn: sqlite3.Connection):
+        """Возврат соединения в пул"""
+        lease = getattr(self._local, 'lease', None)
+        if lease is None or lease[0] is not conn:
+            logger.warning("Attempt to release a connection not leased by this thread")
+            return
+
+        lease[1] -= 1
+        if lease[1] > 0:
+            return
+
+        self._local.lease = None
+        try:
+            # Не оставляем незавершенных транзакций следующему владельцу соединения
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error as e:
+            logger.error(f"Error resetting pooled connection: {e}")
+
+        with self._lock:
+            if self._closed:
+                conn.close()
+            else:
+                self._idle.append((conn, time.monotonic()))
+        self._slots.release()
+
+    def stats(self) -> dict:
+        """Статистика пула соединений
+
+        Returns:
+            dict: Счетчики попаданий и промахов, число свободных соединений и т.д.
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'max_size': self.max_size,
+                'idle': len(self._idle),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / requests, 4) if requests else 0.0,
+                'health_check_failures': self.health_check_failures,
+                'exhausted': self.exhausted,
+                'statement_cache_size': self.statement_cache_size
+            }
+
+    def close(self):
+        """Закрытие всех свободных соединений пула"""
+        with self._lock:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, _ in idle:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.error(f"Error closing pooled connection: {e}")
+
+
+class WalCheckpointer:
+    """Фоновый checkpoint журнала WAL
+
+    Периодически переносит страницы из WAL в основной файл базы, чтобы
+    журнал не разрастался между автоматическими checkpoint'ами, и ведет
+    статистику выполненных checkpoint'ов.
+    """
+
+    def __init__(self, pool: ConnectionPool, interval: float = 300.0, mode: str = "PASSIVE"):
+        self.pool = pool
+        self.interval = interval
+        self.mode = mode
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+        # Статистика
+        self.runs = 0
+        self.busy = 0
+        self.errors = 0
+        self.total_checkpointed = 0
+        self.last_log_frames = 0
+        self.last_checkpointed = 0
+        self.last_duration_ms = 0.0
+        self.last_run_at: Optional[str] = None
+
+    def start(self):
+        """Запуск фонового потока"""
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name="wal-checkpointer", daemon=True)
+            self._thread.start()
+            logger.info(f"WAL checkpointer started (interval={self.interval}s, mode={self.mode})")
+
+    def stop(self):
+        """Остановка фонового потока"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.checkpoint()
+
+    def checkpoint(self, mode: Optional[str] = None) -> Optional[tuple]:
+        """Выполнение checkpoint
+
+        Args:
+            mode: Режим checkpoint ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE')
+
+        Returns:
+            tuple: (busy, log_frames, checkpointed_frames) или None при ошибке
+        """
+        mode = (mode or self.mode).upper()
+        start_time = time.monotonic()
+        conn = None
+        try:
+            conn = self.pool.acquire()
+            result = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Error running WAL checkpoint: {e}")
+            with self._lock:
+                self.errors += 1
+            return None
+        finally:
+            if conn is not None:
+                self.pool.release(conn)
+
+        busy, log_frames, checkpointed = result
+        with self._lock:
+            self.runs += 1
+            self.busy += 1 if busy else 0
+            self.last_log_frames = log_frames
+            self.last_checkpointed = checkpointed
+            self.total_checkpointed += max(checkpointed, 0)
+            self.last_duration_ms = round((time.monotonic() - start_time) * 1000, 2)
+            self.last_run_at = datetime.now().isoformat()
+        return result
+
+    def stats(self) -> dict:
+        """Статистика checkpoint'ов
+
+        Returns:
+            dict: Количество запусков, занятых попыток, ошибок и данные последнего checkpoint
+        """
+        with self._lock:
+            return {
+                'interval': self.interval,
+                'mode': self.mode,
+                'runs': self.runs,
+                'busy': self.busy,
+                'errors': self.errors,
+                'total_checkpointed_frames': self.total_checkpointed,
+                'last_log_frames': self.last_log_frames,
+                'last_checkpointed_frames': self.last_checkpointed,
+                'last_duration_ms': self.last_duration_ms,
+                'last_run_at': self.last_run_at
+            }
@@ -0,0 +1,116 @@
+"""Локальная имитация Telegram Bot API для проверки webhook без сети
+
+Пример:
+
+    fake = FakeTelegram()
+    await fake.start()
+    bot = Bot(token, session=fake.session())
+    ...  # запуск WebhookServer на localhost
+    await fake.send_update(webhook_url, fake.message_update(user_id, "Каталог"), secret)
+    print(fake.requests)  # [('sendMessage', {...}), ...]
+    await fake.stop()
+"""
+import itertools
+import time
+from typing import List, Optional, Tuple
+
+import aiohttp
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+
+
+class FakeTelegram:
+    """HTTP-сервер, отвечающий на запросы бота как Bot API
+
+    Все запросы сохраняются в requests. Методы send* возвращают сообщение,
+    getMe - бота, остальные методы - True. Для отправки обновлений в
+    webhook бота используется send_update().
+    """
+
+    BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Support Bot', 'username': 'support_bot'}
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8081):
+        self.host = host
+        self.port = port
+        self.requests: List[Tuple[str, dict]] = []
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def session(self) -> AiohttpSession:
+        """Сессия бота, направляющая запросы в эту имитацию"""
+        return AiohttpSession(api=TelegramAPIServer.from_base(self.base_url))
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle_method)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        self.requests.append((method, params))
+
+        if method == 'getMe':
+            result = self.BOT_USER
+        elif method.startswith('send'):
+            result = {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'},
+                'from': self.BOT_USER,
+                'text': params.get('text', '')
+            }
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    def message_update(self, user_id: int, text: str, first_name: str = "Client",
+                       username: Optional[str] = None) -> dict:
+        """Обновление с текстовым сообщением пользователя"""
+        user = {'id': user_id, 'is_bot': False, 'first_name': first_name}
+        if username:
+            user['username'] = username
+        return {
+            'update_id': next(self._update_ids),
+            'message': {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private', 'first_name': first_name},
+                'from': user,
+                'text': text
+            }
+        }
+
+    async def send_update(self, webhook_url: str, update: dict, secret: str = "") -> int:
+        """Доставка обновления в webhook бота, как это делает Telegram
+
+        Returns:
+            int: HTTP-статус ответа бота
+        """
+        headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+        async with aiohttp.ClientSession() as session:
+            async with session.post(webhook_url, json=update, headers=headers) as response:
+                return response.status
+
+    def sent_messages(self, chat_id: Optional[int] = None) -> List[str]:
+        """Тексты сообщений, отправленных ботом (всем или в указанный чат)"""
+        return [
+            params.get('text', '') for method, params in self.requests
+            if method == 'sendMessage' and (chat_id is None or int(params.get('chat_id', 0)) == chat_id)
+        ]
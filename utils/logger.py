@@ -1,10 +1,8 @@
 import logging
 from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler
 import os
-from datetime import datetime, timedelta
+from datetime import datetime
 import json
-import sqlite3
-from pathlib import Path
 import inspect
 
 
@@ -224,183 +222,6 @@ class BotMonitoring:
         }))
 
 
-class AnalyticsReporter:
-    """Класс для генерации аналитических отчетов"""
-    
-    @staticmethod
-    def get_manager_performance_report(db_path, manager_id=None, days=7):
-        """Получает отчет о производительности менеджеров за указанный период"""
-        try:
-            # Подключаемся к базе данных
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            
-            # Определяем период отчета
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=days)
-            
-            # Строим запрос в зависимости от того, запрашиваются ли данные по конкретному менеджеру
-            if manager_id:
-                query = """
-                SELECT 
-                    m.id as manager_id,
-                    m.name as manager_name,
-                    COUNT(c.client_id) as total_chats,
-                    AVG(r.rating) as avg_rating,
-                    COUNT(r.rating) as rating_count,
-                    SUM(CASE WHEN r.rating >= 4 THEN 1 ELSE 0 END) as positive_ratings,
-                    SUM(CASE WHEN r.rating <= 2 THEN 1 ELSE 0 END) as negative_ratings
-                FROM 
-                    managers m
-                LEFT JOIN 
-                    chats c ON m.id = c.manager_id
-                LEFT JOIN 
-                    ratings r ON c.client_id = r.chat_id
-                WHERE 
-                    m.id = ? AND
-                    c.status = 'closed' AND
-                    r.timestamp BETWEEN ? AND ?
-                GROUP BY 
-                    m.id
-                """
-                cursor.execute(query, (manager_id, start_date.isoformat(), end_date.isoformat()))
-            else:
-                query = """
-                SELECT 
-                    m.id as manager_id,
-                    m.name as manager_name,
-                    COUNT(c.client_id) as total_chats,
-                    AVG(r.rating) as avg_rating,
-                    COUNT(r.rating) as rating_count,
-                    SUM(CASE WHEN r.rating >= 4 THEN 1 ELSE 0 END) as positive_ratings,
-                    SUM(CASE WHEN r.rating <= 2 THEN 1 ELSE 0 END) as negative_ratings
-                FROM 
-                    managers m
-                LEFT JOIN 
-                    chats c ON m.id = c.manager_id
-                LEFT JOIN 
-                    ratings r ON c.client_id = r.chat_id
-                WHERE 
-                    c.status = 'closed' AND
-                    r.timestamp BETWEEN ? AND ?
-                GROUP BY 
-                    m.id
-                ORDER BY 
-                    avg_rating DESC
-                """
-                cursor.execute(query, (start_date.isoformat(), end_date.isoformat()))
-            
-            # Получаем результаты
-            results = cursor.fetchall()
-            
-            # Преобразуем результаты в словарь для удобства
-            report = []
-            for row in results:
-                manager_data = {
-                    'manager_id': row[0],
-                    'manager_name': row[1] or f"Manager {row[0]}",
-                    'total_chats': row[2],
-                    'avg_rating': round(row[3], 2) if row[3] is not None else 0,
-                    'rating_count': row[4],
-                    'positive_ratings': row[5] or 0,
-                    'negative_ratings': row[6] or 0,
-                    'period': f"{start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}"
-                }
-                report.append(manager_data)
-            
-            return report
-        except Exception as e:
-            db_logger.error(f"Error generating manager performance report: {e}")
-            return []
-        finally:
-            if conn:
-                conn.close()
-    
-    @staticmethod
-    def get_response_time_report(log_path="logs/analytics.log", days=7):
-        """Анализирует время отклика менеджеров из лог-файла аналитики"""
-        try:
-            # Определяем период отчета
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=days)
-            
-            # Словари для хранения данных
-            chat_started = {}  # client_id -> timestamp
-            manager_response_times = {}  # manager_id -> [response_times]
-            
-            # Читаем лог-файл
-            log_file = Path(log_path)
-            if not log_file.exists():
-                return {}
-            
-            with open(log_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    try:
-                        # Извлекаем JSON из строки лога
-                        parts = line.strip().split(' - ')
-                        if len(parts) >= 4:
-                            try:
-                                log_data = json.loads(parts[3])
-                            except:
-                                continue
-                            
-                            # Парсим временную метку
-                            log_timestamp = datetime.fromisoformat(log_data.get('timestamp', '').replace('Z', '+00:00'))
-                            
-                            # Проверяем, входит ли запись в анализируемый период
-                            if not (start_date <= log_timestamp <= end_date):
-                                continue
-                            
-                            # Обрабатываем события
-                            event = log_data.get('event')
-                            
-                            if event == 'chat_started':
-                                client_id = log_data.get('client_id')
-                                chat_started[client_id] = log_timestamp
-                            
-                            elif event == 'chat_accepted':
-                                client_id = log_data.get('client_id')
-                                manager_id = log_data.get('manager_id')
-                                
-                                # Если есть запись о начале чата, вычисляем время отклика
-                                if client_id in chat_started:
-                                    start_time = chat_started[client_id]
-                                    response_time = (log_timestamp - start_time).total_seconds()
-                                    
-                                    # Добавляем в статистику менеджера
-                                    if manager_id not in manager_response_times:
-                                        manager_response_times[manager_id] = []
-                                    
-                                    manager_response_times[manager_id].append(response_time)
-                    except Exception as e:
-                        continue
-            
-            # Готовим отчет
-            report = []
-            for manager_id, response_times in manager_response_times.items():
-                if response_times:
-                    avg_response_time = sum(response_times) / len(response_times)
-                    min_response_time = min(response_times)
-                    max_response_time = max(response_times)
-                    
-                    report.append({
-                        'manager_id': manager_id,
-                        'avg_response_time': round(avg_response_time, 2),
-                        'min_response_time': round(min_response_time, 2),
-                        'max_response_time': round(max_response_time, 2),
-                        'response_count': len(response_times),
-                        'period': f"{start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}"
-                    })
-            
-            # Сортируем по среднему времени отклика (от наименьшего к наибольшему)
-            report.sort(key=lambda x: x['avg_response_time'])
-            
-            return report
-        except Exception as e:
-            logger.error(f"Error generating response time report: {e}")
-            return []
-
-
 # Класс-декоратор для измерения времени выполнения
 class PerformanceMonitor:
     """Декоратор для измерения производительности функций"""
@@ -0,0 +1,192 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional
+
+from utils.logger import logger
+
+
+class MessageJournal:
+    """Отложенная пакетная запись сообщений и отметок о прочтении
+
+    Вместо отдельной транзакции на каждое сообщение операции
+    накапливаются в памяти и записываются одной транзакцией каждые
+    flush_interval секунд или при накоплении max_batch операций.
+    Порядок операций сохраняется. Время сообщения и обращение, к
+    которому оно относится, фиксируются при постановке в журнал, а не
+    при записи в базу: пока сообщение ждет записи, чат могут закрыть и
+    открыть заново (в том числе в другом процессе-обработчике).
+
+    Операции, не записанные из-за временной ошибки (например, база
+    заблокирована), возвращаются в начало очереди и записываются
+    повторно не чаще раза в retry_interval секунд.
+    """
+
+    def __init__(self, write_batch: Callable[[list], Awaitable],
+                 session_of: Callable[[int], Awaitable[Optional[int]]],
+                 flush_interval: float = 0.05, max_batch: int = 200,
+                 retry_interval: float = 1.0, close_timeout: float = 30.0):
+        """
+        Args:
+            write_batch: Корутина, записывающая список операций одной транзакцией;
+                возвращает (количество записанных, список операций для повтора)
+            session_of: Корутина, возвращающая ID текущего обращения чата
+            flush_interval: Максимальная задержка записи (сек)
+            max_batch: Количество операций, при котором запись начинается сразу
+            retry_interval: Пауза перед повтором после неудачной записи (сек)
+            close_timeout: Сколько при остановке повторять запись оставшихся операций (сек)
+        """
+        self.write_batch = write_batch
+        self.session_of = session_of
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.retry_interval = retry_interval
+        self.close_timeout = close_timeout
+
+        self._pending = []
+        self._has_rows: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+        # Метрики
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.errors = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    async def start(self):
+        """Запуск фоновой записи"""
+        if self._task is None:
+            self._has_rows = asyncio.Event()
+            self._full = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Message journal started (interval={self.flush_interval}s, batch={self.max_batch})")
+
+    async def close(self):
+        """Остановка фоновой записи с сохранением всех накопленных операций"""
+        if self._task is None:
+            return
+        # Останавливаем задачу только между записями, чтобы не потерять взятый пакет
+        async with self._flush_lock:
+            self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+        deadline = time.monotonic() + self.close_timeout
+        while await self.flush() and time.monotonic() < deadline:
+            await asyncio.sleep(self.retry_interval)
+        if self._pending:
+            logger.critical(
+                f"Message journal stopped with {len(self._pending)} unwritten operations, they are lost"
+            )
+            for kind, args in self._pending:
+                logger.critical(f"Lost journal operation {kind} {args}")
+            self.dropped += len(self._pending)
+            self._pending = []
+        logger.info(f"Message journal stopped, {self.rows_flushed} operations written")
+
+    async def _run(self):
+        while True:
+            await self._has_rows.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            if await self.flush():
+                await asyncio.sleep(self.retry_interval)
+
+    async def _append(self, operation: tuple):
+        if self._task is None:
+            await self.start()
+        self._pending.append(operation)
+        self.max_depth = max(self.max_depth, len(self._pending))
+        self._has_rows.set()
+        if len(self._pending) >= self.max_batch:
+            self._full.set()
+
+    async def save_message(self, chat_id: int, sender_id: int, message_text: str,
+                           message_type: str = 'text', file_id: str = None) -> bool:
+        """Постановка сообщения в журнал (аргументы как у Database.save_message)"""
+        # Формат и часовой пояс как у CURRENT_TIMESTAMP в SQLite
+        timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        session_id = await self.session_of(chat_id)
+        await self._append(
+            ('message', (chat_id, sender_id, message_text, message_type, file_id, timestamp, session_id))
+        )
+        return True
+
+    async def mark_messages_as_read(self, chat_id: int, user_id: int) -> bool:
+        """Постановка отметки о прочтении в журнал (аргументы как у Database.mark_messages_as_read)"""
+        await self._append(('read', (chat_id, user_id)))
+        return True
+
+    async def flush(self) -> int:
+        """Запись всех накопленных операций одной транзакцией
+
+        Returns:
+            int: Количество операций, оставшихся в очереди из-за ошибки записи
+        """
+        if self._flush_lock is None:
+            return 0
+        async with self._flush_lock:
+            operations, self._pending = self._pending, []
+            self._has_rows.clear()
+            self._full.clear()
+            if not operations:
+                return 0
+
+            start_time = time.monotonic()
+            try:
+                written, failed = await self.write_batch(operations)
+            except Exception as e:
+                logger.error(f"Error flushing message journal ({len(operations)} operations): {e}")
+                written, failed = 0, operations
+            elapsed_ms = (time.monotonic() - start_time) * 1000
+
+            # Операции с постоянной ошибкой база не записала и не вернула для повтора
+            dropped = len(operations) - written - len(failed)
+            if dropped:
+                self.dropped += dropped
+                logger.critical(f"Message journal dropped {dropped} operations that cannot be written")
+            if failed:
+                self.errors += len(failed)
+                # Возвращаем в начало очереди, перед операциями, поступившими во время записи
+                self._pending[:0] = failed
+                self._has_rows.set()
+                if len(self._pending) >= self.max_batch:
+                    self._full.set()
+            if written:
+                self.flushes += 1
+                self.rows_flushed += written
+                self.last_flush_ms = round(elapsed_ms, 2)
+                self.max_flush_ms = max(self.max_flush_ms, self.last_flush_ms)
+                self.total_flush_ms += elapsed_ms
+            return len(failed)
+
+    def stats(self) -> dict:
+        """Статистика журнала
+
+        Returns:
+            dict: Глубина очереди, количество и задержка записей пакетов
+        """
+        return {
+            'pending': len(self._pending),
+            'max_depth': self.max_depth,
+            'flushes': self.flushes,
+            'rows_flushed': self.rows_flushed,
+            'avg_batch_size': round(self.rows_flushed / self.flushes, 2) if self.flushes else 0.0,
+            'errors': self.errors,
+            'dropped': self.dropped,
+            'last_flush_ms': self.last_flush_ms,
+            'max_flush_ms': self.max_flush_ms,
+            'avg_flush_ms': round(self.total_flush_ms / self.flushes, 2) if self.flushes else 0.0
+        }
@@ -0,0 +1,514 @@
+"""Версионированные миграции схемы базы данных
+
+Текущая версия схемы хранится в PRAGMA user_version. При запуске
+применяются только миграции с номером больше текущей версии, каждая в
+отдельной транзакции вместе с обновлением user_version. Если версия
+базы равна LATEST_VERSION, схема не проверяется вовсе.
+
+Версия 0 означает неверсионированную базу: перед миграциями для нее
+выполняется Database._create_tables(), которая создает базовую схему и
+дополняет таблицы старых версий бота.
+"""
+
+# Сводная статистика менеджеров: (таблица, столбец периода, формат strftime
+# периода в местном времени). Обе таблицы имеют одинаковые счетчики.
+MANAGER_STATS_PERIODS = (
+    ('manager_stats_hourly', 'hour', '%Y-%m-%d %H:00'),
+    ('manager_stats_daily', 'day', '%Y-%m-%d'),
+)
+
+# Счетчики, которые увеличиваются при событиях обращения
+MANAGER_STATS_COUNTERS = (
+    'chats_accepted', 'response_time_sum', 'chats_closed', 'duration_sum',
+    'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5',
+)
+
+
+def _manager_stats_migration(table: str, period: str, fmt: str) -> tuple:
+    """Таблица сводной статистики за период и ее заполнение из sessions"""
+    return (
+        f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            {period} TEXT NOT NULL,
+            manager_id INTEGER NOT NULL,
+            chats_accepted INTEGER NOT NULL DEFAULT 0,
+            response_time_sum REAL NOT NULL DEFAULT 0,
+            response_time_min REAL,
+            response_time_max REAL,
+            chats_closed INTEGER NOT NULL DEFAULT 0,
+            duration_sum REAL NOT NULL DEFAULT 0,
+            rating_1 INTEGER NOT NULL DEFAULT 0,
+            rating_2 INTEGER NOT NULL DEFAULT 0,
+            rating_3 INTEGER NOT NULL DEFAULT 0,
+            rating_4 INTEGER NOT NULL DEFAULT 0,
+            rating_5 INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY ({period}, manager_id)
+        ) WITHOUT ROWID
+        """,
+        # Принятие, закрытие и оценка обращения попадают в период своего события.
+        # Перенесенные из старой схемы обращения не учитываются: их отметки
+        # времени неизвестны, а менеджер определен по последнему чату клиента
+        f"""
+        INSERT INTO {table} (
+            {period}, manager_id, chats_accepted, response_time_sum, response_time_min,
+            response_time_max, chats_closed, duration_sum,
+            rating_1, rating_2, rating_3, rating_4, rating_5
+        )
+        SELECT bucket, manager_id, SUM(accepted), TOTAL(response_time), MIN(response_time),
+               MAX(response_time), SUM(closed), TOTAL(duration),
+               COUNT(CASE WHEN rating = 1 THEN 1 END), COUNT(CASE WHEN rating = 2 THEN 1 END),
+               COUNT(CASE WHEN rating = 3 THEN 1 END), COUNT(CASE WHEN rating = 4 THEN 1 END),
+               COUNT(CASE WHEN rating = 5 THEN 1 END)
+        FROM (
+            SELECT strftime('{fmt}', accepted_at, 'unixepoch', 'localtime') AS bucket, manager_id,
+                   1 AS accepted, accepted_at - created_at AS response_time,
+                   0 AS closed, NULL AS duration, NULL AS rating
+            FROM sessions
+            WHERE NOT is_legacy AND manager_id IS NOT NULL AND created_at IS NOT NULL AND accepted_at IS NOT NULL
+            UNION ALL
+            SELECT strftime('{fmt}', closed_at, 'unixepoch', 'localtime'), manager_id,
+                   0, NULL, 1, closed_at - accepted_at, NULL
+            FROM sessions
+            WHERE NOT is_legacy AND manager_id IS NOT NULL AND accepted_at IS NOT NULL AND closed_at IS NOT NULL
+            UNION ALL
+            SELECT strftime('{fmt}', rated_at, 'unixepoch', 'localtime'), manager_id,
+                   0, NULL, 0, NULL, rating
+            FROM sessions
+            WHERE NOT is_legacy AND manager_id IS NOT NULL AND rating IS NOT NULL AND rated_at IS NOT NULL
+        )
+        GROUP BY bucket, manager_id
+        """,
+    )
+
+
+# (версия, описание, SQL-выражения)
+MIGRATIONS = [
+    (1, "Индексы для горячих запросов по messages, chats и managers", (
+        # История чата: WHERE chat_id = ? ORDER BY timestamp
+        """
+        CREATE INDEX IF NOT EXISTS idx_messages_chat_timestamp
+        ON messages (chat_id, timestamp)
+        """,
+        # Непрочитанные сообщения: WHERE chat_id = ? AND sender_id != ? AND is_read = FALSE
+        """
+        CREATE INDEX IF NOT EXISTS idx_messages_unread
+        ON messages (chat_id, sender_id)
+        WHERE is_read = FALSE
+        """,
+        # Поиск клиента по username при принятии чата
+        """
+        CREATE INDEX IF NOT EXISTS idx_chats_username
+        ON chats (username)
+        """,
+        # Ожидающие/активные чаты и статистика по статусам
+        """
+        CREATE INDEX IF NOT EXISTS idx_chats_status_manager
+        ON chats (status, manager_id)
+        """,
+        # Активный чат менеджера: WHERE manager_id = ? AND is_active = TRUE
+        """
+        CREATE INDEX IF NOT EXISTS idx_chats_active_manager
+        ON chats (manager_id)
+        WHERE is_active = TRUE
+        """,
+        # Выбор наименее загруженного доступного менеджера
+        """
+        CREATE INDEX IF NOT EXISTS idx_managers_available
+        ON managers (active_chats, last_activity)
+        WHERE is_active = TRUE AND is_available = TRUE
+        """,
+    )),
+    (2, "Таблица состояния навигации по каталогу", (
+        """
+        CREATE TABLE IF NOT EXISTS navigation_state (
+            user_id INTEGER PRIMARY KEY,
+            category TEXT,
+            subcategory TEXT,
+            type TEXT,
+            updated_at REAL NOT NULL
+        )
+        """,
+        # Загрузка последних и удаление устаревших состояний
+        """
+        CREATE INDEX IF NOT EXISTS idx_navigation_state_updated
+        ON navigation_state (updated_at)
+        """,
+    )),
+    (3, "Время постановки чата в очередь ожидания", (
+        "ALTER TABLE chats ADD COLUMN enqueued_at REAL",
+        # Уже ожидающим чатам время постановки неизвестно и остается NULL:
+        # в очереди они идут первыми, ожидание считается от запуска бота
+        # Очередь ожидания: WHERE status = 'pending' ORDER BY enqueued_at
+        """
+        CREATE INDEX IF NOT EXISTS idx_chats_pending_queue
+        ON chats (enqueued_at)
+        WHERE status = 'pending'
+        """,
+    )),
+    (4, "Индекс для постраничного чтения истории чата", (
+        # Страницы истории: WHERE chat_id = ? AND id < ? ORDER BY id DESC
+        """
+        CREATE INDEX IF NOT EXISTS idx_messages_chat_id
+        ON messages (chat_id, id)
+        """,
+    )),
+    (5, "Полнотекстовый индекс сообщений (FTS5)", (
+        # Индекс без копии текста: содержимое читается из messages по rowid
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            message_text,
+            content = 'messages',
+            content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, message_text) VALUES (new.id, new.message_text);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, message_text)
+            VALUES ('delete', old.id, old.message_text);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF message_text ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, message_text)
+            VALUES ('delete', old.id, old.message_text);
+            INSERT INTO messages_fts (rowid, message_text) VALUES (new.id, new.message_text);
+        END
+        """,
+        # Индексируем уже сохраненные сообщения
+        "INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')",
+    )),
+    (6, "Время закрытия и архивации чата", (
+        "ALTER TABLE chats ADD COLUMN closed_at REAL",
+        "ALTER TABLE chats ADD COLUMN archived_at REAL",
+        # Уже закрытым чатам время закрытия неизвестно и остается NULL
+        # Очередь архивации: WHERE status = 'closed' AND archived_at IS NULL AND closed_at < ?
+        """
+        CREATE INDEX IF NOT EXISTS idx_chats_archive_queue
+        ON chats (closed_at)
+        WHERE status = 'closed' AND archived_at IS NULL
+        """,
+    )),
+    (7, "Сессии обращений: отдельная запись на каждое обращение клиента", (
+        """
+        CREATE TABLE IF NOT EXISTS sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id INTEGER NOT NULL,
+            manager_id INTEGER,
+            created_at REAL,
+            accepted_at REAL,
+            closed_at REAL,
+            rating INTEGER,
+            rating_comment TEXT,
+            rated_at REAL,
+            is_legacy BOOLEAN NOT NULL DEFAULT FALSE,
+            FOREIGN KEY (client_id) REFERENCES chats (client_id) ON DELETE CASCADE
+        )
+        """,
+        # Обращения клиента: WHERE client_id = ? ORDER BY id DESC
+        """
+        CREATE INDEX IF NOT EXISTS idx_sessions_client
+        ON sessions (client_id, id)
+        """,
+        # Закрытые обращения менеджера за период
+        """
+        CREATE INDEX IF NOT EXISTS idx_sessions_manager_closed
+        ON sessions (manager_id, closed_at)
+        """,
+        "ALTER TABLE chats ADD COLUMN current_session_id INTEGER",
+        "ALTER TABLE messages ADD COLUMN session_id INTEGER",
+        # Каждый существующий чат становится одним обращением с пометкой
+        # is_legacy. Переносятся только известные отметки времени, время
+        # принятия не хранилось вовсе. Перенесенные обращения не продолжаются
+        # новыми событиями и не попадают в сводную статистику.
+        """
+        INSERT INTO sessions (client_id, manager_id, created_at, closed_at, is_legacy)
+        SELECT client_id, manager_id, enqueued_at,
+               CASE WHEN status = 'closed' THEN closed_at END, TRUE
+        FROM chats
+        """,
+        """
+        UPDATE chats SET current_session_id = (
+            SELECT MAX(id) FROM sessions WHERE sessions.client_id = chats.client_id
+        )
+        """,
+        """
+        UPDATE sessions SET (rating, rating_comment, rated_at) = (
+            SELECT rating, comment, CAST(strftime('%s', timestamp) AS REAL)
+            FROM chat_ratings WHERE chat_ratings.chat_id = sessions.client_id
+        )
+        WHERE client_id IN (SELECT chat_id FROM chat_ratings)
+        """,
+        """
+        UPDATE messages SET session_id = (
+            SELECT current_session_id FROM chats WHERE chats.client_id = messages.chat_id
+        )
+        """,
+        # Сообщения обращения: WHERE session_id = ? ORDER BY id
+        """
+        CREATE INDEX IF NOT EXISTS idx_messages_session
+        ON messages (session_id, id)
+        """,
+    )),
+    (8, "Сводная статистика менеджеров по часам и дням", (
+        *_manager_stats_migration(*MANAGER_STATS_PERIODS[0]),
+        *_manager_stats_migration(*MANAGER_STATS_PERIODS[1]),
+    )),
+    (9, "Удаление индексов messages, замененных idx_messages_chat_id", (
+        # История и непрочитанные сообщения читаются по (chat_id, id); эти
+        # индексы планировщик больше не выбирает, а обновляются они при
+        # каждой вставке и отметке о прочтении
+        "DROP INDEX IF EXISTS idx_messages_chat_timestamp",
+        "DROP INDEX IF EXISTS idx_messages_unread",
+    )),
+    (10, "Составной индекс очереди ожидающих чатов", (
+        # Частичный индекс по enqueued_at планировщик не выбирал: запрос
+        # читался по idx_chats_status_manager с сортировкой во временном дереве.
+        # Очередь: WHERE status = 'pending' ORDER BY enqueued_at, client_id
+        "DROP INDEX IF EXISTS idx_chats_pending_queue",
+        """
+        CREATE INDEX IF NOT EXISTS idx_chats_status_enqueued
+        ON chats (status, enqueued_at)
+        """,
+    )),
+    (11, "Составной индекс очереди архивации", (
+        # Частичный индекс по closed_at тоже не выбирался. Очередь архивации:
+        # WHERE status = 'closed' AND archived_at IS NULL
+        #   AND (closed_at IS NULL OR closed_at < ?) ORDER BY closed_at
+        "DROP INDEX IF EXISTS idx_chats_archive_queue",
+        """
+        CREATE INDEX IF NOT EXISTS idx_chats_archive_queue
+        ON chats (status, archived_at, closed_at)
+        """,
+    )),
+    (12, "Удаление неиспользуемого индекса закрытых обращений менеджера", (
+        # Отчеты читают сводную статистику, а не sessions
+        "DROP INDEX IF EXISTS idx_sessions_manager_closed",
+    )),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# Схема архива сообщений закрытых чатов (отдельный файл, подключается как "archive").
+# Архив не версионируется: таблица повторяет столбцы messages.
+ARCHIVE_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS archive.messages (
+        id INTEGER PRIMARY KEY,
+        chat_id INTEGER NOT NULL,
+        sender_id INTEGER NOT NULL,
+        message_text TEXT NOT NULL,
+        message_type TEXT DEFAULT 'text',
+        file_id TEXT,
+        timestamp DATETIME,
+        is_read BOOLEAN DEFAULT FALSE,
+        session_id INTEGER
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS archive.idx_archive_messages_chat_id
+    ON messages (chat_id, id)
+    """,
+    # Полнотекстовый индекс архива: поиск идет по обеим базам
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS archive.messages_fts USING fts5(
+        message_text,
+        content = 'messages',
+        content_rowid = 'id',
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS archive.messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts (rowid, message_text) VALUES (new.id, new.message_text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS archive.messages_fts_delete AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, message_text)
+        VALUES ('delete', old.id, old.message_text);
+    END
+    """,
+)
+
+# Столбцы, появившиеся в archive.messages позже: (столбец, тип, индекс).
+# Недостающие столбцы добавляются при запуске, затем создается индекс.
+ARCHIVE_COLUMNS = (
+    ('session_id', 'INTEGER', """
+    CREATE INDEX IF NOT EXISTS archive.idx_archive_messages_session
+    ON messages (session_id, id)
+    """),
+)
+
+# История сообщений вместе с архивом. Условия по chat_id (session_id) и id
+# SQLite переносит в обе части и сливает их, читая каждую по индексу.
+MESSAGE_HISTORY = """(
+    SELECT id, chat_id, sender_id, message_text, message_type, file_id, timestamp, is_read, session_id
+    FROM main.messages
+    UNION ALL
+    SELECT id, chat_id, sender_id, message_text, message_type, file_id, timestamp, is_read, session_id
+    FROM archive.messages
+)"""
+
+# Запросы горячего пути, которые не должны выполняться полным сканированием таблицы
+# или сортировкой во временном дереве: имя -> (запрос, параметры[, допустимые шаги плана]).
+# Используются Database.check_query_plans() для проверки EXPLAIN QUERY PLAN; каждый
+# индекс idx_* должен использоваться хотя бы одним из этих запросов.
+HOT_QUERIES = {
+    'get_chat_history': (
+        f"""
+        SELECT id, sender_id, message_text, message_type, file_id, timestamp, is_read
+        FROM {MESSAGE_HISTORY}
+        WHERE chat_id = ?
+        ORDER BY id DESC
+        LIMIT ?
+        """,
+        (0, 50)
+    ),
+    'get_chat_history_page': (
+        f"""
+        SELECT id, sender_id, message_text, message_type, file_id, timestamp, is_read
+        FROM {MESSAGE_HISTORY}
+        WHERE chat_id = ? AND id < ?
+        ORDER BY id DESC
+        LIMIT ?
+        """,
+        (0, 0, 11)
+    ),
+    'get_message_by_id': (
+        f"""
+        SELECT id, sender_id, message_text, message_type, file_id, timestamp, is_read
+        FROM {MESSAGE_HISTORY}
+        WHERE id = ? AND chat_id = ?
+        """,
+        (0, 0)
+    ),
+    'search_messages': (
+        """
+        SELECT m.id
+        FROM messages_fts
+        JOIN messages m ON m.id = messages_fts.rowid
+        WHERE messages_fts MATCH ?
+        ORDER BY messages_fts.rank
+        LIMIT ?
+        """,
+        ('""', 20)
+    ),
+    'search_messages.archive': (
+        """
+        SELECT m.id
+        FROM archive.messages_fts f
+        JOIN archive.messages m ON m.id = f.rowid
+        WHERE f.messages_fts MATCH ?
+        ORDER BY f.rank
+        LIMIT ?
+        """,
+        ('""', 20)
+    ),
+    'mark_messages_as_read': (
+        """
+        UPDATE messages
+        SET is_read = TRUE
+        WHERE chat_id = ? AND sender_id != ? AND is_read = FALSE
+        """,
+        (0, 0)
+    ),
+    'get_unread_messages_count': (
+        """
+        SELECT COUNT(*)
+        FROM messages
+        WHERE chat_id = ? AND sender_id != ? AND is_read = FALSE
+        """,
+        (0, 0)
+    ),
+    'get_client_id_by_username': (
+        "SELECT client_id FROM chats WHERE username = ?",
+        ('',)
+    ),
+    'get_pending_chats': (
+        """
+        SELECT client_id, username, client_name, client_phone, client_nickname
+        FROM chats
+        WHERE status = 'pending'
+        ORDER BY enqueued_at, client_id
+        """,
+        ()
+    ),
+    'get_active_chats_by_manager': (
+        """
+        SELECT client_id, username, client_name, client_phone
+        FROM chats
+        WHERE status = 'active' AND manager_id = ?
+        ORDER BY client_id DESC
+        """,
+        (0,)
+    ),
+    'get_active_chat': (
+        "SELECT * FROM chats WHERE manager_id = ? AND is_active = TRUE",
+        (0,)
+    ),
+    'get_session_history': (
+        f"""
+        SELECT id, sender_id, message_text, message_type, file_id, timestamp, is_read
+        FROM {MESSAGE_HISTORY}
+        WHERE session_id = ?
+        ORDER BY id
+        LIMIT ?
+        """,
+        (0, 50)
+    ),
+    'archive_closed_chats': (
+        """
+        SELECT client_id FROM chats
+        WHERE status = 'closed' AND archived_at IS NULL AND (closed_at IS NULL OR closed_at < ?)
+        ORDER BY closed_at
+        LIMIT ?
+        """,
+        (0.0, 50)
+    ),
+    'get_manager_report': (
+        """
+        SELECT s.manager_id, m.name, SUM(s.chats_accepted), SUM(s.chats_closed)
+        FROM manager_stats_daily s
+        LEFT JOIN managers m ON m.id = s.manager_id
+        WHERE s.day BETWEEN ? AND ?
+        GROUP BY s.manager_id
+        """,
+        ('', ''),
+        # Группируются строки одного отчета: дни периода на число менеджеров
+        ('USE TEMP B-TREE FOR GROUP BY',)
+    ),
+    'get_client_sessions': (
+        """
+        SELECT id, created_at, closed_at
+        FROM sessions
+        WHERE client_id = ?
+        ORDER BY id DESC
+        LIMIT ?
+        """,
+        (0, 10)
+    ),
+    'load_navigation_states': (
+        """
+        SELECT user_id, category, subcategory, type, updated_at
+        FROM navigation_state
+        WHERE updated_at >= ?
+        ORDER BY updated_at DESC
+        LIMIT ?
+        """,
+        (0.0, 10000)
+    ),
+    'get_dashboard_stats.available_managers': (
+        "SELECT COUNT(*) FROM managers WHERE is_available = TRUE AND is_active = TRUE",
+        ()
+    ),
+    'get_dashboard_stats.active_chats': (
+        "SELECT COUNT(*) FROM chats WHERE status = 'active'",
+        ()
+    ),
+}
@@ -0,0 +1,255 @@
+import asyncio
+import sys
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from utils.logger import logger
+
+
+class NavigationState:
+    """Выбор пользователя в каталоге"""
+
+    __slots__ = ('category', 'subcategory', 'type_name', 'touched_at')
+
+    def __init__(self, category: Optional[str] = None, subcategory: Optional[str] = None,
+                 type_name: Optional[str] = None, touched_at: float = 0.0):
+        self.category = category
+        self.subcategory = subcategory
+        self.type_name = type_name
+        self.touched_at = touched_at
+
+    def size(self) -> int:
+        """Приблизительный объем памяти, занимаемый записью (байт)"""
+        return sys.getsizeof(self) + sum(
+            sys.getsizeof(value) for value in (self.category, self.subcategory, self.type_name)
+            if value is not None
+        )
+
+
+class SQLiteNavigationBackend:
+    """Хранение состояния навигации в таблице navigation_state
+
+    При запуске бота непросроченные состояния загружаются обратно в
+    память через синхронный Database. Изменения записываются пакетами
+    через AsyncDatabase, поэтому commit не выполняется в цикле событий.
+    """
+
+    def __init__(self, db, adb):
+        self.db = db
+        self.adb = adb
+
+    def load(self, limit: int, since: float) -> list:
+        return self.db.load_navigation_states(limit, since)
+
+    async def write(self, changes: dict) -> bool:
+        return await self.adb.write_navigation_states(changes)
+
+    def purge(self, before: float) -> int:
+        return self.db.purge_navigation_states(before)
+
+
+class NavigationStateStore:
+    """Ограниченное хранилище состояния навигации по каталогу
+
+    Записи вытесняются по LRU при превышении max_entries и устаревают,
+    если пользователь не обращался к ним дольше ttl секунд. Используется
+    из цикла событий, поэтому блокировки не нужны.
+
+    Изменения сохраняются в постоянное хранилище не сразу, а раз в
+    flush_interval секунд одним пакетом; несколько изменений выбора
+    одного пользователя за это время дают одну запись.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 1800.0, backend=None,
+                 flush_interval: float = 1.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self._states: OrderedDict = OrderedDict()  # user_id -> NavigationState, от старых к новым
+        self.memory_bytes = 0
+        # Несохраненные изменения: user_id -> (category, subcategory, type, updated_at) или None
+        self._dirty = {}
+        self._task: Optional[asyncio.Task] = None
+
+        # Статистика
+        self.evicted = 0
+        self.expired = 0
+        self.flushes = 0
+        self.write_errors = 0
+
+    def configure(self, max_entries: Optional[int] = None, ttl: Optional[float] = None, backend=None,
+                  flush_interval: Optional[float] = None):
+        """Изменение настроек хранилища после создания (из конфигурации бота)"""
+        if max_entries is not None:
+            self.max_entries = max_entries
+        if ttl is not None:
+            self.ttl = ttl
+        if backend is not None:
+            self.backend = backend
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        self._shrink()
+
+    def restore(self) -> int:
+        """Загрузка непросроченных состояний из постоянного хранилища
+
+        Returns:
+            int: Количество загруженных записей
+        """
+        if self.backend is None:
+            return 0
+        now = time.time()
+        self.backend.purge(now - self.ttl)
+        rows = self.backend.load(self.max_entries, now - self.ttl)
+        monotonic_now = time.monotonic()
+        # Строки упорядочены от новых к старым, в хранилище - наоборот
+        for user_id, category, subcategory, type_name, updated_at in reversed(rows):
+            state = NavigationState(category, subcategory, type_name, monotonic_now - (now - updated_at))
+            self._put(user_id, state)
+        logger.info(f"Restored {len(rows)} catalog navigation states")
+        return len(rows)
+
+    def _put(self, user_id: int, state: NavigationState):
+        old = self._states.pop(user_id, None)
+        if old is not None:
+            self.memory_bytes -= old.size()
+        self._states[user_id] = state
+        self.memory_bytes += state.size()
+
+    def _remove(self, user_id: int) -> Optional[NavigationState]:
+        state = self._states.pop(user_id, None)
+        if state is not None:
+            self.memory_bytes -= state.size()
+        return state
+
+    def _shrink(self):
+        """Удаление просроченных записей и вытеснение лишних по LRU"""
+        deadline = time.monotonic() - self.ttl
+        while self._states:
+            user_id, state = next(iter(self._states.items()))
+            if state.touched_at < deadline:
+                self.expired += 1
+            elif len(self._states) > self.max_entries:
+                self.evicted += 1
+            else:
+                break
+            self._remove(user_id)
+
+    def _persist(self, user_id: int, state: Optional[NavigationState]):
+        if self.backend is None:
+            return
+        self._dirty[user_id] = None if state is None else (
+            state.category, state.subcategory, state.type_name, time.time()
+        )
+
+    async def start_writer(self):
+        """Запуск фоновой записи изменений в постоянное хранилище"""
+        if self.backend is not None and self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Navigation state writer started (interval={self.flush_interval}s)")
+
+    async def close(self):
+        """Остановка фоновой записи с сохранением накопленных изменений"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Запись накопленных изменений одним пакетом
+
+        Returns:
+            int: Количество записанных изменений
+        """
+        if self.backend is None or not self._dirty:
+            return 0
+        changes, self._dirty = self._dirty, {}
+        try:
+            written = await self.backend.write(changes)
+        except Exception as e:
+            logger.error(f"Error persisting {len(changes)} navigation states: {e}")
+            written = False
+        if not written:
+            self.write_errors += 1
+            # Повторим при следующей записи, если пользователь не изменил выбор заново
+            for user_id, fields in changes.items():
+                self._dirty.setdefault(user_id, fields)
+            return 0
+        self.flushes += 1
+        return len(changes)
+
+    def get(self, user_id: int) -> Optional[NavigationState]:
+        """Получение состояния пользователя с продлением срока жизни"""
+        state = self._states.get(user_id)
+        if state is None:
+            return None
+        now = time.monotonic()
+        if now - state.touched_at > self.ttl:
+            self._remove(user_id)
+            self.expired += 1
+            return None
+        state.touched_at = now
+        self._states.move_to_end(user_id)
+        return state
+
+    def __contains__(self, user_id: int) -> bool:
+        return self.get(user_id) is not None
+
+    def start(self, user_id: int, category: str) -> NavigationState:
+        """Новый выбор, начиная с категории"""
+        state = NavigationState(category, touched_at=time.monotonic())
+        self._put(user_id, state)
+        self._shrink()
+        self._persist(user_id, state)
+        return state
+
+    def update(self, user_id: int, **fields) -> Optional[NavigationState]:
+        """Изменение полей состояния (category, subcategory, type_name)
+
+        Returns:
+            NavigationState: Обновленное состояние или None, если его нет
+        """
+        state = self.get(user_id)
+        if state is None:
+            return None
+        self.memory_bytes -= state.size()
+        for name, value in fields.items():
+            setattr(state, name, value)
+        self.memory_bytes += state.size()
+        self._persist(user_id, state)
+        return state
+
+    def clear(self, user_id: int):
+        """Сброс состояния пользователя"""
+        if self._remove(user_id) is not None:
+            self._persist(user_id, None)
+
+    def stats(self) -> dict:
+        """Статистика хранилища
+
+        Returns:
+            dict: Количество записей, объем памяти, вытесненные и просроченные записи
+        """
+        return {
+            'entries': len(self._states),
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'memory_bytes': self.memory_bytes,
+            'evicted': self.evicted,
+            'expired': self.expired,
+            'pending_writes': len(self._dirty),
+            'flushes': self.flushes,
+            'write_errors': self.write_errors,
+            'backend': type(self.backend).__name__ if self.backend else None
+        }
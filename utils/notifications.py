@@ -0,0 +1,102 @@
+import asyncio
+import time
+from typing import Iterable
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramServerError
+
+from utils.logger import logger
+from utils.outbound import NOTIFY, send_priority
+
+
+class NotificationDispatcher:
+    """Рассылка уведомлений менеджерам
+
+    Рассылка нескольким получателям (fan_out) выполняется параллельно.
+    Уведомления ставятся в общую очередь исходящих сообщений с
+    приоритетом NOTIFY: ограничение частоты и повтор после ответа 429
+    выполняет OutboundQueue. Здесь повторяются сетевые ошибки и ошибки
+    сервера (с экспоненциальной задержкой) и собирается статистика.
+    """
+
+    def __init__(self, bot: Bot, max_retries: int = 3, backoff: float = 0.5):
+        """
+        Args:
+            bot: Экземпляр бота
+            max_retries: Количество повторов отправки после сетевой ошибки
+            backoff: Начальная задержка повтора после сетевой ошибки (сек)
+        """
+        self.bot = bot
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        # Статистика
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.last_send_ms = 0.0
+        self.max_send_ms = 0.0
+        self.total_send_ms = 0.0
+
+    async def send(self, chat_id: int, text: str, **kwargs) -> bool:
+        """Отправка уведомления с повторами
+
+        Args:
+            chat_id: ID получателя
+            text: Текст сообщения
+            **kwargs: Остальные аргументы Bot.send_message
+
+        Returns:
+            bool: True, если сообщение доставлено
+        """
+        start_time = time.monotonic()
+        for attempt in range(self.max_retries + 1):
+            try:
+                with send_priority(NOTIFY):
+                    await self.bot.send_message(chat_id, text, **kwargs)
+                break
+            except (TelegramNetworkError, TelegramServerError) as e:
+                logger.warning(f"Error sending to {chat_id} (attempt {attempt + 1}): {e}")
+                if attempt < self.max_retries:
+                    self.retries += 1
+                    await asyncio.sleep(self.backoff * 2 ** attempt)
+            except Exception as e:
+                logger.error(f"Error sending message to {chat_id}: {e}")
+                self.failed += 1
+                return False
+        else:
+            logger.error(f"Giving up sending message to {chat_id} after {self.max_retries} retries")
+            self.failed += 1
+            return False
+
+        elapsed_ms = (time.monotonic() - start_time) * 1000
+        self.sent += 1
+        self.last_send_ms = round(elapsed_ms, 2)
+        self.max_send_ms = max(self.max_send_ms, self.last_send_ms)
+        self.total_send_ms += elapsed_ms
+        return True
+
+    async def fan_out(self, chat_ids: Iterable[int], text: str, **kwargs) -> int:
+        """Параллельная отправка одного сообщения нескольким получателям
+
+        Returns:
+            int: Количество получателей, которым сообщение доставлено
+        """
+        results = await asyncio.gather(*(self.send(chat_id, text, **kwargs) for chat_id in chat_ids))
+        return sum(results)
+
+    def stats(self) -> dict:
+        """Статистика отправки
+
+        Returns:
+            dict: Доставленные и неудачные отправки, повторы и задержка
+                отправки (с учетом ожидания в очереди исходящих сообщений)
+        """
+        return {
+            'sent': self.sent,
+            'failed': self.failed,
+            'retries': self.retries,
+            'last_send_ms': self.last_send_ms,
+            'max_send_ms': self.max_send_ms,
+            'avg_send_ms': round(self.total_send_ms / self.sent, 2) if self.sent else 0.0
+        }
@@ -0,0 +1,287 @@
+import asyncio
+import itertools
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+from utils.logger import logger
+
+
+# Приоритеты исходящих сообщений: меньшее значение отправляется раньше
+RELAY = 0   # Переписка клиента и менеджера и ответы на действия пользователя
+NOTIFY = 1  # Уведомления менеджеров и администратора
+REPORT = 2  # Отчеты и аналитика
+
+PRIORITY_NAMES = {RELAY: 'relay', NOTIFY: 'notify', REPORT: 'report'}
+
+_send_priority: ContextVar[int] = ContextVar('send_priority', default=RELAY)
+
+
+class send_priority:
+    """Приоритет запросов к Telegram, отправляемых внутри блока with"""
+
+    def __init__(self, priority: int):
+        self.priority = priority
+        self._token = None
+
+    def __enter__(self):
+        self._token = _send_priority.set(self.priority)
+        return self
+
+    def __exit__(self, *exc_info):
+        _send_priority.reset(self._token)
+
+
+class TokenBucket:
+    """Ограничитель частоты: rate операций в секунду с запасом capacity"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated_at')
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self) -> float:
+        """Занимает токен и возвращает, сколько секунд нужно подождать до его появления"""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def is_idle(self) -> bool:
+        """Запас полностью восстановлен - ограничитель можно удалить"""
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class _Request:
+    __slots__ = ('priority', 'make_request', 'bot', 'method', 'future', 'enqueued_at')
+
+    def __init__(self, priority, make_request, bot, method, future):
+        self.priority = priority
+        self.make_request = make_request
+        self.bot = bot
+        self.method = method
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class _ChatQueue:
+    __slots__ = ('chat_id', 'requests', 'bucket', 'scheduled')
+
+    def __init__(self, chat_id, bucket: TokenBucket):
+        self.chat_id = chat_id
+        self.requests = deque()
+        self.bucket = bucket
+        # Чат стоит в очереди готовых или его запрос выполняется
+        self.scheduled = False
+
+
+class OutboundQueue(BaseRequestMiddleware):
+    """Единая очередь исходящих запросов бота к Telegram
+
+    Подключается как middleware сессии бота (bot.session.middleware), поэтому
+    через нее проходят все отправки: message.answer, bot.send_message,
+    send_photo и т.д. Запросы без chat_id (getUpdates, getMe) выполняются
+    напрямую.
+
+    - Запросы в один чат выполняются строго по очереди и не чаще chat_rate
+      в секунду (с запасом chat_burst), все запросы бота - не чаще
+      global_rate в секунду.
+    - Из чатов, ожидающих отправки, первым обслуживается чат с более
+      приоритетным запросом (RELAY, затем NOTIFY, затем REPORT, см.
+      send_priority), при равном приоритете - в порядке поступления.
+    - На ответ 429 запрос повторяется после указанной Telegram паузы,
+      на время которой приостанавливается вся очередь.
+    - Если в очереди max_pending запросов, новые запросы ждут
+      освобождения места.
+    """
+
+    # Очереди простаивающих чатов удаляются, когда их становится больше
+    MAX_IDLE_CHATS = 1024
+
+    def __init__(self, global_rate: float = 30.0, chat_rate: float = 1.0, chat_burst: int = 3,
+                 workers: int = 8, max_pending: int = 1000, max_retries: int = 3):
+        """
+        Args:
+            global_rate: Максимум запросов в секунду для всего бота
+            chat_rate: Максимум запросов в секунду в один чат
+            chat_burst: Сколько запросов в чат можно отправить подряд без ожидания
+            workers: Количество одновременно выполняемых запросов
+            max_pending: Размер очереди, после которого отправители ждут
+            max_retries: Количество повторов запроса после ответа 429
+        """
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, capacity=global_rate)
+        self._chats: Dict[object, _ChatQueue] = {}
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        self._pending = 0
+
+        # (приоритет первого запроса, номер, чат) для чатов, готовых к отправке
+        self._ready: Optional[asyncio.PriorityQueue] = None
+        self._space: Optional[asyncio.Semaphore] = None
+        self._tasks = []
+
+        # Метрики
+        self.sent = 0
+        self.failed = 0
+        self.rate_limited = 0
+        self.blocked = 0
+        self.max_depth = 0
+        self.wait_ms = {name: [0, 0.0, 0.0] for name in PRIORITY_NAMES.values()}  # [количество, сумма, максимум]
+
+    def _start(self):
+        self._ready = asyncio.PriorityQueue()
+        self._space = asyncio.Semaphore(self.max_pending)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Outbound queue started ({self.workers} workers)")
+
+    async def close(self):
+        """Отправка оставшихся запросов и остановка обработчиков очереди"""
+        if not self._tasks:
+            return
+        while self._pending:
+            await asyncio.sleep(0.05)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info(f"Outbound queue stopped, {self.sent} requests sent")
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        if not self._tasks:
+            self._start()
+        if self._space.locked():
+            self.blocked += 1
+        await self._space.acquire()
+
+        future = asyncio.get_running_loop().create_future()
+        request = _Request(_send_priority.get(), make_request, bot, method, future)
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            if len(self._chats) >= self.MAX_IDLE_CHATS:
+                self._chats = {
+                    key: value for key, value in self._chats.items()
+                    if value.scheduled or not value.bucket.is_idle()
+                }
+            chat = self._chats[chat_id] = _ChatQueue(chat_id, TokenBucket(self.chat_rate, self.chat_burst))
+        chat.requests.append(request)
+        self._pending += 1
+        self.max_depth = max(self.max_depth, self._pending)
+
+        # Один чат обслуживается одним обработчиком, чтобы сохранить порядок сообщений
+        if not chat.scheduled:
+            chat.scheduled = True
+            self._push_ready(chat)
+        return await future
+
+    def _push_ready(self, chat: _ChatQueue):
+        self._ready.put_nowait((chat.requests[0].priority, next(self._sequence), chat))
+
+    async def _worker(self):
+        while True:
+            _, _, chat = await self._ready.get()
+            try:
+                await self._process(chat, chat.requests[0])
+            finally:
+                chat.requests.popleft()
+                self._pending -= 1
+                self._space.release()
+                if chat.requests:
+                    self._push_ready(chat)
+                else:
+                    chat.scheduled = False
+
+    async def _process(self, chat: _ChatQueue, request: _Request):
+        stats = self.wait_ms[PRIORITY_NAMES.get(request.priority, 'relay')]
+        waited = (time.monotonic() - request.enqueued_at) * 1000
+        stats[0] += 1
+        stats[1] += waited
+        stats[2] = max(stats[2], waited)
+
+        for attempt in range(self.max_retries + 1):
+            await chat.bucket.acquire()
+            await self._global.acquire()
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            try:
+                result = await request.make_request(request.bot, request.method)
+            except TelegramRetryAfter as e:
+                self.rate_limited += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                logger.warning(f"Flood limit for chat {chat.chat_id}, pausing outbound queue for {e.retry_after}s")
+                if attempt < self.max_retries:
+                    continue
+                error = e
+            except Exception as e:
+                error = e
+            else:
+                self.sent += 1
+                if not request.future.done():
+                    request.future.set_result(result)
+                return
+            break
+
+        self.failed += 1
+        if not request.future.done():
+            request.future.set_exception(error)
+
+    def stats(self) -> dict:
+        """Статистика очереди
+
+        Returns:
+            dict: Текущая и максимальная глубина, число ожиданий места в очереди,
+                отправленные и неудачные запросы, ответы 429 и ожидание
+                в очереди по приоритетам (мс)
+        """
+        return {
+            'depth': self._pending,
+            'max_depth': self.max_depth,
+            'ready_chats': self._ready.qsize() if self._ready else 0,
+            'blocked': self.blocked,
+            'sent': self.sent,
+            'failed': self.failed,
+            'rate_limited': self.rate_limited,
+            'paused': max(0.0, round(self._paused_until - time.monotonic(), 2)),
+            'wait_ms': {
+                name: {
+                    'count': count,
+                    'avg': round(total / count, 2) if count else 0.0,
+                    'max': round(maximum, 2)
+                }
+                for name, (count, total, maximum) in self.wait_ms.items()
+            }
+        }
@@ -0,0 +1,137 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, List, Optional
+
+from utils.logger import logger
+
+
+class PendingChat:
+    """Чат в очереди ожидания менеджера"""
+
+    __slots__ = ('client_id', 'username', 'enqueued_at')
+
+    def __init__(self, client_id: int, username: Optional[str], enqueued_at: float):
+        self.client_id = client_id
+        self.username = username
+        self.enqueued_at = enqueued_at
+
+    def wait_time(self, now: Optional[float] = None) -> float:
+        """Время ожидания в секундах"""
+        return max(0.0, (now or time.time()) - self.enqueued_at)
+
+
+class PendingChatQueue:
+    """Очередь ожидающих чатов в порядке поступления
+
+    Дублирует строки chats со статусом 'pending' и временем постановки
+    enqueued_at: самый старый чат и время ожидания любого чата
+    определяются за O(1) без запросов к базе. Очередь обновляется
+    методами Database, меняющими статус чата, и восстанавливается из
+    таблицы chats при запуске. Подписчики (см. subscribe) вызываются
+    при поступлении нового чата в потоке, выполнившем запись.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chats = OrderedDict()  # client_id -> PendingChat в порядке enqueued_at
+        self._listeners: List[Callable[[PendingChat], None]] = []
+
+        # Статистика
+        self.enqueued = 0
+        self.dequeued = 0
+        self.max_depth = 0
+        self.max_wait = 0.0
+        self.total_wait = 0.0
+
+    def load(self, rows: Iterable[tuple]):
+        """Заполнение строками (client_id, username, enqueued_at), упорядоченными по enqueued_at"""
+        now = time.time()
+        with self._lock:
+            self._chats.clear()
+            for client_id, username, enqueued_at in rows:
+                self._chats[client_id] = PendingChat(client_id, username, enqueued_at or now)
+            self.max_depth = max(self.max_depth, len(self._chats))
+        logger.info(f"Pending chat queue loaded: {len(self._chats)} chats")
+
+    def subscribe(self, listener: Callable[[PendingChat], None]):
+        """Подписка на поступление новых чатов в очередь"""
+        self._listeners.append(listener)
+
+    def push(self, client_id: int, username: Optional[str], enqueued_at: float) -> bool:
+        """Постановка чата в конец очереди
+
+        Повторный запрос клиента, уже стоящего в очереди, не меняет его места.
+
+        Returns:
+            bool: True, если чат добавлен в очередь
+        """
+        with self._lock:
+            if client_id in self._chats:
+                return False
+            chat = PendingChat(client_id, username, enqueued_at)
+            self._chats[client_id] = chat
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, len(self._chats))
+
+        for listener in self._listeners:
+            try:
+                listener(chat)
+            except Exception as e:
+                logger.error(f"Error in pending queue listener: {e}")
+        return True
+
+    def remove(self, client_id: int) -> Optional[float]:
+        """Удаление чата из очереди (принят или закрыт)
+
+        Returns:
+            float: Время ожидания чата в секундах или None, если чата не было в очереди
+        """
+        with self._lock:
+            chat = self._chats.pop(client_id, None)
+            if chat is None:
+                return None
+            wait = chat.wait_time()
+            self.dequeued += 1
+            self.max_wait = max(self.max_wait, wait)
+            self.total_wait += wait
+            return wait
+
+    def oldest(self) -> Optional[PendingChat]:
+        """Чат, дольше всех ожидающий менеджера"""
+        with self._lock:
+            return next(iter(self._chats.values()), None)
+
+    def get(self, client_id: int) -> Optional[PendingChat]:
+        with self._lock:
+            return self._chats.get(client_id)
+
+    def chats(self) -> List[PendingChat]:
+        """Все ожидающие чаты, начиная с самого старого"""
+        with self._lock:
+            return list(self._chats.values())
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    def __contains__(self, client_id: int) -> bool:
+        return client_id in self._chats
+
+    def stats(self) -> dict:
+        """Статистика очереди
+
+        Returns:
+            dict: Текущая и максимальная длина, ожидание самого старого чата
+                и время ожидания принятых чатов (сек)
+        """
+        with self._lock:
+            oldest = next(iter(self._chats.values()), None)
+            return {
+                'depth': len(self._chats),
+                'max_depth': self.max_depth,
+                'enqueued': self.enqueued,
+                'dequeued': self.dequeued,
+                'oldest_wait': round(oldest.wait_time(), 1) if oldest else 0.0,
+                'max_wait': round(self.max_wait, 1),
+                'avg_wait': round(self.total_wait / self.dequeued, 1) if self.dequeued else 0.0
+            }
@@ -0,0 +1,214 @@
+import inspect
+from typing import Callable, Iterable, Optional
+
+from aiogram import Dispatcher, types
+
+from utils.logger import logger
+
+
+class _Route:
+    """Маршрут: обработчик, роль и необязательное дополнительное условие"""
+
+    __slots__ = ('order', 'handler', 'role', 'guard', 'match')
+
+    def __init__(self, order: int, handler: Callable, role: Optional[str] = None,
+                 guard: Optional[Callable] = None, match: Optional[Callable] = None):
+        self.order = order
+        self.handler = handler
+        self.role = role
+        self.guard = guard
+        self.match = match
+
+
+async def _check(result) -> bool:
+    """Результат условия маршрута; условия могут быть асинхронными"""
+    if inspect.isawaitable(result):
+        result = await result
+    return bool(result)
+
+
+class _RoleCheck:
+    """Проверка ролей пользователя в рамках одного обновления
+
+    Роль администратора запрашивается не больше одного раза и только
+    если ее требует один из маршрутов-кандидатов. Проверка может быть
+    асинхронной (например, через контекст обновления).
+    """
+
+    __slots__ = ('user_id', '_managers', '_is_admin', '_admin')
+
+    def __init__(self, user_id: int, managers, is_admin: Optional[Callable]):
+        self.user_id = user_id
+        self._managers = managers
+        self._is_admin = is_admin
+        self._admin = None
+
+    async def has(self, role: Optional[str]) -> bool:
+        if role is None:
+            return True
+        if role == MessageRouter.MANAGER:
+            return self.user_id in self._managers
+        if role == MessageRouter.ADMIN:
+            if self._admin is None:
+                self._admin = self._is_admin is not None and await _check(self._is_admin(self.user_id))
+            return self._admin
+        return False
+
+
+class _PrefixTrie:
+    """Префиксное дерево для маршрутов вида text.startswith(...)"""
+
+    __slots__ = ('_root',)
+
+    def __init__(self):
+        # Узел: {символ: узел}, маршруты узла хранятся под ключом None
+        self._root = {}
+
+    def add(self, prefix: str, route: _Route):
+        node = self._root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node.setdefault(None, []).append(route)
+
+    def match(self, text: str) -> list:
+        """Все маршруты, префикс которых является началом текста"""
+        routes = list(self._root.get(None, ()))
+        node = self._root
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                break
+            routes.extend(node.get(None, ()))
+        return routes
+
+
+class MessageRouter:
+    """Таблица маршрутизации текстовых сообщений
+
+    Заменяет цепочку фильтров @dp.message(lambda ...), которую aiogram
+    проверяет по порядку для каждого обновления. Точные тексты кнопок
+    ищутся по словарю, префиксы - по префиксному дереву, поэтому
+    обработчик находится за один проход без обращений к базе данных.
+
+    Статические маршруты (точный текст и префикс) проверяются раньше
+    динамических (значения из базы и произвольные условия), внутри
+    каждой группы соблюдается порядок регистрации. Роль администратора
+    запрашивается не более одного раза за обновление. Условия маршрутов
+    и проверка роли могут быть как обычными, так и асинхронными функциями.
+    """
+
+    MANAGER = 'manager'
+    ADMIN = 'admin'
+
+    def __init__(self, managers: Iterable[int] = (), is_admin: Optional[Callable] = None):
+        self.managers = frozenset(managers)
+        self.is_admin = is_admin
+        self._exact = {}
+        self._prefixes = _PrefixTrie()
+        self._dynamic = []
+        self._fallback: Optional[_Route] = None
+        self._order = 0
+
+        # Статистика маршрутизации
+        self.resolved = {'exact': 0, 'prefix': 0, 'dynamic': 0, 'fallback': 0}
+
+    def _route(self, handler: Callable, role: Optional[str], guard: Optional[Callable],
+               match: Optional[Callable] = None) -> _Route:
+        self._order += 1
+        return _Route(self._order, handler, role, guard, match)
+
+    def exact(self, text: str, role: Optional[str] = None, guard: Optional[Callable] = None):
+        """Маршрут для сообщения с точно совпадающим текстом"""
+        def decorator(handler):
+            self._exact.setdefault(text, []).append(self._route(handler, role, guard))
+            return handler
+        return decorator
+
+    def prefix(self, prefix: str, role: Optional[str] = None, guard: Optional[Callable] = None):
+        """Маршрут для сообщения, текст которого начинается с prefix"""
+        def decorator(handler):
+            self._prefixes.add(prefix, self._route(handler, role, guard))
+            return handler
+        return decorator
+
+    def member(self, values: Callable[[types.Message], Iterable[str]], role: Optional[str] = None):
+        """Маршрут для сообщения, текст которого входит в набор значений
+
+        Args:
+            values: Функция, возвращающая допустимые тексты для сообщения
+                (например, список городов или категорий из базы данных)
+        """
+        def decorator(handler):
+            async def match(message):
+                if message.text is None:
+                    return False
+                choices = values(message)
+                if inspect.isawaitable(choices):
+                    choices = await choices
+                return message.text in choices
+            route = self._route(handler, role, None, match)
+            self._dynamic.append(route)
+            return handler
+        return decorator
+
+    def when(self, predicate: Callable[[types.Message], bool], role: Optional[str] = None):
+        """Маршрут с произвольным условием"""
+        def decorator(handler):
+            self._dynamic.append(self._route(handler, role, None, predicate))
+            return handler
+        return decorator
+
+    def fallback(self, handler: Callable):
+        """Обработчик сообщений, не подошедших ни под один маршрут"""
+        self._fallback = self._route(handler, None, None)
+        return handler
+
+    async def resolve(self, message: types.Message) -> Optional[Callable]:
+        """Поиск обработчика для сообщения
+
+        Returns:
+            Callable: Обработчик или None, если обработчик по умолчанию не задан
+        """
+        roles = _RoleCheck(message.from_user.id, self.managers, self.is_admin)
+        text = message.text
+
+        if text is not None:
+            exact = self._exact.get(text, ())
+            prefixed = self._prefixes.match(text)
+            candidates = sorted((*exact, *prefixed), key=lambda route: route.order) if prefixed else exact
+            for route in candidates:
+                if await roles.has(route.role) and (route.guard is None or await _check(route.guard(message))):
+                    self.resolved['prefix' if route in prefixed else 'exact'] += 1
+                    return route.handler
+
+        for route in self._dynamic:
+            if await roles.has(route.role) and await _check(route.match(message)):
+                self.resolved['dynamic'] += 1
+                return route.handler
+
+        if self._fallback is not None:
+            self.resolved['fallback'] += 1
+            return self._fallback.handler
+        return None
+
+    def attach(self, dp: Dispatcher):
+        """Регистрация единственного обработчика сообщений в диспетчере"""
+        @dp.message()
+        async def dispatch_message(message: types.Message):
+            handler = await self.resolve(message)
+            if handler is None:
+                logger.warning(f"No route for message from user {message.from_user.id}")
+                return
+            await handler(message)
+
+    def stats(self) -> dict:
+        """Статистика маршрутизации
+
+        Returns:
+            dict: Количество сообщений, обработанных каждым типом маршрутов
+        """
+        return {
+            'exact_routes': sum(len(routes) for routes in self._exact.values()),
+            'dynamic_routes': len(self._dynamic),
+            'resolved': dict(self.resolved)
+        }
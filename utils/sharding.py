@@ -0,0 +1,353 @@
+"""Многопроцессный режим: распределение обновлений по процессам-обработчикам
+
+Процесс-приемник получает обновления (polling или webhook) и передает
+каждое обновление процессу-обработчику с номером jump_hash(from_user.id, N)
+через Unix-сокет. Все обновления одного пользователя попадают в один
+процесс и обрабатываются в нем по порядку, поэтому состояние пользователя
+(навигация по каталогу, контекст обновления) остается локальным.
+
+Общие данные хранятся в базе. Изменения, которые процессы дублируют в
+памяти (активные чаты, очередь ожидающих чатов, нагрузка менеджеров, кэш
+справочников), процесс-обработчик публикует через
+Database.subscribe_changes(), приемник рассылает их остальным
+обработчикам, и те применяют их через Database.apply_change().
+
+Протокол - JSON-сообщения, по одному в строке:
+    обработчик -> приемник: {"shard": i} при подключении, {"event": [kind, key]}
+    приемник -> обработчик: {"update": {...}}, {"event": [kind, key]}, {"stop": true}
+"""
+import asyncio
+import json
+import os
+import signal
+import sys
+import tempfile
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from utils.logger import logger
+
+
+# Максимальная длина одного сообщения протокола
+_LINE_LIMIT = 4 * 1024 * 1024
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Согласованное хеширование (Lamping, Veach)
+
+    При изменении числа процессов на другой процесс переезжает только
+    часть пользователей, пропорциональная изменению.
+    """
+    key &= 0xFFFFFFFFFFFFFFFF
+    bucket, j = -1, 0
+    while j < buckets:
+        bucket = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def update_user_id(update: dict) -> int:
+    """ID пользователя, от которого пришло обновление (0, если его нет)"""
+    for key, payload in update.items():
+        if key == 'update_id' or not isinstance(payload, dict):
+            continue
+        user = payload.get('from') or payload.get('user') or payload.get('chat')
+        if user is None and isinstance(payload.get('message'), dict):
+            user = payload['message'].get('chat')
+        if isinstance(user, dict):
+            return user.get('id', 0)
+    return 0
+
+
+def _encode(message: dict) -> bytes:
+    return json.dumps(message, ensure_ascii=False, separators=(',', ':')).encode() + b'\n'
+
+
+class ShardFront:
+    """Процесс-приемник: запускает обработчики и распределяет между ними обновления"""
+
+    def __init__(self, workers: int, command: List[str], socket_path: str = "",
+                 connect_timeout: float = 60.0):
+        """
+        Args:
+            workers: Количество процессов-обработчиков
+            command: Команда запуска обработчика (номер и сокет передаются
+                в переменных окружения SHARD_INDEX и SHARD_SOCKET)
+            socket_path: Путь Unix-сокета (по умолчанию во временном каталоге)
+            connect_timeout: Ожидание подключения всех обработчиков (сек)
+        """
+        self.workers = workers
+        self.command = command
+        self.socket_path = socket_path or os.path.join(tempfile.mkdtemp(prefix='support-bot-'), 'shards.sock')
+        self.connect_timeout = connect_timeout
+
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._processes: Dict[int, asyncio.subprocess.Process] = {}
+        self._writers: Dict[int, asyncio.StreamWriter] = {}
+        self._connected: Dict[int, asyncio.Event] = {}
+        self._watchers = []
+        self._closing = False
+
+        # Статистика
+        self.forwarded = [0] * workers
+        self.events = 0
+        self.restarts = 0
+
+    async def start(self):
+        """Запуск сервера сокета и процессов-обработчиков"""
+        self._connected = {index: asyncio.Event() for index in range(self.workers)}
+        self._server = await asyncio.start_unix_server(self._on_connect, path=self.socket_path, limit=_LINE_LIMIT)
+        for index in range(self.workers):
+            await self._spawn(index)
+        await asyncio.wait_for(
+            asyncio.gather(*(event.wait() for event in self._connected.values())),
+            self.connect_timeout
+        )
+        logger.info(f"Shard front started: {self.workers} workers on {self.socket_path}")
+
+    async def _spawn(self, index: int):
+        env = dict(os.environ, SHARD_INDEX=str(index), SHARD_SOCKET=self.socket_path)
+        process = await asyncio.create_subprocess_exec(*self.command, env=env)
+        self._processes[index] = process
+        self._watchers.append(asyncio.create_task(self._watch(index, process)))
+
+    async def _watch(self, index: int, process: asyncio.subprocess.Process):
+        code = await process.wait()
+        if self._closing:
+            return
+        # Обработчик упал - запускаем заново, обновления для него ждут подключения
+        logger.error(f"Shard worker {index} exited with code {code}, restarting")
+        self._connected[index].clear()
+        self._writers.pop(index, None)
+        self.restarts += 1
+        await self._spawn(index)
+
+    async def _on_connect(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        hello = json.loads(await reader.readline())
+        index = hello['shard']
+        self._writers[index] = writer
+        self._connected[index].set()
+        logger.info(f"Shard worker {index} connected")
+
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            if 'event' in message:
+                self.events += 1
+                data = _encode(message)
+                for other, other_writer in list(self._writers.items()):
+                    if other != index:
+                        other_writer.write(data)
+        if self._writers.get(index) is writer:
+            self._writers.pop(index, None)
+            self._connected[index].clear()
+
+    async def forward(self, update: Update):
+        """Передача обновления процессу-обработчику пользователя
+
+        Если соединение с обработчиком оборвалось, обновление отправляется
+        повторно после его перезапуска и подключения.
+        """
+        data = update.model_dump(mode='json', exclude_none=True)
+        index = jump_hash(update_user_id(data), self.workers)
+        line = _encode({'update': data})
+        while True:
+            await self._connected[index].wait()
+            writer = self._writers[index]
+            try:
+                writer.write(line)
+                await writer.drain()
+                break
+            except ConnectionError as e:
+                logger.warning(f"Shard worker {index} connection lost, resending update {update.update_id}: {e}")
+                if self._writers.get(index) is writer:
+                    self._writers.pop(index, None)
+                    self._connected[index].clear()
+        self.forwarded[index] += 1
+
+    async def run_polling(self, bot: Bot, allowed_updates: List[str], timeout: int = 30):
+        """Получение обновлений через getUpdates до получения SIGTERM/SIGINT"""
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+
+        async def poll():
+            offset = None
+            while True:
+                try:
+                    updates = await bot.get_updates(offset=offset, timeout=timeout, allowed_updates=allowed_updates)
+                except Exception as e:
+                    logger.error(f"Error getting updates: {e}")
+                    await asyncio.sleep(1)
+                    continue
+                for update in updates:
+                    try:
+                        await self.forward(update)
+                    except Exception as e:
+                        logger.error(f"Error forwarding update {update.update_id}: {e}")
+                    offset = update.update_id + 1
+
+        task = asyncio.create_task(poll())
+        try:
+            await stop.wait()
+        finally:
+            task.cancel()
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                loop.remove_signal_handler(sig)
+
+    async def close(self, timeout: float = 30.0):
+        """Остановка обработчиков после обработки переданных им обновлений"""
+        self._closing = True
+        for writer in self._writers.values():
+            writer.write(_encode({'stop': True}))
+        for process in self._processes.values():
+            try:
+                await asyncio.wait_for(process.wait(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Shard worker {process.pid} did not stop in time, terminating")
+                process.terminate()
+        for task in self._watchers:
+            task.cancel()
+        if self._server is not None:
+            self._server.close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        logger.info(f"Shard front stopped, updates per worker: {self.forwarded}")
+
+    def stats(self) -> dict:
+        """Статистика распределения обновлений"""
+        return {
+            'workers': self.workers,
+            'connected': len(self._writers),
+            'forwarded': list(self.forwarded),
+            'events': self.events,
+            'restarts': self.restarts
+        }
+
+
+class ShardWorker:
+    """Процесс-обработчик: выполняет обновления своей доли пользователей
+
+    Обновления одного пользователя выполняются строго по очереди,
+    обновления разных пользователей - параллельно (не больше
+    max_concurrency одновременно).
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, db, index: int, socket_path: str,
+                 max_concurrency: int = 32):
+        self.dp = dp
+        self.bot = bot
+        self.db = db
+        self.index = index
+        self.socket_path = socket_path
+        self.max_concurrency = max_concurrency
+
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lanes: Dict[int, deque] = {}
+        self._tasks = set()
+        self._slots: Optional[asyncio.Semaphore] = None
+
+        # Статистика
+        self.processed = 0
+        self.errors = 0
+        self.events_applied = 0
+        self.total_process_ms = 0.0
+
+    def _on_change(self, kind: str, key):
+        """Подписчик изменений базы; вызывается в потоке, выполнившем запись"""
+        self._loop.call_soon_threadsafe(self._send, {'event': [kind, key]})
+
+    def _send(self, message: dict):
+        if self._writer is not None and not self._writer.is_closing():
+            self._writer.write(_encode(message))
+
+    async def run(self):
+        """Подключение к приемнику и обработка обновлений до команды остановки"""
+        self._loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        # Ctrl+C в терминале получает вся группа процессов - останавливает нас приемник
+        self._loop.add_signal_handler(signal.SIGINT, lambda: None)
+
+        reader, self._writer = await asyncio.open_unix_connection(self.socket_path, limit=_LINE_LIMIT)
+        self.db.subscribe_changes(self._on_change)
+        self._send({'shard': self.index})
+        logger.info(f"Shard worker {self.index} started (pid {os.getpid()})")
+
+        workflow_data = {'dispatcher': self.dp, **self.dp.workflow_data}
+        workflow_data.pop('bot', None)
+        await self.dp.emit_startup(bot=self.bot, **workflow_data)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                if 'update' in message:
+                    self._enqueue(message['update'])
+                elif 'event' in message:
+                    kind, key = message['event']
+                    self.db.apply_change(kind, key)
+                    self.events_applied += 1
+                elif message.get('stop'):
+                    break
+            if self._tasks:
+                await asyncio.wait(set(self._tasks))
+        finally:
+            await self.dp.emit_shutdown(bot=self.bot, **workflow_data)
+            self._writer.close()
+            logger.info(f"Shard worker {self.index} stopped, {self.processed} updates processed")
+
+    def _enqueue(self, data: dict):
+        user_id = update_user_id(data)
+        lane = self._lanes.get(user_id)
+        if lane is not None:
+            lane.append(data)
+            return
+        self._lanes[user_id] = deque([data])
+        task = asyncio.create_task(self._run_lane(user_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_lane(self, user_id: int):
+        lane = self._lanes[user_id]
+        try:
+            while lane:
+                data = lane[0]
+                async with self._slots:
+                    start_time = time.monotonic()
+                    try:
+                        update = Update.model_validate(data, context={'bot': self.bot})
+                        await self.dp.feed_update(self.bot, update)
+                    except Exception as e:
+                        self.errors += 1
+                        logger.error(f"Error processing update for user {user_id}: {e}")
+                    self.processed += 1
+                    self.total_process_ms += (time.monotonic() - start_time) * 1000
+                lane.popleft()
+        finally:
+            del self._lanes[user_id]
+
+    def stats(self) -> dict:
+        """Статистика процесса-обработчика"""
+        return {
+            'shard': self.index,
+            'processed': self.processed,
+            'errors': self.errors,
+            'events_applied': self.events_applied,
+            'active_users': len(self._lanes),
+            'avg_process_ms': round(self.total_process_ms / self.processed, 2) if self.processed else 0.0
+        }
+
+
+def worker_command() -> List[str]:
+    """Команда запуска процесса-обработчика: тот же скрипт тем же интерпретатором"""
+    return [sys.executable, os.path.abspath(sys.argv[0])]
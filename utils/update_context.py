@@ -0,0 +1,93 @@
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message, TelegramObject
+
+
+_current_context: ContextVar[Optional['UpdateContext']] = ContextVar('update_context', default=None)
+
+
+class UpdateContext:
+    """Состояние пользователя в рамках одного обновления
+
+    Активный чат и собеседник берутся из таблицы маршрутизации без
+    обращения к базе. Оценка и признак администратора загружаются одним
+    запросом при первом обращении и дальше используются фильтрами
+    маршрутизатора и обработчиками без повторных запросов.
+    """
+
+    __slots__ = ('user_id', 'is_manager', '_db', '_loaded', '_rating', '_is_admin')
+
+    def __init__(self, user_id: int, is_manager: bool, db):
+        self.user_id = user_id
+        self.is_manager = is_manager
+        self._db = db
+        self._loaded = False
+        self._rating = None
+        self._is_admin = False
+
+    @staticmethod
+    def current() -> Optional['UpdateContext']:
+        """Контекст обновления, обрабатываемого в текущей задаче"""
+        return _current_context.get()
+
+    async def _load(self):
+        if not self._loaded:
+            self._rating, self._is_admin = await self._db.get_user_state(self.user_id)
+            self._loaded = True
+
+    def in_active_chat(self) -> bool:
+        """Есть ли у пользователя активный чат (у клиента - свой, у менеджера - любой)"""
+        if self.is_manager:
+            return self._db.routing.focused_client(self.user_id) is not None
+        return self._db.routing.is_active(self.user_id)
+
+    def peer(self) -> Optional[int]:
+        """Собеседник: менеджер для клиента, текущий клиент для менеджера"""
+        if self.is_manager:
+            return self._db.routing.focused_client(self.user_id)
+        return self._db.routing.manager_of(self.user_id)
+
+    async def get_rating(self) -> Optional[tuple]:
+        """Оценка текущего обращения клиента (rating, comment, rated_at) или None"""
+        await self._load()
+        return self._rating
+
+    async def is_admin(self) -> bool:
+        await self._load()
+        return self._is_admin
+
+    def invalidate(self):
+        """Сброс загруженного состояния после изменений в этом же обновлении"""
+        self._loaded = False
+
+
+class UpdateContextMiddleware(BaseMiddleware):
+    """Создает UpdateContext для каждого входящего сообщения
+
+    Контекст передается обработчикам в аргументе ctx и доступен
+    фильтрам через UpdateContext.current().
+    """
+
+    def __init__(self, db, managers: Iterable[int]):
+        self.db = db
+        self.managers = frozenset(managers)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if not isinstance(event, Message) or event.from_user is None:
+            return await handler(event, data)
+
+        user_id = event.from_user.id
+        ctx = UpdateContext(user_id, user_id in self.managers, self.db)
+        data['ctx'] = ctx
+        token = _current_context.set(ctx)
+        try:
+            return await handler(event, data)
+        finally:
+            _current_context.reset(token)
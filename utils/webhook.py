@@ -0,0 +1,216 @@
+import asyncio
+import hmac
+import signal
+import time
+from typing import Awaitable, Callable, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+from utils.logger import logger
+
+
+class WebhookServer:
+    """Прием обновлений от Telegram через webhook (aiohttp)
+
+    Альтернатива long polling: Telegram сам отправляет обновления на
+    адрес бота, поэтому несколько экземпляров можно поставить за
+    балансировщиком нагрузки.
+
+    - Запросы без правильного заголовка X-Telegram-Bot-Api-Secret-Token
+      отклоняются (401).
+    - Обновление подтверждается сразу после разбора, обработка идет в
+      фоне; одновременно обрабатывается не больше max_concurrency
+      обновлений, при заполнении ответ Telegram задерживается до
+      освобождения места.
+    - По SIGTERM/SIGINT сервер перестает принимать обновления (503 на
+      webhook и /healthz, чтобы балансировщик снял экземпляр с нагрузки),
+      закрывает порт, дожидается уже начатых запросов и затем обработки
+      всех принятых обновлений; на все вместе отводится drain_timeout секунд.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, path: str = "/webhook", secret: str = "",
+                 max_concurrency: int = 32, drain_timeout: float = 30.0,
+                 process: Optional[Callable[[Update], Awaitable]] = None):
+        """
+        Args:
+            process: Обработка принятого обновления; по умолчанию
+                dp.feed_update (в многопроцессном режиме - передача в процесс-обработчик)
+        """
+        self.dp = dp
+        self.bot = bot
+        self.process = process or (lambda update: dp.feed_update(bot, update))
+        self.path = path
+        self.secret = secret
+        self.max_concurrency = max_concurrency
+        self.drain_timeout = drain_timeout
+
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tasks = set()
+        self._draining = False
+        self._stopped: Optional[asyncio.Event] = None
+
+        # Метрики
+        self.received = 0
+        self.rejected = 0
+        self.errors = 0
+        self.max_in_flight = 0
+        self.last_ingest_ms = 0.0
+        self.max_ingest_ms = 0.0
+        self.total_ingest_ms = 0.0
+        self.total_process_ms = 0.0
+        self.processed = 0
+
+    def create_app(self) -> web.Application:
+        """Приложение aiohttp с маршрутами webhook и проверки состояния"""
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._stopped = asyncio.Event()
+        app = web.Application()
+        app.router.add_post(self.path, self._handle_update)
+        app.router.add_get("/healthz", self._handle_health)
+        return app
+
+    async def _handle_health(self, request: web.Request) -> web.Response:
+        if self._draining:
+            return web.json_response({'status': 'draining', **self.stats()}, status=503)
+        return web.json_response({'status': 'ok', **self.stats()})
+
+    async def _handle_update(self, request: web.Request) -> web.Response:
+        start_time = time.monotonic()
+        if self._draining:
+            # Telegram повторит доставку, балансировщик направит ее другому экземпляру
+            return web.Response(status=503)
+
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if self.secret and not hmac.compare_digest(token, self.secret):
+            self.rejected += 1
+            logger.warning(f"Rejected webhook request from {request.remote}: invalid secret token")
+            return web.Response(status=401)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            self.rejected += 1
+            logger.warning(f"Rejected malformed webhook update: {e}")
+            return web.Response(status=400)
+
+        # Ждем свободного места, не подтверждая обновление (обратное давление на Telegram)
+        await self._slots.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self.received += 1
+        self.max_in_flight = max(self.max_in_flight, len(self._tasks))
+
+        elapsed_ms = (time.monotonic() - start_time) * 1000
+        self.last_ingest_ms = round(elapsed_ms, 2)
+        self.max_ingest_ms = max(self.max_ingest_ms, self.last_ingest_ms)
+        self.total_ingest_ms += elapsed_ms
+        return web.Response()
+
+    async def _process(self, update: Update):
+        start_time = time.monotonic()
+        try:
+            await self.process(update)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Error processing update {update.update_id}: {e}")
+        finally:
+            self._slots.release()
+            self.processed += 1
+            self.total_process_ms += (time.monotonic() - start_time) * 1000
+
+    def stop(self):
+        """Перевод сервера в режим завершения (вызывается по сигналу)"""
+        if not self._draining:
+            logger.info("Webhook server is draining")
+            self._draining = True
+            self._stopped.set()
+
+    async def drain(self, timeout: Optional[float] = None):
+        """Ожидание обработки уже принятых обновлений
+
+        Вызывается после остановки приема запросов, иначе запрос, ожидающий
+        свободного места, может добавить задачу уже после начала ожидания.
+        """
+        if not self._tasks:
+            return
+        logger.info(f"Waiting for {len(self._tasks)} updates in progress")
+        done, pending = await asyncio.wait(
+            set(self._tasks), timeout=self.drain_timeout if timeout is None else timeout
+        )
+        if pending:
+            logger.warning(f"Drain timeout: cancelling {len(pending)} unfinished updates")
+            for task in pending:
+                task.cancel()
+
+    async def run(self, host: str = "0.0.0.0", port: int = 8080, webhook_url: str = ""):
+        """Запуск сервера до получения SIGTERM/SIGINT
+
+        Args:
+            host: Адрес для входящих соединений
+            port: Порт
+            webhook_url: Публичный адрес webhook; если указан, регистрируется
+                в Telegram вместе с секретным токеном
+        """
+        app = self.create_app()
+        # Запросы, начатые до остановки, ждем не дольше drain_timeout
+        runner = web.AppRunner(app, shutdown_timeout=self.drain_timeout)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except NotImplementedError:
+                pass
+
+        workflow_data = {'dispatcher': self.dp, **self.dp.workflow_data}
+        workflow_data.pop('bot', None)
+        await self.dp.emit_startup(bot=self.bot, **workflow_data)
+        try:
+            await site.start()
+            if webhook_url:
+                await self.bot.set_webhook(
+                    webhook_url,
+                    secret_token=self.secret or None,
+                    allowed_updates=self.dp.resolve_used_update_types(),
+                    max_connections=self.max_concurrency
+                )
+            logger.info(f"Webhook server listening on {host}:{port}{self.path}")
+            await self._stopped.wait()
+        finally:
+            # Webhook не удаляем: обновления продолжают получать другие экземпляры.
+            # Сначала закрываем порт и дожидаемся начатых запросов - после этого
+            # новых задач не появится, - и только потом ждем сами задачи
+            deadline = loop.time() + self.drain_timeout
+            await runner.cleanup()
+            await self.drain(max(0.0, deadline - loop.time()))
+            await self.dp.emit_shutdown(bot=self.bot, **workflow_data)
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                try:
+                    loop.remove_signal_handler(sig)
+                except NotImplementedError:
+                    pass
+            logger.info(f"Webhook server stopped, {self.processed} updates processed")
+
+    def stats(self) -> dict:
+        """Статистика приема обновлений
+
+        Returns:
+            dict: Принятые, отклоненные и обрабатываемые обновления, задержка
+                подтверждения и средняя длительность обработки (мс)
+        """
+        return {
+            'received': self.received,
+            'rejected': self.rejected,
+            'errors': self.errors,
+            'in_flight': len(self._tasks),
+            'max_in_flight': self.max_in_flight,
+            'last_ingest_ms': self.last_ingest_ms,
+            'max_ingest_ms': self.max_ingest_ms,
+            'avg_ingest_ms': round(self.total_ingest_ms / self.received, 2) if self.received else 0.0,
+            'avg_process_ms': round(self.total_process_ms / self.processed, 2) if self.processed else 0.0
+        }